@@ -0,0 +1,643 @@
+"""
+Nucleo di calcolo dell'analisi dell'income statement, indipendente da Streamlit.
+
+Contiene la configurazione del mapping, la valutazione (vettoriale) delle
+espressioni di mapping e il calcolo di TTM (anche mobile, per ogni trimestre),
+variazioni Y/Y e margini. Essendo importabile senza eseguire l'interfaccia, può
+essere usato anche da process pool e job batch.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from column_index import build_column_index, normalize_column_name
+from expressions import compile_mapping_expr, is_mapping_expression, transform_expr
+from instrumentation import timed
+
+logger = logging.getLogger(__name__)
+
+###############################################
+# CONFIGURAZIONE – Income Statement Mapping
+###############################################
+
+config = {
+    "income_mapping": {
+        "Revenue": ["Total Revenue", "Operating Revenue"],
+        "Total COGS": ["Cost Of Revenue"],
+        "Gross Profit": ["Gross Profit"],
+        "SG&A": ["Selling General And Administration", "General & Administrative"],
+        "R&D": ["Research And Development"],
+        "S&M": ["Sales And Marketing", "Selling and Marketing", "Selling Expenses", "Marketing Expense"],
+        "Operating Income": ["Operating Income"],
+        "Pretax Income": ["Pretax Income"],
+        "Taxes": ["Income Tax Expense", "Taxes"],
+        "Net Income": ["Net Income"],
+        "EPS": ["Diluted EPS"],
+        "Net Interest Income": ["Net Non Operating Interest Income Expense", "Other Income Expense"]
+    }
+}
+
+###############################################
+# FUNZIONI DI MAPPING E VALUTAZIONE
+###############################################
+
+def _numeric_column(df, colname, fill_zero):
+    """Estrae una colonna come array float64 (NaN sostituiti da 0 se richiesto)."""
+    if colname not in df.columns:
+        return np.zeros(len(df)) if fill_zero else None
+    values = pd.to_numeric(df[colname], errors='coerce').to_numpy(dtype=float)
+    if fill_zero:
+        values = np.nan_to_num(values, nan=0.0)
+    return values
+
+def evaluate_mapping_columns(df, mapping_dict, on_error=logger.error, on_target_error=None):
+    """
+    Valuta il mapping su tutte le righe di df contemporaneamente.
+    Restituisce un dizionario target -> array float64 (uno per periodo) oppure None.
+    Gli errori di valutazione vengono segnalati, per ciascun target, tramite on_error
+    oppure, se indicata, tramite on_target_error(target, messaggio).
+    """
+    if on_target_error is None:
+        on_target_error = lambda target, msg: on_error(msg)
+    evaluated = {}
+    for target, expr in mapping_dict.items():
+        if expr is None:
+            evaluated[target] = None
+            continue
+        if is_mapping_expression(expr) and '`' not in expr:
+            expr = transform_expr(expr, list(df.columns))
+        if is_mapping_expression(expr):
+            try:
+                columns, evaluator = compile_mapping_expr(expr)
+                # Come nella valutazione riga per riga, i valori mancanti contano come 0
+                values = [_numeric_column(df, col, fill_zero=True) for col in columns]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    result = np.broadcast_to(evaluator(values), (len(df),)).astype(float)
+                invalid = ~np.isfinite(result)
+                if invalid.any():
+                    on_target_error(target, f"Errore nell'eval per {target} con '{expr}': divisione per zero "
+                                            f"in {int(invalid.sum())} periodi")
+                    result[invalid] = np.nan
+                evaluated[target] = result
+            except Exception as e:
+                on_target_error(target, f"Errore nell'eval per {target} con '{expr}': {e}")
+                evaluated[target] = None
+        else:
+            evaluated[target] = _numeric_column(df, expr, fill_zero=False)
+    return evaluated
+
+def evaluate_mapping_latest(df, mapping_dict, on_error=logger.error):
+    """
+    Valuta l'espressione (eventualmente aritmetica) definita per ciascuna voce sul record più recente.
+    """
+    evaluated = evaluate_mapping_columns(df.iloc[:1], mapping_dict, on_error)
+    return {target: (float(values[0]) if values is not None else None)
+            for target, values in evaluated.items()}
+
+@timed("mapping_eval")
+def compute_income_mapping_timeseries(df, mapping_dict, on_error=logger.error, on_target_error=None):
+    """Calcola il mapping per tutti i periodi con un'unica valutazione per colonna."""
+    evaluated = evaluate_mapping_columns(df, mapping_dict, on_error, on_target_error)
+    return pd.DataFrame(
+        {target: (values if values is not None else np.nan) for target, values in evaluated.items()},
+        index=df.index
+    )
+
+###############################################
+# TTM MOBILE DAI DATI TRIMESTRALI
+###############################################
+
+# Trimestri consecutivi che compongono un periodo TTM
+TTM_QUARTERS = 4
+
+# Voci non additive nel tempo, riconosciute dal nome normalizzato (la prima regola
+# che corrisponde vale). Le voci di flusso (ricavi, costi, utili) si sommano;
+# i numeri di azioni e le aliquote si mediano; i saldi di fine periodo usano
+# l'ultimo trimestre; le voci per azione (EPS) si ricalcolano come utile TTM su
+# azioni medie, oppure, se lo statement non le contiene, come somma dei quattro EPS.
+TTM_ITEM_KINDS = [
+    ("per_share", re.compile(r"\beps\b|\bper share\b")),
+    ("last", re.compile(r"\boutstanding\b|\bbalance\b|\bend of period\b")),
+    ("average", re.compile(r"\bshare\b|\brate\b|\bratio\b|\bmargin\b")),
+]
+
+# Utile e azioni medie da cui ricavare l'EPS TTM, per base di calcolo
+PER_SHARE_BASES = {
+    "diluted": (["Diluted NI Availto Com Stockholders", "Net Income Common Stockholders", "Net Income"],
+                ["Diluted Average Shares"]),
+    "basic": (["Net Income Common Stockholders", "Net Income"], ["Basic Average Shares"]),
+}
+
+@lru_cache(maxsize=4096)
+def ttm_item_kind(column):
+    """Regola TTM di una voce: "flow", "average", "last" o "per_share"."""
+    key = normalize_column_name(column)
+    for kind, pattern in TTM_ITEM_KINDS:
+        if pattern.search(key):
+            return kind
+    return "flow"
+
+def period_months(index):
+    """
+    Mese progressivo (anno * 12 + mese) di ogni periodo, arrotondato al mese di
+    chiusura più vicino (trimestri fiscali a 52/53 settimane); NaN per i periodi non datati.
+    """
+    dates = pd.DatetimeIndex(pd.to_datetime(pd.Index(index), errors='coerce')) + pd.Timedelta(days=15)
+    return (dates.year * 12 + dates.month).to_numpy(dtype=float, na_value=np.nan)
+
+def _per_share_inputs(column, index):
+    """(utile, azioni medie) per ricalcolare una voce per azione, oppure None."""
+    basis = "basic" if "basic" in normalize_column_name(column).split() else "diluted"
+    income, shares = (index.resolve_candidates(candidates) for candidates in PER_SHARE_BASES[basis])
+    return (income[0], shares[0]) if income and shares else None
+
+@timed("ttm_build")
+def rolling_ttm(quarterly_income_statement, quarters=TTM_QUARTERS):
+    """
+    TTM mobile per ogni trimestre, calcolato con un'unica passata di finestre mobili
+    su tutte le voci. Restituisce un DataFrame con le stesse voci e i trimestri dal
+    più recente; i trimestri senza quattro trimestri consecutivi (buchi nella serie)
+    hanno tutti i valori NaN e una voce mancante in un trimestre rende NaN le finestre
+    che lo contengono, invece di produrre somme parziali.
+    """
+    months = period_months(quarterly_income_statement.index)
+    # Dal trimestre più vecchio; i periodi non datati in testa, fuori da ogni finestra valida
+    order = np.lexsort((months, ~np.isnan(months)))
+    ordered = quarterly_income_statement.iloc[order]
+    values = ordered.astype(float) if all(pd.api.types.is_numeric_dtype(dtype) for dtype in ordered.dtypes) \
+        else ordered.apply(pd.to_numeric, errors='coerce').astype(float)
+
+    # Finestra valida solo se i trimestri sono consecutivi (3 mesi l'uno dall'altro)
+    contiguous = pd.Series(months[order]).diff(quarters - 1).to_numpy() == 3 * (quarters - 1)
+
+    windows = values.rolling(quarters, min_periods=quarters)
+    sums = windows.sum()
+    means = windows.mean()
+    ttm = sums.copy()
+    kinds = {col: ttm_item_kind(col) for col in values.columns}
+    average = [col for col, kind in kinds.items() if kind == "average"]
+    last = [col for col, kind in kinds.items() if kind == "last"]
+    ttm[average] = means[average]
+    ttm[last] = values[last]
+
+    index = build_column_index(values.columns)
+    for col in (col for col, kind in kinds.items() if kind == "per_share"):
+        inputs = _per_share_inputs(col, index)
+        if inputs is not None:
+            income, shares = inputs
+            ttm[col] = sums[income] / means[shares].where(means[shares] != 0)
+
+    ttm.loc[~contiguous, :] = np.nan
+    return ttm.iloc[::-1]
+
+###############################################
+# METRICHE DERIVATE
+###############################################
+
+# Colonne finali dell'analisi, nell'ordine di visualizzazione
+OUTPUT_COLUMNS = [
+    "Revenue", "Total COGS", "Gross Profit", "SG&A", "R&D", "Operating Income",
+    "Pretax Income", "Taxes", "Tax Percentage", "Net Income", "EPS", "Net Interest Income",
+    "Net Margin", "Operating Margin", "Net Income Y/Y", "Revenue Y/Y", "Gross Margin"
+]
+
+# Voci monetarie (convertite in milioni per la visualizzazione)
+AMOUNT_COLUMNS = ["Revenue", "Total COGS", "Gross Profit", "SG&A", "R&D",
+                  "Operating Income", "Pretax Income", "Taxes", "Net Income", "Net Interest Income"]
+
+# Voci in percentuale
+PERCENT_COLUMNS = ["Gross Margin", "Revenue Y/Y", "Net Income Y/Y", "Tax Percentage", "Net Margin",
+                   "Operating Margin"]
+
+def _column(df, name):
+    """Colonna come Series float; se manca, una Series di NaN."""
+    if name in df.columns:
+        return pd.to_numeric(df[name], errors='coerce')
+    return pd.Series(np.nan, index=df.index)
+
+def _sum_ignoring_missing(*names):
+    return names, lambda df: sum(_column(df, name).fillna(0) for name in names)
+
+def _difference(minuend, subtrahend):
+    return (minuend, subtrahend), lambda df: _column(df, minuend) - _column(df, subtrahend)
+
+def _percentage(numerator, denominator):
+    """numerator / denominator * 100, NaN dove il denominatore è mancante o zero."""
+    def compute(df):
+        den = _column(df, denominator)
+        return _column(df, numerator) / den.where(den != 0) * 100
+    return (numerator, denominator), compute
+
+def _year_over_year(column):
+    """
+    Variazione % rispetto all'anno precedente. La riga TTM (in cima) si confronta
+    con il primo anno annuale.
+    """
+    def compute(df):
+        values = _column(df, column)
+        result = pd.Series(np.nan, index=df.index)
+        is_ttm = df.index.isin(["TTM"])
+
+        # Converti l'indice in datetime e ordina dal più vecchio al più recente:
+        # pct_change confronta ogni riga con la precedente
+        regular_years = values[~is_ttm]
+        regular_years.index = pd.to_datetime(regular_years.index, errors='coerce')
+        change = regular_years.sort_index(ascending=True).pct_change() * 100
+        result[~is_ttm] = change.reindex(regular_years.index).to_numpy()
+
+        if is_ttm.any() and len(df) > 1:
+            next_annual = values.iloc[1]
+            if pd.notna(next_annual) and next_annual != 0:
+                result[is_ttm] = ((values[is_ttm] / next_annual) - 1) * 100
+        return result
+    return (column,), compute
+
+def _same_quarter_last_year(column):
+    """
+    Variazione % rispetto allo stesso trimestre dell'anno precedente, cercato per data
+    (12 mesi prima) e non per posizione: i trimestri mancanti danno NaN.
+    """
+    def compute(df):
+        values = _column(df, column)
+        months = period_months(df.index)
+        lookup = pd.Series(values.to_numpy(), index=months)
+        lookup = lookup[lookup.index.notna() & ~lookup.index.duplicated()]
+        previous = lookup.reindex(months - 12).to_numpy()
+        previous = np.where(previous == 0, np.nan, previous)
+        return pd.Series((values.to_numpy() / previous - 1) * 100, index=df.index)
+    return (column,), compute
+
+# Ogni metrica è (colonna, modalità, colonne di input, funzione sulle colonne intere).
+# "fill" completa solo i periodi in cui il mapping non fornisce la voce, "set" la calcola sempre.
+
+# Voci calcolate quando il mapping non le fornisce, nell'ordine di valutazione
+DERIVED_METRICS = [
+    ("Gross Profit", "fill", *_difference("Revenue", "Total COGS")),
+    ("Operating Expenses", "set", *_sum_ignoring_missing("SG&A", "R&D", "S&M")),
+    ("Operating Income", "fill", *_difference("Gross Profit", "Operating Expenses")),
+    ("Taxes", "fill", *_difference("Pretax Income", "Net Income")),
+]
+
+GROWTH_METRICS = [
+    ("Revenue Y/Y", "set", *_year_over_year("Revenue")),
+    ("Net Income Y/Y", "set", *_year_over_year("Net Income")),
+]
+
+MARGIN_METRICS = [
+    ("Gross Margin", "set", *_percentage("Gross Profit", "Revenue")),
+    ("Net Margin", "set", *_percentage("Net Income", "Revenue")),
+    ("Operating Margin", "set", *_percentage("Operating Income", "Revenue")),
+    ("Tax Percentage", "set", *_percentage("Taxes", "Pretax Income")),
+]
+
+ANALYSIS_METRICS = DERIVED_METRICS + GROWTH_METRICS + MARGIN_METRICS
+
+# Analisi trimestrale: Y/Y sullo stesso trimestre dell'anno precedente
+QUARTERLY_GROWTH_METRICS = [
+    ("Revenue Y/Y", "set", *_same_quarter_last_year("Revenue")),
+    ("Net Income Y/Y", "set", *_same_quarter_last_year("Net Income")),
+]
+
+QUARTERLY_METRICS = DERIVED_METRICS + QUARTERLY_GROWTH_METRICS + MARGIN_METRICS
+
+def _build_dependents(metrics):
+    """Grafo delle dipendenze: colonna -> metriche che la usano come input."""
+    dependents = {}
+    for name, mode, inputs, _ in metrics:
+        for col in inputs:
+            dependents.setdefault(col, set()).add(name)
+        if mode == "fill":
+            # Una voce "fill" dipende anche dal valore mappato per la stessa colonna
+            dependents.setdefault(name, set()).add(name)
+    return dependents
+
+METRIC_DEPENDENTS = _build_dependents(ANALYSIS_METRICS)
+
+def affected_columns(changed_targets):
+    """Colonne da ricalcolare quando cambiano i target indicati (chiusura transitiva)."""
+    affected = set(changed_targets)
+    pending = list(changed_targets)
+    while pending:
+        for dependent in METRIC_DEPENDENTS.get(pending.pop(), ()):
+            if dependent not in affected:
+                affected.add(dependent)
+                pending.append(dependent)
+    return affected
+
+@timed("derived_metrics")
+def apply_metrics(df, metrics, base=None):
+    """
+    Applica in ordine le metriche su colonne intere. Le voci "fill" partono dai
+    valori mappati in base (di default df stesso).
+    """
+    base = df if base is None else base
+    for name, mode, _, compute in metrics:
+        values = compute(df)
+        if mode == "fill" and name in base.columns:
+            df[name] = _column(base, name).fillna(values)
+        else:
+            df[name] = values
+    return df
+
+###############################################
+# CALCOLO DELL'ANALISI
+###############################################
+
+def map_income_statement(annual_income_statement, quarterly_income_statement, income_mapping_user,
+                         include_ttm=True, on_error=logger.error, on_warning=logger.warning,
+                         on_target_error=None):
+    """
+    Valuta il mapping su tutti i periodi annuali e, se richiesto, sulla riga TTM
+    ottenuta dagli ultimi quattro trimestri (in cima al risultato).
+    """
+    # Calcolo del mapping per tutte le righe (timeseries)
+    df_income_ts = compute_income_mapping_timeseries(annual_income_statement, income_mapping_user,
+                                                     on_error, on_target_error)
+
+    # Creazione della riga TTM a partire dai dati trimestrali, se richiesta
+    if include_ttm:
+        try:
+            if quarterly_income_statement is not None and not quarterly_income_statement.empty:
+                # TTM dell'ultimo trimestre, con le regole per voce di rolling_ttm
+                latest_ttm = rolling_ttm(quarterly_income_statement).iloc[:1]
+                if latest_ttm.isna().all(axis=None):
+                    on_warning("TTM non calcolabile: mancano trimestri consecutivi recenti. "
+                               "Si utilizzeranno solo i dati annuali.")
+                    return df_income_ts
+                ttm_df = compute_income_mapping_timeseries(latest_ttm, income_mapping_user,
+                                                           on_error, on_target_error)
+                ttm_df.index = ["TTM"]
+
+                # Concatena la riga TTM in cima al timeseries annuale
+                return pd.concat([ttm_df, df_income_ts])
+            else:
+                on_warning("Dati trimestrali non disponibili. Si utilizzeranno solo i dati annuali.")
+        except Exception as e:
+            on_warning(f"Impossibile calcolare TTM: {e}. Si utilizzeranno solo i dati annuali.")
+    return df_income_ts
+
+def _final_frames(derived):
+    # Riordino delle colonne finali
+    df_income_full = derived.reindex(columns=[col for col in OUTPUT_COLUMNS if col in derived.columns])
+    return df_income_full, to_millions(df_income_full)
+
+def analyze_income_statement(annual_income_statement, quarterly_income_statement, income_mapping_user,
+                             include_ttm=True, on_error=logger.error, on_warning=logger.warning):
+    """
+    Applica il mapping all'income statement annuale (periodi dal più recente) e calcola
+    la riga TTM dai trimestri, le variazioni Y/Y e i margini.
+    Restituisce (df_income_full, df_income_display), quest'ultimo con gli importi in milioni.
+    """
+    mapped = map_income_statement(annual_income_statement, quarterly_income_statement,
+                                  income_mapping_user, include_ttm, on_error, on_warning)
+    derived = apply_metrics(mapped.copy(deep=False), ANALYSIS_METRICS, base=mapped)
+    return _final_frames(derived)
+
+def analyze_quarterly_statement(quarterly_income_statement, income_mapping_user,
+                                on_error=logger.error, on_warning=logger.warning):
+    """
+    Analisi trimestrale: applica il mapping al TTM mobile di ogni trimestre e calcola
+    variazioni Y/Y (sullo stesso trimestre dell'anno precedente) e margini per trimestre.
+    I trimestri senza quattro trimestri consecutivi vengono esclusi.
+    Restituisce (df_income_full, df_income_display) come analyze_income_statement.
+    """
+    if quarterly_income_statement is None or quarterly_income_statement.empty:
+        on_warning("Dati trimestrali non disponibili per l'analisi trimestrale.")
+        return _final_frames(pd.DataFrame())
+    ttm = rolling_ttm(quarterly_income_statement)
+    ttm = ttm[ttm.notna().any(axis=1)]
+    if ttm.empty:
+        on_warning(f"Servono almeno {TTM_QUARTERS} trimestri consecutivi per il TTM mobile.")
+        return _final_frames(pd.DataFrame())
+    mapped = compute_income_mapping_timeseries(ttm, income_mapping_user, on_error)
+    derived = apply_metrics(mapped.copy(deep=False), QUARTERLY_METRICS, base=mapped)
+    return _final_frames(derived)
+
+def update_income_analysis(state, annual_income_statement, quarterly_income_statement, income_mapping_user,
+                           include_ttm=True):
+    """
+    Versione incrementale di analyze_income_statement. state è il dizionario restituito
+    dalla chiamata precedente (o None): se riguarda gli stessi statement, vengono valutati
+    solo i target il cui mapping è cambiato e ricalcolate solo le metriche che ne dipendono.
+    Restituisce il nuovo state, con "df_income_full", "df_income_display", "affected"
+    (None se è stato necessario un calcolo completo) e "messages", i messaggi di
+    valutazione come target -> [(tipo, messaggio)] (None per quelli non legati a un target).
+    """
+    messages = {}
+
+    def report(target, kind, msg):
+        entries = messages.setdefault(target, [])
+        if (kind, msg) not in entries:
+            entries.append((kind, msg))
+
+    def map_targets(mapping):
+        messages.clear()
+        return map_income_statement(
+            annual_income_statement, quarterly_income_statement, mapping, include_ttm,
+            on_error=lambda msg: report(None, "error", msg),
+            on_warning=lambda msg: report(None, "warning", msg),
+            on_target_error=lambda target, msg: report(target, "error", msg)
+        )
+
+    reusable = (
+        state is not None
+        and state["mapped"] is not None
+        and state["annual"] is annual_income_statement
+        and state["quarterly"] is quarterly_income_statement
+        and state["include_ttm"] == include_ttm
+        and state["mapping"].keys() == income_mapping_user.keys()
+    )
+    if reusable:
+        changed = {target for target, expr in income_mapping_user.items() if state["mapping"][target] != expr}
+        if not changed:
+            return dict(state, affected=set())
+        mapped_changed = map_targets({target: income_mapping_user[target] for target in changed})
+        reusable = mapped_changed.index.equals(state["mapped"].index)
+
+    if not reusable:
+        mapped = map_targets(income_mapping_user)
+        derived = apply_metrics(mapped.copy(deep=False), ANALYSIS_METRICS, base=mapped)
+        affected = None
+    else:
+        # Copie superficiali: con il copy-on-write le colonne non ricalcolate restano condivise
+        mapped = state["mapped"].copy(deep=False)
+        derived = state["derived"].copy(deep=False)
+        for target in changed:
+            mapped[target] = mapped_changed[target]
+            derived[target] = mapped_changed[target]
+        affected = affected_columns(changed)
+        derived = apply_metrics(derived, [m for m in ANALYSIS_METRICS if m[0] in affected], base=mapped)
+        # I messaggi dei target non ricalcolati restano quelli dell'analisi precedente
+        messages = {**{target: entries for target, entries in state["messages"].items()
+                       if target is not None and target not in changed},
+                    **messages}
+
+    df_income_full, df_income_display = _final_frames(derived)
+    return {
+        "annual": annual_income_statement,
+        "quarterly": quarterly_income_statement,
+        "include_ttm": include_ttm,
+        "mapping": dict(income_mapping_user),
+        "mapped": mapped,
+        "derived": derived,
+        "df_income_full": df_income_full,
+        "df_income_display": df_income_display,
+        "affected": affected,
+        "messages": messages,
+    }
+
+def to_millions(df):
+    """
+    Vista di df con gli importi convertiti in MILIONI: vengono allocate solo le
+    colonne degli importi, le altre restano condivise con df
+    """
+    df_income_display = df.copy(deep=False)
+    for col in AMOUNT_COLUMNS:
+        if col in df_income_display.columns:
+            df_income_display[col] = df_income_display[col] / 1e6
+    return df_income_display
+
+###############################################
+# CACHE CONDIVISA DELLE ANALISI
+###############################################
+
+class AnalysisCache:
+    """
+    Analisi condivise tra sessioni, limitate alle max_entries voci usate più di recente.
+    Una voce contiene solo i risultati (copiati: nessuna vista sugli statement della
+    sessione che li ha calcolati), il mapping e i messaggi; chi la riusa vi associa i
+    propri statement e, senza "mapped" e "derived", al cambio di mapping successivo
+    ricalcola l'analisi per intero.
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, state):
+        """Memorizza i risultati di state (restituito da update_income_analysis)."""
+        entry = {
+            "include_ttm": state["include_ttm"],
+            "mapping": dict(state["mapping"]),
+            "messages": {target: list(entries) for target, entries in state["messages"].items()},
+            "df_income_full": state["df_income_full"].copy(),
+            "df_income_display": state["df_income_display"].copy(),
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def __len__(self):
+        return len(self._entries)
+
+###############################################
+# FORMATTAZIONE PER LA VISUALIZZAZIONE
+###############################################
+
+def statement_hash(df):
+    """Impronta del contenuto di uno statement (indice, colonne e valori), per le cache."""
+    if df is None:
+        return "none"
+    digest = hashlib.sha1()
+    digest.update(repr(list(df.columns)).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def mapping_hash(mapping):
+    """Impronta di un mapping target -> colonna/espressione, indipendente dall'ordine dei target."""
+    payload = json.dumps(mapping or {}, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def latest_period_values(df, quarterly_df=None):
+    """
+    Valore dell'ultimo periodo di ogni colonna di df, formattato in milioni ("$1.23M").
+    Le colonne presenti nel trimestrale usano l'ultimo trimestre, le altre l'ultimo anno;
+    i valori mancanti diventano "N/A" e quelli non numerici restano testo.
+    Restituisce una Series indicizzata per colonna, calcolata senza cicli per voce.
+    """
+    if df is None or df.empty:
+        return pd.Series(dtype=object)
+    raw = df.iloc[0]
+    if quarterly_df is not None and not quarterly_df.empty:
+        latest_quarter = quarterly_df.iloc[0].reindex(df.columns)
+        raw = latest_quarter.where(df.columns.isin(quarterly_df.columns), raw)
+    numeric = pd.to_numeric(raw, errors="coerce")
+    formatted = "$" + (numeric / 1e6).map("{:.2f}".format) + "M"
+    text = raw.astype(str)
+    return formatted.where(numeric.notna(), text.where(raw.notna(), "N/A"))
+
+def period_labels(index):
+    """Etichette testuali dei periodi: le date come AAAA-MM-GG, il resto (es. "TTM") invariato."""
+    return [p.strftime("%Y-%m-%d") if hasattr(p, "strftime") else str(p) for p in index]
+
+def with_period_labels(df):
+    """
+    Vista di df con i periodi come testo (l'indice misto date/"TTM" non è serializzabile
+    in Arrow); per un MultiIndex (Ticker, Periodo) viene convertito solo l'ultimo livello.
+    I dati non vengono copiati.
+    """
+    view = df.copy(deep=False)
+    if isinstance(df.index, pd.MultiIndex):
+        view.index = df.index.set_levels(period_labels(df.index.levels[-1]), level=-1, verify_integrity=False)
+    else:
+        view.index = pd.Index(period_labels(df.index), name=df.index.name)
+    return view
+
+def display_formatters(df):
+    """Formattatori per colonna (formato di str.format) per Styler.format."""
+    formatters = {col: "{:.2f}%" for col in PERCENT_COLUMNS if col in df.columns}
+    formatters.update({col: "{:,.2f}" for col in AMOUNT_COLUMNS if col in df.columns})
+    if "EPS" in df.columns:
+        formatters["EPS"] = "{:.2f}"
+    return formatters
+
+@timed("style_dataframe")
+def style_dataframe(df):
+    """
+    Formattazione per la visualizzazione tramite pandas Styler: i valori restano
+    numerici (ordinabili) e le stringhe vengono prodotte solo in fase di rendering.
+    """
+    if df is None or df.empty:
+        return df
+    return with_period_labels(df).style.format(display_formatters(df), na_rep="N/A")
+
+@timed("format_dataframe")
+def format_dataframe(df):
+    """Copia di df con i valori già convertiti in testo formattato (percentuali, importi, EPS)"""
+    if df is None or df.empty:
+        return df
+    
+    formatters = display_formatters(df)
+    formatted = {}
+    for col in df.columns:
+        fmt = formatters.get(col)
+        if fmt is None:
+            formatted[col] = df[col]
+            continue
+        values = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+        missing = np.isnan(values)
+        text = np.array([fmt.format(v) for v in values], dtype=object)
+        # Le percentuali mancanti (o già testuali) restano invariate, gli altri valori diventano "N/A"
+        text[missing] = df[col].to_numpy(dtype=object)[missing] if col in PERCENT_COLUMNS else "N/A"
+        formatted[col] = text
+    
+    # Un'unica costruzione del risultato invece di una copia modificata colonna per colonna
+    return pd.DataFrame(formatted, index=df.index)
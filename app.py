@@ -1,15 +1,66 @@
+import time
+
+# Tempo dell'intera esecuzione dello script, import compresi (a freddo pesano solo alla
+# prima esecuzione del processo), registrato per step in fondo alla pagina
+run_started = time.perf_counter()
+
 import streamlit as st
-import yfinance as yf
 import pandas as pd
-import re
-import plotly.graph_objects as go
-import plotly.express as px
-import time
+import os
 import random
+import uuid
+from collections import OrderedDict
 from datetime import datetime
 
+from analysis import (
+    analyze_quarterly_statement, config, latest_period_values, mapping_hash, statement_hash,
+    style_dataframe, update_income_analysis
+)
+from batch import parse_tickers, resolve_mapping, run_batch
+from column_index import build_column_index, suggest_targets
+from export import EXPORT_FORMATS, available_formats, export_bytes
+from data_sources import DemoProvider
+from expressions import FUNCTIONS, evaluate_expression, is_mapping_expression, transform_expr
+from fetch_scheduler import is_rate_limit_error
+from instrumentation import default_registry, increment, record, span
+from peers import MIN_PEERS, PEER_LEVELS
+from resources import (
+    get_analysis_cache, get_data_provider, get_fetch_service, get_mapping_registry, get_panel_store,
+    get_peer_panel, get_prefetcher, get_session_memory, get_statement_cache
+)
+from session_memory import SessionData, compact_statement
+
 st.set_page_config(page_title="Financial Statement Analyzer", layout="wide")
 
+# Dati usati dalla modalità demo, qualunque sia la sorgente configurata (DATA_SOURCE)
+DEMO_PROVIDER = DemoProvider()
+
+# Oltre questo numero di voci la tabella delle colonne disponibili è nascosta di default
+WIDE_STATEMENT_COLUMNS = int(os.environ.get("WIDE_STATEMENT_COLUMNS", 60))
+
+# Combinazioni (ticker, mapping) di cui si conservano i grafici in sessione
+CHART_CACHE_SIZE = int(os.environ.get("CHART_CACHE_SIZE", 8))
+
+# Periodicità dell'analisi: annuale con riga TTM oppure TTM mobile di ogni trimestre
+PERIOD_MODES = ["Annuale + TTM", "Trimestrale (TTM mobile)"]
+
+# Dati pesanti di una sessione (nome -> valore iniziale), nell'ordine in cui vengono
+# liberati oltre il budget di memoria della sessione
+SESSION_DATA_FIELDS = {
+    "chart_cache": OrderedDict,
+    "charts": lambda: None,
+    "analysis_state": lambda: None,
+    "batch_result": lambda: None,
+    "annual_income_statement": lambda: None,
+    "quarterly_data": lambda: None,
+}
+# Campi ricostruibili senza interrompere il passo corrente
+TRIMMABLE_FIELDS = ("chart_cache", "charts", "analysis_state")
+
+# Pannello di debug con i tempi delle fasi: mostra misure dell'intero processo e
+# permette di azzerarle, quindi si attiva solo dalla configurazione del server
+SHOW_DEBUG_PANEL = os.environ.get("DEBUG_PANEL", "0") == "1"
+
 # Initialize session state variables
 if 'demo_mode' not in st.session_state:
     st.session_state.demo_mode = False
@@ -17,255 +68,63 @@ if 'step' not in st.session_state:
     st.session_state.step = 'input'
 if 'ticker' not in st.session_state:
     st.session_state.ticker = ''
-if 'annual_income_statement' not in st.session_state:
-    st.session_state.annual_income_statement = None
 if 'income_mapping_user' not in st.session_state:
     st.session_state.income_mapping_user = None
+if 'batch_tickers' not in st.session_state:
+    st.session_state.batch_tickers = []
+if 'mapping_suggestion' not in st.session_state:
+    st.session_state.mapping_suggestion = None
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if 'session_data' not in st.session_state:
+    st.session_state.session_data = SessionData(SESSION_DATA_FIELDS)
+session_data = st.session_state.session_data
+
+# Oltre il budget della sessione si liberano i dati ricostruibili; i dati delle sessioni
+# inattive vengono liberati e ricaricati (dalla cache) alla loro interazione successiva
+trimmable = TRIMMABLE_FIELDS if st.session_state.step == 'batch' else TRIMMABLE_FIELDS + ("batch_result",)
+if get_session_memory().attach(st.session_state.session_id, session_data, trimmable):
+    if st.session_state.step in ('mapping', 'mapping_config', 'analyze'):
+        st.session_state.resume_step = st.session_state.step
+        st.session_state.step = 'load_data'
+    st.session_state.statement_key = None
+
+run_step = st.session_state.step
 
 st.title("📊 Financial Statement Analyzer")
-st.write("Analisi dell'Income Statement da Yahoo Finance")
-
-###############################################
-# DEMO DATA
-###############################################
-
-# Sample data for demo mode when API is rate limited
-DEMO_COMPANY_INFO = {
-    "AAPL": {
-        "longName": "Apple Inc.",
-        "sector": "Technology",
-        "industry": "Consumer Electronics",
-        "currentPrice": 174.79,
-        "marketCap": 2740000000000,
-        "logo_url": "https://logo.clearbit.com/apple.com"
-    },
-    "MSFT": {
-        "longName": "Microsoft Corporation",
-        "sector": "Technology",
-        "industry": "Software—Infrastructure",
-        "currentPrice": 403.78,
-        "marketCap": 3000000000000,
-        "logo_url": "https://logo.clearbit.com/microsoft.com"
-    },
-    "GOOGL": {
-        "longName": "Alphabet Inc.",
-        "sector": "Communication Services",
-        "industry": "Internet Content & Information",
-        "currentPrice": 153.05,
-        "marketCap": 1900000000000,
-        "logo_url": "https://logo.clearbit.com/google.com"
-    }
-}
-
-# Sample financial data structure for demo mode
-DEMO_FINANCIAL_DATA = {
-    "AAPL": {
-        "financials": {
-            "Revenue": [394328000000, 365817000000, 274515000000, 260174000000],
-            "Cost Of Revenue": [226107000000, 208168000000, 152836000000, 161782000000],
-            "Gross Profit": [168221000000, 157649000000, 121679000000, 98392000000],
-            "Selling General And Administration": [26474000000, 25094000000, 21973000000, 19916000000],
-            "Research And Development": [29915000000, 26251000000, 21914000000, 18752000000],
-            "Operating Income": [111832000000, 109552000000, 94680000000, 66288000000],
-            "Pretax Income": [113645000000, 109272000000, 94680000000, 67091000000],
-            "Income Tax Expense": [18573000000, 14089000000, 14527000000, 9680000000],
-            "Net Income": [95025000000, 99803000000, 94680000000, 57411000000],
-            "Diluted EPS": [6.14, 6.11, 5.61, 3.28]
-        },
-        "dates": ["2023-09-30", "2022-09-30", "2021-09-30", "2020-09-30"]
-    },
-    "MSFT": {
-        "financials": {
-            "Revenue": [211915000000, 198270000000, 168088000000, 143015000000],
-            "Cost Of Revenue": [70950000000, 65812000000, 52232000000, 46078000000],
-            "Gross Profit": [140965000000, 132458000000, 115856000000, 96937000000],
-            "Selling General And Administration": [42513000000, 39585000000, 35327000000, 29539000000],
-            "Research And Development": [27155000000, 24512000000, 20716000000, 19269000000],
-            "Operating Income": [88389000000, 83383000000, 69916000000, 52959000000],
-            "Pretax Income": [88092000000, 83386000000, 71102000000, 53036000000],
-            "Income Tax Expense": [10605000000, 10978000000, 9831000000, 8755000000],
-            "Net Income": [77487000000, 72738000000, 61271000000, 44281000000],
-            "Diluted EPS": [10.31, 9.65, 8.05, 5.76]
-        },
-        "dates": ["2023-06-30", "2022-06-30", "2021-06-30", "2020-06-30"]
-    },
-    "GOOGL": {
-        "financials": {
-            "Revenue": [307394000000, 282836000000, 257637000000, 182527000000],
-            "Cost Of Revenue": [131380000000, 126203000000, 110939000000, 84732000000],
-            "Gross Profit": [176014000000, 156633000000, 146698000000, 97795000000],
-            "Selling General And Administration": [45567000000, 43026000000, 37702000000, 31023000000],
-            "Research And Development": [44861000000, 39500000000, 31562000000, 27573000000],
-            "Operating Income": [84486000000, 73972000000, 78714000000, 41224000000],
-            "Pretax Income": [84800000000, 76033000000, 86692000000, 42733000000],
-            "Income Tax Expense": [11907000000, 13118000000, 14701000000, 7813000000],
-            "Net Income": [73800000000, 59972000000, 76033000000, 40269000000],
-            "Diluted EPS": [5.80, 4.56, 5.61, 2.93]
-        },
-        "dates": ["2023-12-31", "2022-12-31", "2021-12-31", "2020-12-31"]
-    }
-}
-
-# Function to get demo financial data
-def get_demo_financial_data(ticker):
-    """Get demo financial data for a ticker"""
-    if ticker in DEMO_FINANCIAL_DATA:
-        return DEMO_FINANCIAL_DATA[ticker]
-    # Default to AAPL if ticker not in demo data
-    return DEMO_FINANCIAL_DATA["AAPL"]
-
-# Function to get demo company info
-def get_demo_company_info(ticker):
-    """Get demo company info for a ticker"""
-    if ticker in DEMO_COMPANY_INFO:
-        return DEMO_COMPANY_INFO[ticker]
-    # Default to AAPL if ticker not in demo data
-    return DEMO_COMPANY_INFO["AAPL"]
-
-###############################################
-# CONFIGURAZIONE – Income Statement Mapping
-###############################################
-
-config = {
-    "income_mapping": {
-        "Revenue": ["Total Revenue", "Operating Revenue"],
-        "Total COGS": ["Cost Of Revenue"],
-        "Gross Profit": ["Gross Profit"],
-        "SG&A": ["Selling General And Administration", "General & Administrative"],
-        "R&D": ["Research And Development"],
-        "S&M": ["Sales And Marketing", "Selling and Marketing", "Selling Expenses", "Marketing Expense"],
-        "Operating Income": ["Operating Income"],
-        "Pretax Income": ["Pretax Income"],
-        "Taxes": ["Income Tax Expense", "Taxes"],
-        "Net Income": ["Net Income"],
-        "EPS": ["Diluted EPS"],
-        "Net Interest Income": ["Net Non Operating Interest Income Expense", "Other Income Expense"]
-    }
-}
-
-###############################################
-# FUNZIONE DI CREAZIONE GRAFICI CON PLOTLY
-###############################################
-
-def create_charts(df):
-    """Create charts from the data"""
-    # Create a copy for chart formatting
-    chart_df = df.copy()
-    
-    # 1. Revenue & Net Income Chart
-    fig1 = go.Figure()
-    
-    if "Revenue" in chart_df.columns:
-        fig1.add_trace(go.Bar(
-            x=chart_df.index,
-            y=chart_df["Revenue"],
-            name="Revenue",
-            marker_color='rgb(55, 83, 109)'
-        ))
-    
-    if "Net Income" in chart_df.columns:
-        fig1.add_trace(go.Bar(
-            x=chart_df.index,
-            y=chart_df["Net Income"],
-            name="Net Income",
-            marker_color='rgb(26, 118, 255)'
-        ))
-    
-    fig1.update_layout(
-        title="Revenue & Net Income (in millions)",
-        xaxis_title="Year",
-        yaxis_title="Amount (in millions)",
-        barmode='group',
-        legend=dict(x=0, y=1.0),
-        template="plotly_white"
-    )
-    
-    # 2. Margins & Tax Percentage Chart (aggiunto il Tax Percentage qui)
-    fig2 = go.Figure()
-    
-    # Aggiungi i margini
-    for margin in ["Gross Margin", "Operating Margin", "Net Margin"]:
-        if margin in chart_df.columns:
-            # Handle string percentage values
-            if chart_df[margin].dtype == 'object':
-                margin_values = chart_df[margin].apply(lambda x: float(x.strip('%')) if isinstance(x, str) else x)
-            else:
-                margin_values = chart_df[margin]
-                
-            fig2.add_trace(go.Scatter(
-                x=chart_df.index,
-                y=margin_values,
-                mode='lines+markers',
-                name=margin
-            ))
-    
-    # Aggiungi Tax Percentage al grafico dei margini
-    if "Tax Percentage" in chart_df.columns:
-        if chart_df["Tax Percentage"].dtype == 'object':
-            tax_values = chart_df["Tax Percentage"].apply(lambda x: float(x.strip('%')) if isinstance(x, str) else x)
-        else:
-            tax_values = chart_df["Tax Percentage"]
-            
-        fig2.add_trace(go.Scatter(
-            x=chart_df.index,
-            y=tax_values,
-            mode='lines+markers',
-            name="Tax Percentage",
-            marker_color='rgb(255, 127, 14)'  # Orange
-        ))
-    
-    fig2.update_layout(
-        title="Profit Margins & Tax Percentage (%)",
-        xaxis_title="Year",
-        yaxis_title="Percentage (%)",
-        legend=dict(x=0, y=1.0),
-        template="plotly_white"
-    )
-    
-    # 3. YoY Growth Chart
-    fig3 = go.Figure()
-    
-    for growth in ["Revenue Y/Y", "Net Income Y/Y"]:
-        if growth in chart_df.columns:
-            # Handle string percentage values
-            if chart_df[growth].dtype == 'object':
-                growth_values = chart_df[growth].apply(lambda x: float(x.strip('%')) if isinstance(x, str) else x)
-            else:
-                growth_values = chart_df[growth]
-                
-            fig3.add_trace(go.Scatter(
-                x=chart_df.index,
-                y=growth_values,
-                mode='lines+markers',
-                name=growth
-            ))
-    
-    fig3.update_layout(
-        title="Year-over-Year Growth (%)",
-        xaxis_title="Year",
-        yaxis_title="Growth (%)",
-        legend=dict(x=0, y=1.0),
-        template="plotly_white"
-    )
-    
-    return fig1, fig2, fig3
+st.write(f"Analisi dell'Income Statement da {get_data_provider().label}")
 
 ###############################################
 # FUNZIONI DI MAPPING E VALUTAZIONE
 ###############################################
 
-def transform_expr(user_input, available):
-    """
-    Sostituisce ogni numero (indice) nell'input con il nome della colonna corrispondente
-    (racchiuso tra backtick), basandosi sulla lista available.
-    """
-    def repl(match):
-        idx = int(match.group(0))
-        if idx <= len(available):
-            return f"`{available[idx-1]}`"
-        else:
-            return match.group(0)
-    return re.sub(r'\b\d+\b', repl, user_input)
+@st.cache_data(max_entries=32, show_spinner=False)
+def get_latest_values(statement_key, _df, _quarterly_df):
+    """Valori formattati dell'ultimo periodo, calcolati una volta per statement caricato"""
+    return latest_period_values(_df, _quarterly_df)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def get_columns_table(statement_key, _df, _quarterly_df, _mapping_config):
+    """Tabella "Colonne disponibili" (indice, valore e target suggerito), una volta per statement"""
+    values = get_latest_values(statement_key, _df, _quarterly_df)
+    suggestions = suggest_targets(_df.columns, _mapping_config)
+    suggested = pd.Series({col: f"{target} ({score:.0%})" for col, (target, score) in suggestions.items()},
+                          dtype=object)
+    return pd.DataFrame({
+        "Indice": range(1, len(_df.columns) + 1),
+        "Colonna": _df.columns,
+        "Valore Ultimo Periodo": values.reindex(_df.columns).fillna("N/A").to_numpy(),
+        "Target suggerito": suggested.reindex(_df.columns).fillna("").to_numpy(),
+    })
+
+def current_statement_key():
+    """Chiave degli statement in sessione (calcolata una sola volta dopo il caricamento)"""
+    if st.session_state.get('statement_key') is None:
+        st.session_state.statement_key = (
+            statement_hash(session_data.annual_income_statement),
+            statement_hash(session_data.quarterly_data),
+        )
+    return st.session_state.statement_key
 
 def display_candidates_with_values(df, candidate_list, quarterly_df=None):
     """
@@ -280,60 +139,14 @@ def display_candidates_with_values(df, candidate_list, quarterly_df=None):
     if df.empty:
         return {}
     
-    # Determina quale DataFrame usare per i valori
-    display_df = quarterly_df if quarterly_df is not None else df
-    latest = display_df.iloc[0]  # Prima riga (più recente)
-    
-    # Indica la fonte dei dati per migliore comprensione
-    source = "trimestre" if quarterly_df is not None else "anno"
+    values = get_latest_values(current_statement_key(), df, quarterly_df)
+    # Indice normalizzato delle colonne (in cache per layout): nessuna scansione lineare
+    index = build_column_index(df.columns)
     
     results = {}
     for i, col in enumerate(candidate_list, start=1):
-        try:
-            # Verifica se la colonna esiste
-            if col in display_df.columns:
-                # Accedi al valore
-                raw_value = latest[col]
-                
-                # Formatta il valore in base al tipo
-                if pd.notna(raw_value):
-                    if isinstance(raw_value, (int, float)):
-                        formatted_value = f"${raw_value/1e6:.2f}M"
-                    else:
-                        # Tenta conversione a float se è una stringa
-                        try:
-                            num_value = float(raw_value)
-                            formatted_value = f"${num_value/1e6:.2f}M"
-                        except (ValueError, TypeError):
-                            formatted_value = str(raw_value)
-                else:
-                    formatted_value = "N/A"
-            else:
-                # Ricerca flessibile
-                found = False
-                for df_col in display_df.columns:
-                    if col.lower() == df_col.lower():
-                        raw_value = latest[df_col]
-                        if pd.notna(raw_value):
-                            if isinstance(raw_value, (int, float)):
-                                formatted_value = f"${raw_value/1e6:.2f}M"
-                            else:
-                                try:
-                                    num_value = float(raw_value)
-                                    formatted_value = f"${num_value/1e6:.2f}M"
-                                except (ValueError, TypeError):
-                                    formatted_value = str(raw_value)
-                        else:
-                            formatted_value = "N/A"
-                        found = True
-                        break
-                
-                if not found:
-                    formatted_value = "N/A"
-        except Exception as e:
-            formatted_value = "N/A"
-        
-        results[i] = {"col": col, "value": formatted_value}
+        df_col = index.resolve(col)
+        results[i] = {"col": col, "value": values.get(df_col, "N/A") if df_col is not None else "N/A"}
     
     return results
 
@@ -346,45 +159,14 @@ def streamlit_mapping_complex(df, mapping_config):
     st.subheader("Mapping Interattivo (Income Statement)")
     
     # Ottieni i dati trimestrali, se disponibili
-    quarterly_df = st.session_state.quarterly_data if 'quarterly_data' in st.session_state else None
-    
-    with st.expander("Colonne disponibili nell'income statement", expanded=True):
-        # Determina quale DataFrame usare per visualizzare i valori
-        display_df = quarterly_df if quarterly_df is not None else df
-        latest_values = display_df.iloc[0] if not display_df.empty else pd.Series()
-        
-        # Crea una tabella per visualizzare tutte le colonne con i loro valori
-        cols_data = []
-        for i, col in enumerate(df.columns, start=1):
-            try:
-                # Verifica se la colonna esiste anche nei dati trimestrali
-                if quarterly_df is not None and col in quarterly_df.columns:
-                    raw_value = latest_values[col]
-                else:
-                    # Fallback ai dati annuali se la colonna non esiste nei trimestrali
-                    raw_value = df.iloc[0][col] if col in df.columns else None
-                
-                # Formatta il valore
-                if pd.isna(raw_value):
-                    formatted_value = "N/A"
-                elif isinstance(raw_value, (int, float)):
-                    formatted_value = f"${raw_value/1e6:.2f}M"
-                else:
-                    try:
-                        num_value = float(raw_value)
-                        formatted_value = f"${num_value/1e6:.2f}M"
-                    except (ValueError, TypeError):
-                        formatted_value = str(raw_value)
-            except Exception:
-                formatted_value = "N/A"
-            
-            cols_data.append({
-                "Indice": i,
-                "Colonna": col,
-                "Valore Ultimo Periodo": formatted_value
-            })
-        
-        cols_df = pd.DataFrame(cols_data)
+    quarterly_df = session_data.quarterly_data
+    column_index = build_column_index(df.columns)
+    
+    # La tabella completa viene costruita e inviata al browser solo se richiesta
+    # (per gli statement molto ampi è nascosta di default)
+    if st.toggle("Mostra le colonne disponibili nell'income statement",
+                 value=len(df.columns) <= WIDE_STATEMENT_COLUMNS, key="show_columns_table"):
+        cols_df = get_columns_table(current_statement_key(), df, quarterly_df, mapping_config)
         st.dataframe(cols_df, hide_index=True)
         
         # Indica la fonte dei dati per migliore comprensione
@@ -392,15 +174,24 @@ def streamlit_mapping_complex(df, mapping_config):
         st.info(f"I valori mostrati sono dell'ultimo {source} disponibile")
     
     for target, candidates in mapping_config.items():
-        available = [cand for cand in candidates if cand in df.columns]
+        available = column_index.resolve_candidates(candidates)
         
         st.write(f"### Mapping per '{target}'")
         
         if not available:
-            st.warning(f"Nessuna delle candidate predefinite è stata trovata. Verrà usato l'intero elenco disponibile.")
-            available = list(df.columns)
+            # Prima le colonne più simili alle candidate, poi il resto dell'elenco; i suggerimenti
+            # non diventano mai il default (resta la prima colonna, da confermare o cambiare)
+            suggested = [col for col, _ in sorted(
+                ((col, score) for cand in candidates for col, score in column_index.suggest(cand)),
+                key=lambda item: -item[1])]
+            available = list(dict.fromkeys(suggested + list(df.columns)))
+            if suggested:
+                st.warning(f"Nessuna delle candidate predefinite è stata trovata. Verrà usato l'intero elenco "
+                           f"disponibile; colonne più simili: {', '.join(dict.fromkeys(suggested))}")
+            else:
+                st.warning(f"Nessuna delle candidate predefinite è stata trovata. Verrà usato l'intero elenco disponibile.")
             candidates_info = display_candidates_with_values(df, available, quarterly_df)
-            default_value = available[0] if available else None
+            default_value = df.columns[0] if len(df.columns) else None
         else:
             st.success(f"Candidate trovate: {', '.join(available)}")
             candidates_info = display_candidates_with_values(df, available, quarterly_df)
@@ -463,18 +254,16 @@ def streamlit_mapping_complex(df, mapping_config):
             st.write("Opzioni disponibili per l'espressione:")
             
             # Crea la tabella delle opzioni con i valori
-            options_data = []
-            for i, col in enumerate(available, start=1):
-                options_data.append({
-                    "Indice": i,
-                    "Colonna": col,
-                    "Valore Ultimo Periodo": candidates_info[i]["value"]
-                })
-            
-            options_df = pd.DataFrame(options_data)
+            options_df = pd.DataFrame({
+                "Indice": range(1, len(available) + 1),
+                "Colonna": available,
+                "Valore Ultimo Periodo": [candidates_info[i]["value"] for i in range(1, len(available) + 1)]
+            })
             st.dataframe(options_df, hide_index=True)
             
-            st.info("Puoi inserire un singolo numero (es. '1') per selezionare direttamente una colonna, oppure un'espressione matematica usando gli indici (es. '1+2-3').")
+            st.info("Puoi inserire un singolo numero (es. '1') per selezionare direttamente una colonna, "
+                    "oppure un'espressione matematica usando gli indici (es. '1+2-3', 'max(1, 2) * 0.5'). "
+                    f"Funzioni disponibili: {', '.join(FUNCTIONS)}.")
             
             expr_input = st.text_input(
                 f"Inserisci un'espressione per '{target}':",
@@ -497,7 +286,7 @@ def streamlit_mapping_complex(df, mapping_config):
                         else:
                             new_mapping[target] = None
                 # Se è un'espressione aritmetica
-                elif any(op in expr_input for op in ['+', '-', '*', '/']):
+                elif is_mapping_expression(expr_input):
                     transformed = transform_expr(expr_input, available)
                     new_mapping[target] = transformed
                     st.info(f"Espressione trasformata: {transformed}")
@@ -506,18 +295,9 @@ def streamlit_mapping_complex(df, mapping_config):
                     try:
                         # Scegli quale DataFrame usare per calcolare l'anteprima
                         calc_df = quarterly_df if quarterly_df is not None else df
-                        latest_row = {col: float(calc_df.iloc[0][col]) if col in calc_df.iloc[0] and pd.notna(calc_df.iloc[0][col]) else 0 
-                                     for col in calc_df.columns}
-                        
-                        # Sostituisci i nomi di colonna con i valori
-                        expr_with_values = transformed
-                        for col in calc_df.columns:
-                            if f"`{col}`" in expr_with_values:
-                                value = latest_row.get(col, 0)
-                                expr_with_values = expr_with_values.replace(f"`{col}`", str(value))
-                        
-                        # Valuta l'espressione
-                        result = eval(expr_with_values)
+                        # Valori mancanti o non numerici contano come 0, come nell'analisi
+                        latest_row = pd.to_numeric(calc_df.iloc[0], errors='coerce').fillna(0)
+                        result = float(evaluate_expression(transformed, latest_row))
                         period_type = "trimestre" if quarterly_df is not None else "anno"
                         st.success(f"Valore calcolato (ultimo {period_type}): ${result/1e6:.2f}M")
                     except Exception as e:
@@ -557,75 +337,82 @@ def streamlit_mapping_complex(df, mapping_config):
     return new_mapping
 
 
-def evaluate_mapping_latest(df, mapping_dict):
+def remember_mapping(mapping):
+    """Registra il mapping accettato per il ticker corrente (mai in modalità demo)"""
+    if st.session_state.demo_mode:
+        return
+    try:
+        get_mapping_registry().remember(
+            st.session_state.ticker, list(session_data.annual_income_statement.columns), mapping
+        )
+    except Exception as e:
+        st.warning(f"Impossibile salvare il mapping nel registro: {e}")
+
+def apply_mapping_suggestion():
+    """Applica il mapping proposto dal registro, adattato alle colonne del ticker"""
+    suggestion = st.session_state.mapping_suggestion
+    st.session_state.income_mapping_user = resolve_mapping(
+        suggestion.mapping, list(session_data.annual_income_statement.columns)
+    )
+    st.session_state.step = 'analyze'
+
+def accept_mapping_suggestion():
+    """Conferma esplicita del mapping proposto: lo applica e ne rafforza la registrazione"""
+    apply_mapping_suggestion()
+    remember_mapping(st.session_state.income_mapping_user)
+
+def store_analysis(ticker, df_income_full, info=None):
     """
-    Valuta l'espressione (eventualmente aritmetica) definita per ciascuna voce sul record più recente.
+    Salva l'analisi nell'archivio e nel pannello dei peer una sola volta per ticker
+    e mapping (mai i dati demo)
     """
-    latest = df.iloc[0]
-    mapped = {}
-    for target, expr in mapping_dict.items():
-        if expr is None:
-            mapped[target] = None
-        else:
-            if any(op in expr for op in ['+', '-', '*', '/']) and '`' not in expr:
-                expr = transform_expr(expr, list(df.columns))
-            if any(op in expr for op in ['+', '-', '*', '/']):
-                try:
-                    def replace_col(match):
-                        colname = match.group(0).strip('`')
-                        try:
-                            val = float(latest[colname])
-                            if pd.isna(val) or str(val).lower() == "nan":
-                                return "0"
-                            return str(val)
-                        except Exception:
-                            return "0"
-                    transformed_expr = re.sub(r'`[^`]+`', replace_col, expr)
-                    result = eval(transformed_expr)
-                    mapped[target] = result
-                except Exception as e:
-                    st.error(f"Errore nell'eval per {target} con '{expr}': {e}")
-                    mapped[target] = None
-            else:
-                if expr in latest.index:
-                    try:
-                        mapped[target] = float(latest[expr])
-                    except Exception:
-                        mapped[target] = None
-                else:
-                    mapped[target] = None
-    return mapped
-
-def compute_income_mapping_timeseries(df, mapping_dict):
-    results = {}
-    for idx, row in df.iterrows():
-        temp_df = pd.DataFrame([row], index=[idx])
-        mapped = evaluate_mapping_latest(temp_df, mapping_dict)
-        results[idx] = mapped
-    return pd.DataFrame.from_dict(results, orient='index')
+    if st.session_state.demo_mode:
+        return
+    store_key = (ticker, repr(st.session_state.income_mapping_user))
+    if st.session_state.get('panel_stored') == store_key:
+        return
+    try:
+        get_panel_store().append(ticker, df_income_full)
+        st.session_state.panel_stored = store_key
+    except Exception as e:
+        st.warning(f"Impossibile salvare l'analisi nell'archivio: {e}")
+    get_peer_panel().update(ticker, df_income_full, info)
+
+def render_peer_comparison(ticker):
+    """Mediane e percentili di margini e crescita rispetto ai peer di settore e industria"""
+    table, groups = get_peer_panel().compare(ticker)
+    if table.empty:
+        return
+    st.subheader("Confronto con i peer")
+    st.caption(" | ".join(f"{PEER_LEVELS[level]}: {group or 'N/D'} ({count} ticker analizzati)"
+                          for level, (group, count) in groups.items()))
+    if table.drop(columns="Valore").isna().all(axis=None):
+        st.info(f"Servono almeno {MIN_PEERS} ticker analizzati nello stesso settore o industria "
+                "per il confronto.")
+        return
+    st.dataframe(table.style.format("{:.2f}", na_rep="N/A"), use_container_width=True)
 
 # Add caching for API calls with longer TTL
 @st.cache_data(ttl=7200)  # Cache for 2 hours
 def get_company_info(ticker):
     """Fetch company info with caching"""
     if st.session_state.demo_mode:
-        return get_demo_company_info(ticker)
+        return DEMO_PROVIDER.info(ticker)
     
     try:
-        company = yf.Ticker(ticker)
-        time.sleep(1)  # Add delay to avoid rate limiting
-        info = company.info
+        info = get_fetch_service().fetch(ticker, "info")
         
         # Check if we got a valid response
         if not info or len(info) < 5:  # Basic validity check
-            st.warning(f"Risposta limitata da Yahoo Finance per {ticker}. Alcuni dati potrebbero mancare.")
+            st.warning(f"Risposta limitata da {get_data_provider().label} per {ticker}. "
+                       "Alcuni dati potrebbero mancare.")
             
         return info
     except Exception as e:
-        if "Rate limited" in str(e) or "Too Many Requests" in str(e):
-            st.warning("API rata limitata. Passaggio alla modalità demo.")
+        if is_rate_limit_error(e):
+            st.warning("API rata limitata anche dopo i tentativi di retry. Passaggio alla modalità demo.")
             st.session_state.demo_mode = True
-            return get_demo_company_info(ticker)
+            return DEMO_PROVIDER.info(ticker)
         else:
             st.error(f"Errore nel recupero delle informazioni aziendali: {str(e)}")
             return None
@@ -634,22 +421,14 @@ def get_company_info(ticker):
 def get_financial_data(ticker):
     """Fetch financial statements with caching"""
     if st.session_state.demo_mode:
-        demo_data = get_demo_financial_data(ticker)
-        
-        # Convert demo data to pandas DataFrame format
-        fin_data = pd.DataFrame(demo_data["financials"])
-        fin_data.index = pd.to_datetime(demo_data["dates"])
-        
-        # Transpose to match yfinance format
-        fin_data = fin_data.T
-        
-        return fin_data
+        return DEMO_PROVIDER.financials(ticker)
     
     try:
-        company = yf.Ticker(ticker)
-        time.sleep(1)  # Add delay to avoid rate limiting
-        financials = company.financials
+        financials = get_fetch_service().fetch(ticker, "financials")
         
+        if (financials is None or financials.empty) and not get_data_provider().remote:
+            st.error(f"Nessun dato finanziario per {ticker} in {get_data_provider().label}")
+            return None
         if financials is None or financials.empty:
             st.warning(f"Nessun dato finanziario disponibile per {ticker}. Passaggio alla modalità demo.")
             st.session_state.demo_mode = True
@@ -657,16 +436,35 @@ def get_financial_data(ticker):
             
         return financials
     except Exception as e:
-        if "Rate limited" in str(e) or "Too Many Requests" in str(e):
-            st.warning("API rata limitata. Passaggio alla modalità demo.")
+        if is_rate_limit_error(e):
+            st.warning("API rata limitata anche dopo i tentativi di retry. Passaggio alla modalità demo.")
             st.session_state.demo_mode = True
             return get_financial_data(ticker)  # Recursively call with demo mode activated
         else:
             st.error(f"Errore nel recupero dei dati finanziari: {str(e)}")
             return None
 
+@st.cache_data(ttl=7200)  # Cache for 2 hours
+def get_quarterly_financial_data(ticker):
+    """
+    Fetch quarterly financial statements with caching (None if there are none).
+    Gli errori vengono rilanciati, così un errore transitorio non resta in cache per tutti.
+    """
+    quarterly = get_fetch_service().fetch(ticker, "quarterly_financials")
+    if quarterly is None or quarterly.empty:
+        return None
+    return quarterly
+
 def load_ticker_data():
+    """
+    Carica una sola volta per ticker gli statement annuale e trimestrale.
+    Restituisce (annuale, trimestrale) con i periodi dal più recente; (None, None) in caso di errore.
+    """
     ticker = st.session_state.ticker
+    if not st.session_state.demo_mode:
+        # Annuale, trimestrale e info partono insieme: le chiamate successive attendono
+        # (o trovano già in cache) le stesse richieste invece di eseguirle in serie
+        get_fetch_service().prefetch(ticker)
     try:
         with st.spinner(f"Caricamento dati per {ticker}..."):
             # Get financial data (it will use demo data if in demo mode)
@@ -674,216 +472,171 @@ def load_ticker_data():
             
             if financials is None:
                 st.error(f"Nessun dato finanziario disponibile per {ticker}")
-                return None
+                return None, None
             
             # Transform to match the expected format
-            annual_income_statement = financials.T.sort_index(ascending=False)
+            # Forma compatta: un blocco float con le voci come indice categorico
+            annual_income_statement = compact_statement(financials.T.sort_index(ascending=False))
             
             if annual_income_statement.empty:
                 st.error(f"Nessun dato finanziario trovato per {ticker}")
-                return None
+                return None, None
             
+            # In modalità demo non ci sono dati trimestrali
+            q_financials = None
+            if not st.session_state.demo_mode:
+                try:
+                    q_financials = get_quarterly_financial_data(ticker)
+                except Exception as e:
+                    st.warning(f"Dati trimestrali non disponibili per {ticker}: {e}")
+            quarterly_income_statement = (compact_statement(q_financials.T.sort_index(ascending=False))
+                                          if q_financials is not None else None)
+            
+            if not st.session_state.demo_mode and get_data_provider().remote:
+                # Statistiche d'uso per il prefetch dei ticker più richiesti
+                try:
+                    get_statement_cache().record_request(ticker)
+                except Exception:
+                    pass
             st.success(f"Dati caricati con successo per {ticker}")
-            return annual_income_statement
+            return annual_income_statement, quarterly_income_statement
     except Exception as e:
         st.error(f"Errore durante il caricamento dei dati: {e}")
-        return None
-
-def format_dataframe(df):
-    """Format dataframe for display"""
-    if df is None or df.empty:
-        return df
-    
-    # Copy to avoid modifying the original
-    formatted_df = df.copy()
-    
-    # Format percentage columns
-    percent_columns = ["Gross Margin", "Revenue Y/Y", "Net Income Y/Y", "Tax Percentage", "Net Margin", "Operating Margin"]
-    for col in percent_columns:
-        if col in formatted_df.columns:
-            formatted_df[col] = formatted_df[col].apply(
-                lambda x: f"{x:.2f}%" if pd.notna(x) and not isinstance(x, str) else x
-            )
-    
-    # Format monetary columns
-    amount_columns = ["Revenue", "Total COGS", "Gross Profit", "SG&A", "R&D",
-                      "Operating Income", "Pretax Income", "Taxes", "Net Income", "Net Interest Income"]
-    for col in amount_columns:
-        if col in formatted_df.columns:
-            formatted_df[col] = formatted_df[col].apply(
-                lambda x: f"{x:,.2f}" if pd.notna(x) else "N/A"
-            )
-    
-    # Format EPS
-    if "EPS" in formatted_df.columns:
-        formatted_df["EPS"] = formatted_df["EPS"].apply(
-            lambda x: f"{x:.2f}" if pd.notna(x) else "N/A"
-        )
-    
-    return formatted_df
+        return None, None
 
 def save_ticker_input():
     st.session_state.ticker = st.session_state.ticker_input.strip().upper()
     st.session_state.step = 'load_data'
-    st.session_state.annual_income_statement = None
+    session_data.annual_income_statement = None
+    session_data.quarterly_data = None
+    st.session_state.statement_key = None
     st.session_state.income_mapping_user = None
+    st.session_state.mapping_suggestion = None
+    session_data.analysis_state = None
+    session_data.charts = None
+
+def save_batch_input():
+    st.session_state.batch_tickers = parse_tickers(st.session_state.batch_input)
+    session_data.batch_result = None
+    st.session_state.step = 'batch'
 
 def save_mapping():
     st.session_state.income_mapping_user = streamlit_mapping_complex(
-        st.session_state.annual_income_statement, 
+        session_data.annual_income_statement, 
         config["income_mapping"]
     )
     st.session_state.step = 'analyze'
 
 def perform_analysis():
-    with st.spinner("Elaborazione dati in corso..."):
-        annual_income_statement = st.session_state.annual_income_statement
-        income_mapping_user = st.session_state.income_mapping_user
-
-        # Calcolo del mapping per tutte le righe (timeseries)
-        df_income_ts = compute_income_mapping_timeseries(annual_income_statement, income_mapping_user)
-
-        # Aggiustamento per 'Gross Profit': se non è stato mappato, lo calcola come Revenue - Total COGS
-        for idx in df_income_ts.index:
-            if (df_income_ts.at[idx, "Gross Profit"] is None or pd.isna(df_income_ts.at[idx, "Gross Profit"])) \
-               and pd.notnull(df_income_ts.at[idx, "Revenue"]) and pd.notnull(df_income_ts.at[idx, "Total COGS"]):
-                df_income_ts.at[idx, "Gross Profit"] = df_income_ts.at[idx, "Revenue"] - df_income_ts.at[idx, "Total COGS"]
-
-        # Calcolo dei costi operativi e degli aggiustamenti per Operating Income e Taxes
-        for idx in df_income_ts.index:
-            sg_a = df_income_ts.at[idx, "SG&A"] if pd.notnull(df_income_ts.at[idx, "SG&A"]) else 0
-            r_and_d = df_income_ts.at[idx, "R&D"] if pd.notnull(df_income_ts.at[idx, "R&D"]) else 0
-            s_and_m = df_income_ts.at[idx, "S&M"] if pd.notnull(df_income_ts.at[idx, "S&M"]) else 0
-            df_income_ts.at[idx, "Operating Expenses"] = sg_a + r_and_d + s_and_m
-            if (df_income_ts.at[idx, "Operating Income"] is None or pd.isna(df_income_ts.at[idx, "Operating Income"])) \
-               and pd.notnull(df_income_ts.at[idx, "Gross Profit"]):
-                df_income_ts.at[idx, "Operating Income"] = df_income_ts.at[idx, "Gross Profit"] - df_income_ts.at[idx, "Operating Expenses"]
-            if (df_income_ts.at[idx, "Taxes"] is None or pd.isna(df_income_ts.at[idx, "Taxes"])) \
-               and pd.notnull(df_income_ts.at[idx, "Pretax Income"]) and pd.notnull(df_income_ts.at[idx, "Net Income"]):
-                df_income_ts.at[idx, "Taxes"] = df_income_ts.at[idx, "Pretax Income"] - df_income_ts.at[idx, "Net Income"]
-
-        # Creazione della riga TTM a partire dai dati trimestrali se non siamo in demo mode
-        if not st.session_state.demo_mode:
-            try:
-                company = yf.Ticker(st.session_state.ticker)
-                q_financials = company.quarterly_financials
-                if q_financials is not None and not q_financials.empty:
-                    ttm_series = q_financials.iloc[:, :4].sum(axis=1)
-                    ttm_df_temp = pd.DataFrame([ttm_series])
-                    ttm_mapped = evaluate_mapping_latest(ttm_df_temp, income_mapping_user)
-
-                    # Aggiustamento per TTM: se 'Gross Profit' non è disponibile, lo calcola come Revenue - Total COGS
-                    if (ttm_mapped.get("Gross Profit") is None or pd.isna(ttm_mapped.get("Gross Profit"))) and \
-                       (ttm_mapped.get("Revenue") is not None and ttm_mapped.get("Total COGS") is not None):
-                        ttm_mapped["Gross Profit"] = ttm_mapped["Revenue"] - ttm_mapped["Total COGS"]
-
-                    sg_a = ttm_mapped.get("SG&A", 0)
-                    r_and_d = ttm_mapped.get("R&D", 0)
-                    s_and_m = ttm_mapped.get("S&M", 0)
-                    ttm_mapped["Operating Expenses"] = sg_a + r_and_d + s_and_m
-                    if (ttm_mapped.get("Operating Income") is None or pd.isna(ttm_mapped.get("Operating Income"))) and \
-                       ttm_mapped.get("Gross Profit") is not None:
-                        ttm_mapped["Operating Income"] = ttm_mapped["Gross Profit"] - ttm_mapped["Operating Expenses"]
-                    if (ttm_mapped.get("Taxes") is None or pd.isna(ttm_mapped.get("Taxes"))) and \
-                       ttm_mapped.get("Pretax Income") is not None and ttm_mapped.get("Net Income") is not None:
-                        ttm_mapped["Taxes"] = ttm_mapped["Pretax Income"] - ttm_mapped["Net Income"]
-
-                    # Calcolo del margine lordo per il TTM
-                    if ttm_mapped.get("Revenue") and ttm_mapped.get("Revenue") != 0:
-                        ttm_mapped["Gross Margin"] = (ttm_mapped["Gross Profit"] / ttm_mapped["Revenue"]) * 100
-                    else:
-                        ttm_mapped["Gross Margin"] = None
-                        ttm_mapped["Net Income Y/Y"] = None
-                        ttm_mapped["Revenue Y/Y"] = None
-
-                    # Creazione della riga TTM
-                    ttm_df = pd.DataFrame(ttm_mapped, index=["TTM"])
-
-                    # Concatena la riga TTM in cima al timeseries annuale
-                    df_income_full = pd.concat([ttm_df, df_income_ts])
-                else:
-                    st.warning("Dati trimestrali non disponibili. Si utilizzeranno solo i dati annuali.")
-                    df_income_full = df_income_ts.copy()
-            except Exception as e:
-                st.warning(f"Impossibile calcolare TTM: {e}. Si utilizzeranno solo i dati annuali.")
-                df_income_full = df_income_ts.copy()
-        else:
-            # In modalità demo, usa solo i dati annuali
-            df_income_full = df_income_ts.copy()
-
-        # Calcolo delle variazioni Y/Y per tutte le righe (escluso temporaneamente TTM)
-        df_income_full_sorted = df_income_full.copy()
-        if "TTM" in df_income_full_sorted.index:
-            regular_years = df_income_full_sorted.drop("TTM")
-        else:
-            regular_years = df_income_full_sorted
-
-        # Converti l'indice in datetime per garantire l'ordinamento corretto
-        regular_years.index = pd.to_datetime(regular_years.index, errors='coerce')
-
-        # Ordina per data dal più vecchio al più recente
-        regular_years_sorted = regular_years.sort_index(ascending=True)
-
-        # Calcola le variazioni YoY: pct_change confronta ogni riga con la precedente
-        regular_years_sorted["Revenue Y/Y"] = regular_years_sorted["Revenue"].pct_change() * 100
-        regular_years_sorted["Net Income Y/Y"] = regular_years_sorted["Net Income"].pct_change() * 100
-
-        # Riordina dal più recente al più vecchio
-        regular_years_final = regular_years_sorted.sort_index(ascending=False)
-
-        # Aggiorna il dataframe originale per le righe regolari
-        df_income_full.loc[regular_years_final.index, "Revenue Y/Y"] = regular_years_final["Revenue Y/Y"]
-        df_income_full.loc[regular_years_final.index, "Net Income Y/Y"] = regular_years_final["Net Income Y/Y"]
-
-        # Calcola le variazioni Y/Y per la riga TTM confrontandola con il primo anno annuale
-        if "TTM" in df_income_full.index and len(df_income_full) > 1:
-            next_annual = df_income_full.iloc[1]
-            if pd.notna(next_annual["Revenue"]) and next_annual["Revenue"] != 0:
-                df_income_full.at["TTM", "Revenue Y/Y"] = ((df_income_full.at["TTM", "Revenue"] / next_annual["Revenue"]) - 1) * 100
-            else:
-                df_income_full.at["TTM", "Revenue Y/Y"] = None
-            if pd.notna(next_annual["Net Income"]) and next_annual["Net Income"] != 0:
-                df_income_full.at["TTM", "Net Income Y/Y"] = ((df_income_full.at["TTM", "Net Income"] / next_annual["Net Income"]) - 1) * 100
-            else:
-                df_income_full.at["TTM", "Net Income Y/Y"] = None
-
-        # Calcolo dei margini
-        df_income_full["Gross Margin"] = df_income_full.apply(
-            lambda row: (row["Gross Profit"] / row["Revenue"] * 100) if pd.notna(row["Revenue"]) and row["Revenue"] != 0 else None,
-            axis=1
-        )
-        df_income_full["Net Margin"] = df_income_full.apply(
-            lambda row: (row["Net Income"] / row["Revenue"] * 100) if pd.notna(row["Revenue"]) and row["Revenue"] != 0 else None,
-            axis=1
-        )
-        df_income_full["Operating Margin"] = df_income_full.apply(
-            lambda row: (row["Operating Income"] / row["Revenue"] * 100) if pd.notna(row["Revenue"]) and row["Revenue"] != 0 else None,
-            axis=1
-        )
-        df_income_full["Tax Percentage"] = df_income_full.apply(
-            lambda row: (row["Taxes"] / row["Pretax Income"] * 100) if pd.notna(row["Pretax Income"]) and row["Pretax Income"] != 0 else None,
-            axis=1
+    """
+    Analisi memorizzata per ticker, statement, mapping e modalità demo: ai rerun senza
+    modifiche riusa lo stato della sessione, altrimenti i risultati condivisi tra sessioni
+    (get_analysis_cache); se mancano la calcola, dopo un cambio di mapping ricalcolando
+    solo i target modificati e le metriche che ne dipendono.
+    """
+    previous = session_data.analysis_state
+    key = (st.session_state.ticker, current_statement_key(),
+           mapping_hash(st.session_state.income_mapping_user), st.session_state.demo_mode)
+    cache = get_analysis_cache()
+    unchanged = previous is not None and previous["key"] == key
+    shared = None if unchanged else cache.get(key)
+    if unchanged:
+        increment("analysis_requests", result="session")
+        state = dict(previous, affected=set())
+    elif shared is not None:
+        increment("analysis_requests", result="shared")
+        # Risultati di un'altra analisi con gli statement della sessione; senza "mapped" e
+        # "derived" il prossimo cambio di mapping ricalcola tutto (e i grafici si ricostruiscono)
+        state = dict(shared, annual=session_data.annual_income_statement,
+                     quarterly=session_data.quarterly_data, mapped=None, derived=None, affected=None)
+    else:
+        increment("analysis_requests", result="computed")
+        with st.spinner("Elaborazione dati in corso..."):
+            state = update_income_analysis(
+                previous,
+                session_data.annual_income_statement,
+                session_data.quarterly_data,
+                st.session_state.income_mapping_user,
+                include_ttm=not st.session_state.demo_mode
+            )
+        cache.put(key, state)
+    state["key"] = key
+    session_data.analysis_state = state
+    
+    for entries in state["messages"].values():
+        for kind, msg in entries:
+            (st.error if kind == "error" else st.warning)(msg)
+    return state["df_income_full"], state["df_income_display"]
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def get_quarterly_analysis(statement_key, mapping_key, _quarterly_df, _mapping):
+    """Analisi sul TTM mobile di ogni trimestre, calcolata una volta per statement e mapping"""
+    messages = []
+    df_income_full, df_income_display = analyze_quarterly_statement(
+        _quarterly_df, _mapping,
+        on_error=lambda msg: messages.append(("error", msg)),
+        on_warning=lambda msg: messages.append(("warning", msg))
+    )
+    return df_income_full, df_income_display, messages
+
+def perform_quarterly_analysis():
+    """Analisi trimestrale (TTM mobile) con i messaggi di valutazione del mapping"""
+    with st.spinner("Elaborazione dati trimestrali in corso..."):
+        df_income_full, df_income_display, messages = get_quarterly_analysis(
+            current_statement_key(),
+            mapping_hash(st.session_state.income_mapping_user),
+            session_data.quarterly_data,
+            st.session_state.income_mapping_user
         )
+    for kind, msg in messages:
+        (st.error if kind == "error" else st.warning)(msg)
+    return df_income_full, df_income_display
+
+def download_buttons(df, file_stem):
+    """Download dei valori numerici nei formati disponibili; il file viene generato solo al click"""
+    formats = available_formats()
+    for column, fmt in zip(st.columns(len(formats)), formats):
+        extension, mime = EXPORT_FORMATS[fmt]
+        with column:
+            st.download_button(
+                label=f"Download {fmt.upper()}",
+                data=lambda fmt=fmt: export_bytes(df, fmt),
+                file_name=f'{file_stem}{extension}',
+                mime=mime,
+                on_click="ignore",
+                key=f"download_{fmt}",
+            )
 
-        # Riordino delle colonne finali
-        desired_columns = [
-            "Revenue", "Total COGS", "Gross Profit", "SG&A", "R&D", "Operating Income",
-            "Pretax Income", "Taxes", "Tax Percentage", "Net Income", "EPS", "Net Interest Income",
-            "Net Margin", "Operating Margin", "Net Income Y/Y", "Revenue Y/Y", "Gross Margin"
-        ]
-        df_income_full = df_income_full.reindex(columns=[col for col in desired_columns if col in df_income_full.columns])
-
-        # Conversione in MILIONI
-        amount_columns = ["Revenue", "Total COGS", "Gross Profit", "SG&A", "R&D",
-                          "Operating Income", "Pretax Income", "Taxes", "Net Income", "Net Interest Income"]
-        df_income_display = df_income_full.copy()
-        for col in amount_columns:
-            if col in df_income_display.columns:
-                df_income_display[col] = df_income_display[col] / 1e6
-
-        return df_income_full, df_income_display
-
+def render_debug_panel():
+    """Pannello nella sidebar con tempi delle fasi, hit ratio della cache ed export Prometheus"""
+    with st.sidebar.expander("Debug prestazioni", expanded=False):
+        spans = default_registry.spans()
+        counters = default_registry.counters()
+        
+        hit_ratio = default_registry.hit_ratio("statement_cache_requests", hit_values=("hit", "stale"))
+        col1, col2 = st.columns(2)
+        col1.metric("Hit ratio cache", f"{hit_ratio:.0%}" if hit_ratio is not None else "N/A")
+        runs = spans[spans["Span"] == "script_run"]
+        col2.metric("p95 esecuzione", f"{runs['p95 (s)'].max():.2f}s" if not runs.empty else "N/A")
+        sessions, session_mb = get_session_memory().summary()
+        st.caption(f"Sessioni attive: {sessions} | memoria stimata dei dati: {session_mb:.1f} MB")
+        
+        st.markdown("**Span** (secondi)")
+        st.dataframe(spans.drop(columns=["Totale (s)"]).round(4), hide_index=True, use_container_width=True)
+        if not counters.empty:
+            st.markdown("**Contatori**")
+            st.dataframe(counters, hide_index=True, use_container_width=True)
         
+        st.download_button(
+            label="Export Prometheus",
+            data=default_registry.prometheus_text(),
+            file_name="metrics.prom",
+            mime="text/plain",
+        )
+        if st.button("Azzera misure"):
+            default_registry.reset()
+
+get_prefetcher()
 
 ###############################################
 # INTERFACCIA UTENTE CON SIDEBAR
@@ -918,14 +671,84 @@ if st.session_state.step == 'input':
         st.text_input("Ticker (es. AAPL):", value="AAPL", key="ticker_input")
     with col2:
         st.button("Analizza", on_click=save_ticker_input)
+    
+    with st.expander("Analisi batch di più ticker"):
+        st.text_area("Ticker separati da virgola, spazio o a capo:", key="batch_input",
+                     placeholder="AAPL, MSFT, GOOGL")
+        st.info("Verrà applicato il mapping dell'ultima analisi, se presente; "
+                "altrimenti la prima candidata disponibile per ciascuna voce.")
+        st.button("Avvia analisi batch", on_click=save_batch_input)
+
+# Modalità batch: più ticker con lo stesso mapping
+elif st.session_state.step == 'batch':
+    tickers = st.session_state.batch_tickers
+    st.header(f"Analisi batch ({len(tickers)} ticker)")
+    
+    if not tickers:
+        st.warning("Nessun ticker inserito.")
+    else:
+        # Il risultato viene conservato per non ripetere il batch a ogni rerun
+        if session_data.batch_result is None:
+            if not st.session_state.demo_mode:
+                # Le info (settore e industria per il confronto con i peer) arrivano in cache
+                # mentre gira il batch, senza allungarlo
+                for ticker in tickers:
+                    get_fetch_service().submit(ticker, "info")
+            with st.spinner(f"Analisi di {len(tickers)} ticker in corso..."):
+                started = time.perf_counter()
+                with span("step", step="batch"):
+                    summary, results = run_batch(
+                        tickers,
+                        saved_mapping=st.session_state.income_mapping_user,
+                        cache=get_statement_cache(),
+                        demo=st.session_state.demo_mode,
+                        panel_store=None if st.session_state.demo_mode else get_panel_store(),
+                        registry=None if st.session_state.demo_mode else get_mapping_registry(),
+                        service=None if st.session_state.demo_mode else get_fetch_service()
+                    )
+                session_data.batch_result = (summary, results, time.perf_counter() - started)
+                if not st.session_state.demo_mode:
+                    get_peer_panel().refresh(list(summary.loc[summary["Stato"] != "Errore", "Ticker"]))
+        
+        summary, results, elapsed = session_data.batch_result
+        ok_count = int((summary["Stato"] != "Errore").sum())
+        st.success(f"Completati {ok_count} ticker su {len(summary)} in {elapsed:.1f}s")
+        
+        st.subheader("Stato per ticker")
+        st.dataframe(summary, hide_index=True, use_container_width=True)
+        
+        if not results.empty:
+            st.subheader("Risultati combinati (valori in milioni)")
+            st.dataframe(style_dataframe(results), use_container_width=True)
+            
+            download_buttons(results, 'batch_income_statement_analysis')
+    
+    if st.button("Torna all'inizio"):
+        st.session_state.step = 'input'
+        st.rerun()
 
 # STEP 2: Caricamento dati
 elif st.session_state.step == 'load_data':
-    annual_income_statement = load_ticker_data()
+    with span("step", step="load_data"):
+        annual_income_statement, quarterly_income_statement = load_ticker_data()
     
     if annual_income_statement is not None:
-        st.session_state.annual_income_statement = annual_income_statement
-        st.session_state.step = 'mapping'
+        session_data.annual_income_statement = annual_income_statement
+        session_data.quarterly_data = quarterly_income_statement
+        # Dopo il rilascio dei dati della sessione si torna al passo in cui era, con lo stesso mapping
+        st.session_state.step = st.session_state.pop('resume_step', None) or 'mapping'
+        
+        # Layout già visto: il mapping accettato in precedenza evita il passo manuale
+        if st.session_state.step == 'mapping' and not st.session_state.demo_mode:
+            try:
+                suggestion = get_mapping_registry().suggest(
+                    st.session_state.ticker, list(annual_income_statement.columns)
+                )
+            except Exception:
+                suggestion = None
+            st.session_state.mapping_suggestion = suggestion
+            if suggestion is not None and suggestion.automatic:
+                apply_mapping_suggestion()
         st.rerun()
 
 # STEP 3: Configurazione del mapping
@@ -947,7 +770,12 @@ elif st.session_state.step == 'mapping':
             st.markdown(f"**Prezzo attuale:** ${info.get('currentPrice', 'N/A')} | **Market Cap:** ${info.get('marketCap', 0)/1e9:.2f}B")
     
     st.subheader("Record più recente dell'Income Statement Annuale")
-    st.dataframe(pd.DataFrame(st.session_state.annual_income_statement.iloc[0]).T)
+    st.dataframe(pd.DataFrame(session_data.annual_income_statement.iloc[0]).T)
+    
+    suggestion = st.session_state.mapping_suggestion
+    if suggestion is not None:
+        st.info(f"Mapping suggerito dal registro: {suggestion.describe()}")
+        st.button("Applica mapping suggerito", on_click=accept_mapping_suggestion)
     
     if st.button("Configura mapping"):
         st.session_state.step = 'mapping_config'
@@ -957,13 +785,16 @@ elif st.session_state.step == 'mapping':
 elif st.session_state.step == 'mapping_config':
     st.header(f"Mappatura dettagliata per {st.session_state.ticker}")
     
-    mapping_result = streamlit_mapping_complex(
-        st.session_state.annual_income_statement, 
-        config["income_mapping"]
-    )
+    with span("step", step="mapping_config"):
+        mapping_result = streamlit_mapping_complex(
+            session_data.annual_income_statement, 
+            config["income_mapping"]
+        )
     
     if st.button("Applica mapping e procedi con l'analisi"):
         st.session_state.income_mapping_user = mapping_result
+        st.session_state.mapping_suggestion = None
+        remember_mapping(mapping_result)
         st.session_state.step = 'analyze'
         st.rerun()
 
@@ -988,30 +819,82 @@ elif st.session_state.step == 'analyze':
     if st.session_state.demo_mode:
         st.info("⚠️ Visualizzando dati demo. I dati potrebbero non essere aggiornati.")
     
+    suggestion = st.session_state.mapping_suggestion
+    if suggestion is not None:
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            st.info(f"Mapping applicato dal registro: {suggestion.describe()}")
+        with col2:
+            if st.button("Modifica mapping"):
+                st.session_state.step = 'mapping_config'
+                st.rerun()
+    
+    # La modalità trimestrale richiede i dati trimestrali (assenti in modalità demo)
+    if session_data.quarterly_data is not None:
+        st.radio("Periodicità", PERIOD_MODES, key="period_mode", horizontal=True)
+    quarterly_mode = (session_data.quarterly_data is not None
+                      and st.session_state.get("period_mode") == PERIOD_MODES[1])
+    
     try:
-        df_income_full, df_income_display = perform_analysis()
+        with span("step", step="analyze"):
+            if quarterly_mode:
+                df_income_full, df_income_display = perform_quarterly_analysis()
+            else:
+                df_income_full, df_income_display = perform_analysis()
+        if not quarterly_mode:
+            # L'archivio è organizzato per esercizio: vi si salvano solo le analisi annuali
+            with span("panel_store"):
+                store_analysis(st.session_state.ticker, df_income_full, info)
         
-        st.subheader("Income Statement Finale (valori in milioni)")
-        st.dataframe(format_dataframe(df_income_display), use_container_width=True)
+        if quarterly_mode:
+            st.subheader("Income Statement TTM per trimestre (valori in milioni)")
+        else:
+            st.subheader("Income Statement Finale (valori in milioni)")
+        with span("render_dataframe"):
+            st.dataframe(style_dataframe(df_income_display), use_container_width=True)
         
         # Visualizzazioni aggiuntive con Plotly
         st.subheader("Analisi Grafica")
         
-        if "TTM" in df_income_full.index:
-            chart_data = df_income_full.drop("TTM")
+        # Grafici in cache per ticker, statement e mapping: tornando a un mapping già
+        # visto non vengono ricostruiti; altrimenti si aggiornano solo le tracce ricalcolate
+        chart_key = (st.session_state.ticker, current_statement_key(),
+                     mapping_hash(st.session_state.income_mapping_user), quarterly_mode)
+        chart_cache = session_data.chart_cache
+        if chart_key in chart_cache:
+            chart_cache.move_to_end(chart_key)
         else:
-            chart_data = df_income_full.copy()
-        
-        fig1, fig2, fig3 = create_charts(chart_data)
+            # Import differito: Plotly (e la validazione dei template) serve solo qui
+            from charts import create_charts
+            if "TTM" in df_income_full.index:
+                chart_data = df_income_full.drop("TTM")
+            else:
+                chart_data = df_income_full
+            
+            if quarterly_mode:
+                chart_cache[chart_key] = create_charts(chart_data)
+            else:
+                chart_cache[chart_key] = create_charts(
+                    chart_data,
+                    previous=session_data.charts,
+                    affected=session_data.analysis_state["affected"]
+                )
+            while len(chart_cache) > CHART_CACHE_SIZE:
+                chart_cache.popitem(last=False)
+        fig1, fig2, fig3 = chart_cache[chart_key]
+        if not quarterly_mode:
+            # Base per l'aggiornamento incrementale dei grafici annuali
+            session_data.charts = (fig1, fig2, fig3)
         
         tab1, tab2, tab3 = st.tabs(["Revenue & Net Income", "Margini di Profitto", "Crescita YoY"])
         
-        with tab1:
-            st.plotly_chart(fig1, use_container_width=True)
-        with tab2:
-            st.plotly_chart(fig2, use_container_width=True)
-        with tab3:
-            st.plotly_chart(fig3, use_container_width=True)
+        with span("render_charts"):
+            with tab1:
+                st.plotly_chart(fig1, use_container_width=True)
+            with tab2:
+                st.plotly_chart(fig2, use_container_width=True)
+            with tab3:
+                st.plotly_chart(fig3, use_container_width=True)
         
         # Show key metrics if we have at least one row of data
         if len(df_income_full) > 0:
@@ -1048,14 +931,13 @@ elif st.session_state.step == 'analyze':
                     net_margin = float(net_margin.strip('%'))
                 st.metric("Margine Netto", f"{net_margin:.2f}%")
         
+        if not quarterly_mode and not st.session_state.demo_mode:
+            with span("peer_comparison"):
+                render_peer_comparison(st.session_state.ticker)
+        
         # Opzione per scaricare i dati
-        csv = format_dataframe(df_income_display).to_csv().encode('utf-8')
-        st.download_button(
-            label="Download CSV",
-            data=csv,
-            file_name=f'{st.session_state.ticker}_income_statement_analysis.csv',
-            mime='text/csv',
-        )
+        file_stem = f'{st.session_state.ticker}_income_statement_analysis'
+        download_buttons(df_income_display, f'{file_stem}_quarterly' if quarterly_mode else file_stem)
         
         if st.button("Ricomincia con un nuovo ticker"):
             st.session_state.step = 'input'
@@ -1070,4 +952,8 @@ elif st.session_state.step == 'analyze':
 
 # Footer
 st.markdown("---")
-st.markdown("Creato con ❤️ usando Streamlit e yfinance")
\ No newline at end of file
+st.markdown("Creato con ❤️ usando Streamlit e yfinance")
+
+record("script_run", time.perf_counter() - run_started, step=run_step)
+if SHOW_DEBUG_PANEL:
+    render_debug_panel()
\ No newline at end of file
@@ -0,0 +1,218 @@
+"""
+Analisi batch di una lista di ticker (es. una watchlist).
+
+Gli statement vengono scaricati in parallelo con un thread pool (I/O, soggetto
+allo scheduler condiviso), mentre l'analisi di ciascun ticker gira in un
+process pool. Il risultato è una tabella riassuntiva con stato e tempi per
+ticker, più la tabella combinata delle analisi.
+"""
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+from analysis import analyze_income_statement, analyze_quarterly_statement, config, to_millions
+from column_index import build_column_index
+from fetch_scheduler import MAX_CONCURRENCY
+from data_sources import DemoProvider
+from fetch_service import STATEMENT_KINDS, FetchService
+from mapping_registry import referenced_columns
+
+BATCH_PROCESSES = int(os.environ.get("BATCH_PROCESSES", os.cpu_count() or 1))
+
+
+def parse_tickers(text):
+    """Estrae i ticker da un testo separato da virgole, spazi o a capo (senza duplicati)."""
+    tickers = []
+    for token in re.split(r'[\s,;]+', text or ""):
+        token = token.strip().upper()
+        if token and token not in tickers:
+            tickers.append(token)
+    return tickers
+
+
+def read_tickers_file(path):
+    """Legge i ticker da file, ignorando commenti e righe vuote."""
+    with open(path, encoding="utf-8") as f:
+        lines = [line.split("#", 1)[0] for line in f]
+    return parse_tickers("\n".join(lines))
+
+
+def default_mapping(columns, mapping_config=None):
+    """
+    Per ogni target usa la prima candidata presente tra le colonne (anche con nome
+    normalizzato, es. maiuscole o '&'), altrimenti None.
+    """
+    mapping_config = mapping_config or config["income_mapping"]
+    index = build_column_index(columns)
+    mapping = {}
+    for target, candidates in mapping_config.items():
+        available = index.resolve_candidates(candidates)
+        mapping[target] = available[0] if available else None
+    return mapping
+
+
+def resolve_mapping(saved_mapping, columns, mapping_config=None):
+    """
+    Adatta un mapping salvato alle colonne di un ticker: le voci che fanno
+    riferimento a colonne assenti ricadono sulla prima candidata disponibile.
+    """
+    mapping = default_mapping(columns, mapping_config)
+    for target, expr in (saved_mapping or {}).items():
+        if expr is None:
+            continue
+        if all(col in columns for col in referenced_columns(expr)):
+            mapping[target] = expr
+    return mapping
+
+
+def load_statements(ticker, cache=None, demo=False, service=None, provider=None):
+    """
+    Restituisce (annuale, trimestrale) con i periodi dal più recente, recuperati in
+    parallelo dalla sorgente dati (di default DATA_SOURCE) e passando dalla cache
+    persistente se fornita. Se service (FetchService) è fornito si usa quello, con
+    la sua sorgente e la sua cache. In modalità demo il trimestrale è None.
+    """
+    if demo:
+        return DemoProvider().financials(ticker).T.sort_index(ascending=False), None
+
+    owned = service is None
+    if owned:
+        service = FetchService(cache, max_workers=len(STATEMENT_KINDS), provider=provider)
+    try:
+        fetched = service.fetch_many(ticker, STATEMENT_KINDS)
+    finally:
+        if owned:
+            service.shutdown(wait=False)
+
+    financials = fetched["financials"]
+    if isinstance(financials, Exception):
+        raise financials
+    if financials is None or financials.empty:
+        raise ValueError(f"Nessun dato finanziario disponibile per {ticker}")
+    q_financials = fetched.get("quarterly_financials")
+    if isinstance(q_financials, Exception):
+        q_financials = None
+    quarterly = None
+    if q_financials is not None and not q_financials.empty:
+        quarterly = q_financials.T.sort_index(ascending=False)
+    return financials.T.sort_index(ascending=False), quarterly
+
+
+def _analyze_ticker(annual, quarterly, saved_mapping, include_ttm, quarterly_mode=False):
+    """Eseguita nel process pool: analisi di un singolo ticker con messaggi raccolti."""
+    started = time.perf_counter()
+    messages = []
+    mapping = resolve_mapping(saved_mapping, list(annual.columns))
+    if quarterly_mode:
+        df_income_full, _ = analyze_quarterly_statement(
+            quarterly, mapping,
+            on_error=messages.append,
+            on_warning=messages.append
+        )
+    else:
+        df_income_full, _ = analyze_income_statement(
+            annual, quarterly, mapping,
+            include_ttm=include_ttm,
+            on_error=messages.append,
+            on_warning=messages.append
+        )
+    return df_income_full, messages, time.perf_counter() - started
+
+
+def run_batch(tickers, saved_mapping=None, cache=None, demo=False, include_ttm=True,
+              in_millions=True, panel_store=None, fetch_workers=MAX_CONCURRENCY,
+              processes=BATCH_PROCESSES, registry=None, quarterly=False, service=None, provider=None):
+    """
+    Analizza tutti i ticker. Restituisce (summary, results): summary ha una riga per
+    ticker con stato, messaggi, mapping usato e tempi; results concatena le analisi con
+    indice (Ticker, Periodo), con gli importi in milioni se in_millions è True.
+    Se panel_store è fornito, ogni analisi riuscita viene anche salvata nell'archivio.
+    Se registry (MappingRegistry) è fornito, i ticker con un mapping riconosciuto con
+    confidenza sufficiente usano quello al posto di saved_mapping.
+    Con quarterly=True ogni ticker viene analizzato sul TTM mobile di ogni trimestre
+    (periodi trimestrali); queste analisi non vengono salvate nell'archivio, che è per esercizio.
+    Se service (FetchService) è fornito, i recuperi si uniscono a quelli già in corso
+    per gli stessi ticker (es. di altre sessioni); altrimenti si usa un servizio sulla
+    cache e sulla sorgente provider (DataProvider, di default DATA_SOURCE).
+    """
+    status = {ticker: {"Ticker": ticker, "Stato": "OK", "Messaggi": "", "Periodi": 0,
+                       "Mapping": "ultimo mapping" if saved_mapping else "predefinito",
+                       "Fetch (s)": None, "Analisi (s)": None} for ticker in tickers}
+    statements = {}
+    owned = service is None and not demo
+    if owned:
+        service = FetchService(cache, provider=provider)
+
+    def timed_load(ticker):
+        started = time.perf_counter()
+        try:
+            return load_statements(ticker, cache, demo, service), None, time.perf_counter() - started
+        except Exception as e:
+            return None, e, time.perf_counter() - started
+
+    # Fase 1: fetch concorrente (I/O)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(fetch_workers, len(tickers) or 1))) as pool:
+            for ticker, (loaded, error, elapsed) in zip(tickers, pool.map(timed_load, tickers)):
+                status[ticker]["Fetch (s)"] = round(elapsed, 3)
+                if error is not None:
+                    status[ticker]["Stato"] = "Errore"
+                    status[ticker]["Messaggi"] = str(error)
+                else:
+                    statements[ticker] = loaded
+    finally:
+        if owned:
+            service.shutdown(wait=False)
+
+    # Fase 2: analisi in parallelo su più processi (CPU)
+    results = {}
+
+    def record(ticker, outcome):
+        try:
+            df_result, messages, elapsed = outcome()
+        except Exception as e:
+            status[ticker]["Stato"] = "Errore"
+            status[ticker]["Messaggi"] = str(e)
+            return
+        if panel_store is not None and not quarterly:
+            try:
+                panel_store.append(ticker, df_result)
+            except Exception as e:
+                messages.append(f"Salvataggio nell'archivio non riuscito: {e}")
+        results[ticker] = to_millions(df_result) if in_millions else df_result
+        status[ticker]["Periodi"] = len(df_result)
+        status[ticker]["Analisi (s)"] = round(elapsed, 3)
+        if messages:
+            status[ticker]["Stato"] = "Avvisi"
+            status[ticker]["Messaggi"] = " | ".join(messages)
+
+    jobs = []
+    for ticker, (annual, quarterly_statement) in statements.items():
+        ticker_mapping = saved_mapping
+        if registry is not None:
+            suggestion = registry.suggest(ticker, annual.columns)
+            if suggestion is not None and suggestion.automatic:
+                ticker_mapping = suggestion.mapping
+                status[ticker]["Mapping"] = f"registro: {suggestion.describe()}"
+        jobs.append((ticker, annual, quarterly_statement, ticker_mapping, include_ttm and not demo, quarterly))
+    if processes > 1 and len(jobs) > 1:
+        # "spawn" evita di duplicare con fork i thread del server Streamlit
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(processes, len(jobs)), mp_context=context) as pool:
+            futures = {job[0]: pool.submit(_analyze_ticker, *job[1:]) for job in jobs}
+            for ticker, future in futures.items():
+                record(ticker, future.result)
+    else:
+        for ticker, *args in jobs:
+            record(ticker, lambda: _analyze_ticker(*args))
+
+    summary = pd.DataFrame(list(status.values()))
+    if results:
+        combined = pd.concat(results, names=["Ticker", "Periodo"])
+    else:
+        combined = pd.DataFrame()
+    return summary, combined
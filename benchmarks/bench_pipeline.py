@@ -0,0 +1,192 @@
+"""
+Benchmark offline della pipeline di mapping e analisi.
+
+Gli statement vengono sintetizzati a partire da DEMO_FINANCIAL_DATA e scalati
+in numero di ticker, di periodi e di voci di bilancio, così ogni fase gira
+senza rete. Per ciascuna fase si misurano il tempo (mediana delle ripetizioni)
+e il picco di memoria (tracemalloc); i risultati si confrontano con le soglie
+di regressione in thresholds.json. Le soglie sono calibrate sulla mediana
+misurata, moltiplicata per 2.5 per i tempi e per 1.5 per il picco di memoria
+(vedi "_calibrazione" nel file): per ricalibrare, eseguire ogni scala con
+--output e applicare gli stessi fattori.
+
+Esempi:
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --scale large --output risultati.json
+    python benchmarks/bench_pipeline.py --compare risultati_precedenti.json --tolerance 1.2
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from analysis import (  # noqa: E402
+    analyze_income_statement, analyze_quarterly_statement, compute_income_mapping_timeseries,
+    format_dataframe, style_dataframe, to_millions
+)
+from charts import create_charts  # noqa: E402
+from export import export_file  # noqa: E402
+from financial_data import DEMO_FINANCIAL_DATA  # noqa: E402
+
+THRESHOLDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "thresholds.json")
+
+# Numero di ticker, anni e voci aggiuntive (oltre a quelle demo) per ciascuna scala
+SCALES = {
+    "small": {"tickers": 10, "years": 8, "extra_items": 20},
+    "medium": {"tickers": 100, "years": 20, "extra_items": 100},
+    "large": {"tickers": 500, "years": 40, "extra_items": 300},
+}
+
+# Mapping rappresentativo: colonne dirette ed espressioni aritmetiche
+BENCH_MAPPING = {
+    "Revenue": "Revenue",
+    "Total COGS": "Cost Of Revenue",
+    "Gross Profit": None,
+    "SG&A": "`Selling General And Administration`",
+    "R&D": "Research And Development",
+    "S&M": "`Extra Item 1` + `Extra Item 2` * 0.5",
+    "Operating Income": "Operating Income",
+    "Pretax Income": "Pretax Income",
+    "Taxes": "`Pretax Income` - `Net Income`",
+    "Net Income": "Net Income",
+    "EPS": "Diluted EPS",
+    "Net Interest Income": "`Extra Item 3` - `Extra Item 4` / 2",
+}
+
+
+def synthesize_statements(tickers, years, extra_items, seed=0):
+    """
+    Genera {ticker: (annuale, trimestrale)} nel formato usato dall'app (periodi dal più
+    recente). I valori partono dai dati demo e vengono estesi all'indietro con rumore.
+    """
+    rng = np.random.default_rng(seed)
+    demo = list(DEMO_FINANCIAL_DATA.values())
+    statements = {}
+    for i in range(tickers):
+        base = demo[i % len(demo)]["financials"]
+        items = {name: values[0] for name, values in base.items()}
+        items.update({f"Extra Item {k}": rng.uniform(1e8, 1e10) for k in range(1, extra_items + 1)})
+        names = list(items)
+        latest = np.array([items[name] for name in names], dtype=float)
+
+        # Un fattore di crescita per periodo: i valori più vecchi sono più piccoli
+        annual_growth = rng.normal(1.06, 0.08, size=years)
+        annual_scale = np.cumprod(np.r_[1.0, 1 / annual_growth[:-1]])
+        annual_values = latest[None, :] * annual_scale[:, None] * rng.normal(1, 0.02, (years, len(names)))
+        annual_dates = pd.date_range(end="2024-12-31", periods=years, freq="YE")[::-1]
+        annual = pd.DataFrame(annual_values, index=annual_dates, columns=names)
+
+        quarters = years * 4
+        quarterly_values = np.repeat(annual_values / 4, 4, axis=0) * rng.normal(1, 0.05, (quarters, len(names)))
+        quarterly_dates = pd.date_range(end="2025-06-30", periods=quarters, freq="QE")[::-1]
+        quarterly = pd.DataFrame(quarterly_values, index=quarterly_dates, columns=names)
+
+        statements[f"T{i:04d}"] = (annual, quarterly)
+    return statements
+
+
+def measure(fn, repeat):
+    """Esegue fn `repeat` volte: restituisce (mediana dei secondi, picco di memoria in MB, risultato)."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings), peak / 1e6, result
+
+
+def run_benchmarks(scale, repeat):
+    params = SCALES[scale]
+    statements = synthesize_statements(params["tickers"], params["years"], params["extra_items"])
+    inputs = list(statements.values())
+
+    def mapping_stage():
+        return [compute_income_mapping_timeseries(annual, BENCH_MAPPING) for annual, _ in inputs]
+
+    def analysis_stage():
+        return [analyze_income_statement(annual, quarterly, BENCH_MAPPING)[0] for annual, quarterly in inputs]
+
+    def quarterly_stage():
+        return [analyze_quarterly_statement(quarterly, BENCH_MAPPING)[0] for _, quarterly in inputs]
+
+    results = {}
+    results["compute_income_mapping_timeseries"] = measure(mapping_stage, repeat)
+    results["analyze_income_statement"] = measure(analysis_stage, repeat)
+    results["analyze_quarterly_statement"] = measure(quarterly_stage, repeat)
+    analysed = results["analyze_income_statement"][2]
+    displays = [to_millions(df) for df in analysed]
+    results["format_dataframe"] = measure(lambda: [format_dataframe(df) for df in displays], repeat)
+    results["style_dataframe"] = measure(lambda: [style_dataframe(df).to_html() for df in displays], repeat)
+    combined = pd.concat(dict(zip(statements, displays)), names=["Ticker", "Periodo"])
+    results["export_csv"] = measure(lambda: export_file(combined, "csv").close(), repeat)
+    results["create_charts"] = measure(lambda: [create_charts(df.drop("TTM")) for df in analysed], repeat)
+
+    return {
+        stage: {"seconds": round(seconds, 4), "peak_mb": round(peak_mb, 2)}
+        for stage, (seconds, peak_mb, _) in results.items()
+    }
+
+
+def check(report, limits, tolerance=1.0):
+    """Confronta con i limiti {fase: {"seconds": ..., "peak_mb": ...}}; restituisce le regressioni."""
+    failures = []
+    for stage, measured in report.items():
+        for metric, limit in limits.get(stage, {}).items():
+            if measured[metric] > limit * tolerance:
+                failures.append(f"{stage}: {metric} {measured[metric]} > {limit * tolerance:.4g}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark della pipeline di analisi (offline)")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="medium")
+    parser.add_argument("--repeat", type=int, default=3, help="Ripetizioni per fase (default: %(default)s)")
+    parser.add_argument("--output", help="Salva i risultati in JSON (per il confronto tra release)")
+    parser.add_argument("--compare", help="JSON di un'esecuzione precedente da usare come soglia")
+    parser.add_argument("--tolerance", type=float, default=1.0,
+                        help="Moltiplicatore applicato alle soglie (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    params = SCALES[args.scale]
+    print(f"Scala '{args.scale}': {params['tickers']} ticker, {params['years']} anni, "
+          f"{params['extra_items']} voci aggiuntive")
+    report = run_benchmarks(args.scale, args.repeat)
+    for stage, measured in report.items():
+        print(f"  {stage:<36} {measured['seconds']:>9.4f}s  {measured['peak_mb']:>9.2f} MB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"scale": args.scale, "results": report}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        if previous.get("scale") != args.scale:
+            print(f"Attenzione: il confronto usa la scala '{previous.get('scale')}'")
+        limits = previous["results"]
+    else:
+        with open(THRESHOLDS_PATH, encoding="utf-8") as f:
+            limits = json.load(f).get(args.scale, {})
+
+    failures = check(report, limits, args.tolerance)
+    for failure in failures:
+        print(f"REGRESSIONE {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+Benchmark dell'avvio dell'app: avvio a freddo e tempi dei rerun.
+
+Ogni ripetizione gira in un processo Python nuovo (nessun modulo già
+importato), come all'avvio di un container, ed esegue app.py con lo script
+runner di test di Streamlit in modalità demo, senza rete. I tempi dello script
+sono quelli dello span "script_run" registrato dall'app (import compresi), non
+quelli del runner di test, che controlla la fine dell'esecuzione a intervalli:
+  - streamlit_import: import di Streamlit (costo fisso, non dipende dall'app)
+  - cold_run_input:   prima esecuzione dello script, step 'input'
+  - rerun_input:      mediana dei rerun successivi dello step 'input'
+  - input_to_analyze: esecuzioni dal click su "Analizza" allo step 'analyze' compreso
+Il report elenca anche i moduli pesanti già caricati allo step 'input', che
+dovrebbero essere importati solo dagli step che li usano (Streamlit importa
+comunque plotly.graph_objects, se installato). I tempi (mediana delle
+ripetizioni) si confrontano con le soglie "startup" di thresholds.json,
+calibrate come quelle della pipeline (vedi "_calibrazione" nel file).
+
+Esempi:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --repeat 5 --output avvio.json
+    python benchmarks/bench_startup.py --compare avvio_precedente.json --tolerance 1.2
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from bench_pipeline import check
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+THRESHOLDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "thresholds.json")
+
+# Moduli che lo step 'input' non dovrebbe caricare
+HEAVY_MODULES = ["charts", "plotly.express", "yfinance", "pyarrow.dataset", "panel_store"]
+
+# Script eseguito in ogni processo figlio: stampa le misure in JSON
+_CHILD = """
+import json, sys, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+streamlit_import = time.perf_counter() - started
+
+def script_runs():
+    from instrumentation import default_registry
+    spans = default_registry.spans()
+    runs = spans[spans["Span"] == "script_run"]
+    default_registry.reset()
+    return runs
+
+at = AppTest.from_file({app!r}, default_timeout=120)
+at.session_state.demo_mode = True
+at.run()
+cold_run_input = float(script_runs()["Totale (s)"].sum())
+loaded = [name for name in {heavy!r} if name in sys.modules]
+
+for _ in range({reruns}):
+    at.run()
+rerun_input = float(script_runs()["p50 (s)"].iloc[0])
+
+at.text_input(key="ticker_input").set_value("MSFT")
+at.button[0].click().run()
+at.run()
+while at.session_state.step != "analyze":
+    at.button[-1].click().run()
+input_to_analyze = float(script_runs()["Totale (s)"].sum())
+
+print(json.dumps({{
+    "streamlit_import": streamlit_import,
+    "cold_run_input": cold_run_input,
+    "rerun_input": rerun_input,
+    "input_to_analyze": input_to_analyze,
+    "loaded_at_input": loaded,
+}}))
+"""
+
+
+def run_child(workdir, reruns):
+    """Una misura completa in un processo nuovo, con cache e archivi in una directory temporanea."""
+    env = dict(
+        os.environ,
+        PREFETCH_ENABLED="0",
+        STATEMENT_CACHE_PATH=os.path.join(workdir, "statements.sqlite"),
+        MAPPING_REGISTRY_PATH=os.path.join(workdir, "mappings.sqlite"),
+        PANEL_STORE_PATH=os.path.join(workdir, "panel"),
+    )
+    code = _CHILD.format(app=os.path.join(ROOT, "app.py"), heavy=HEAVY_MODULES, reruns=reruns)
+    completed = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env,
+                               capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def run_benchmarks(repeat, reruns):
+    samples = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as workdir:
+            samples.append(run_child(workdir, reruns))
+    report = {
+        stage: {"seconds": round(statistics.median(sample[stage] for sample in samples), 4)}
+        for stage in ("streamlit_import", "cold_run_input", "rerun_input", "input_to_analyze")
+    }
+    return report, samples[-1]["loaded_at_input"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark dell'avvio a freddo e dei rerun dell'app")
+    parser.add_argument("--repeat", type=int, default=3, help="Processi misurati (default: %(default)s)")
+    parser.add_argument("--reruns", type=int, default=10,
+                        help="Rerun dello step 'input' per processo (default: %(default)s)")
+    parser.add_argument("--output", help="Salva i risultati in JSON (per il confronto tra release)")
+    parser.add_argument("--compare", help="JSON di un'esecuzione precedente da usare come soglia")
+    parser.add_argument("--tolerance", type=float, default=1.0,
+                        help="Moltiplicatore applicato alle soglie (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    report, loaded = run_benchmarks(args.repeat, args.reruns)
+    for stage, measured in report.items():
+        print(f"  {stage:<36} {measured['seconds']:>9.4f}s")
+    print(f"  moduli pesanti caricati allo step 'input': {', '.join(loaded) or 'nessuno'}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"results": report, "loaded_at_input": loaded}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            limits = json.load(f)["results"]
+    else:
+        with open(THRESHOLDS_PATH, encoding="utf-8") as f:
+            limits = json.load(f).get("startup", {})
+
+    failures = check(report, limits, args.tolerance)
+    for failure in failures:
+        print(f"REGRESSIONE {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Grafici Plotly dell'analisi, indipendenti da Streamlit.
+
+I grafici sono descritti in modo dichiarativo (CHART_SPECS): layout e tracce per
+colonna. I layout, compreso il template, vengono validati da Plotly una sola
+volta all'import; le figure si costruiscono poi da dizionari già validi senza
+ripetere la validazione, che è la parte più costosa della creazione. Le serie
+lunghe usano tracce WebGL.
+
+Configurazione tramite variabili d'ambiente:
+    CHART_WEBGL_POINTS  punti oltre i quali le linee usano Scattergl (WebGL)
+"""
+import os
+
+import pandas as pd
+import plotly.graph_objects as go
+
+from analysis import period_labels
+from instrumentation import timed
+
+WEBGL_POINTS = int(os.environ.get("CHART_WEBGL_POINTS", 1000))
+
+###############################################
+# FUNZIONE DI CREAZIONE GRAFICI CON PLOTLY
+###############################################
+
+# Layout e tracce (colonna, tipo, opzioni) di ciascun grafico
+CHART_SPECS = [
+    {
+        # Revenue & Net Income Chart
+        "layout": dict(title="Revenue & Net Income (in millions)", xaxis_title="Year",
+                       yaxis_title="Amount (in millions)", barmode='group'),
+        "traces": [
+            ("Revenue", "bar", dict(marker_color='rgb(55, 83, 109)')),
+            ("Net Income", "bar", dict(marker_color='rgb(26, 118, 255)')),
+        ],
+    },
+    {
+        # Margins & Tax Percentage Chart
+        "layout": dict(title="Profit Margins & Tax Percentage (%)", xaxis_title="Year",
+                       yaxis_title="Percentage (%)"),
+        "traces": [
+            ("Gross Margin", "line", {}),
+            ("Operating Margin", "line", {}),
+            ("Net Margin", "line", {}),
+            ("Tax Percentage", "line", dict(marker_color='rgb(255, 127, 14)')),  # Orange
+        ],
+    },
+    {
+        # YoY Growth Chart
+        "layout": dict(title="Year-over-Year Growth (%)", xaxis_title="Year", yaxis_title="Growth (%)"),
+        "traces": [
+            ("Revenue Y/Y", "line", {}),
+            ("Net Income Y/Y", "line", {}),
+        ],
+    },
+]
+
+# Colonne da cui dipende ciascun grafico: dopo un cambio di mapping si aggiornano
+# solo i grafici (e le tracce) che usano colonne ricalcolate
+CHART_COLUMNS = [{column for column, _, _ in spec["traces"]} for spec in CHART_SPECS]
+
+# Template validati una sola volta
+_LAYOUTS = [
+    go.Layout(legend=dict(x=0, y=1.0), template="plotly_white", **spec["layout"]).to_plotly_json()
+    for spec in CHART_SPECS
+]
+
+
+def _values(df, column):
+    """Valori numerici della colonna come array float64 (i grafici accettano solo numeri)."""
+    return pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=float)
+
+
+def _trace(column, kind, options, x, y):
+    if kind == "bar":
+        return dict(type="bar", x=x, y=y, name=column, **options)
+    # Oltre WEBGL_POINTS punti il rendering SVG diventa lento: si passa a WebGL
+    trace_type = "scattergl" if len(y) > WEBGL_POINTS else "scatter"
+    return dict(type=trace_type, x=x, y=y, mode='lines+markers', name=column, **options)
+
+
+def build_chart(index, df, reuse=None):
+    """
+    Costruisce il grafico index di CHART_SPECS. reuse è un dizionario colonna -> array
+    di valori già calcolati (tracce non modificate), usati al posto di quelli di df.
+    """
+    x = period_labels(df.index)
+    traces = []
+    for column, kind, options in CHART_SPECS[index]["traces"]:
+        if column not in df.columns:
+            continue
+        y = reuse[column] if reuse and column in reuse else _values(df, column)
+        traces.append(_trace(column, kind, options, x, y))
+    # Dati e layout sono già validi: si evita la rivalidazione di Plotly
+    return go.Figure(data=traces, layout=_LAYOUTS[index], _validate=False)
+
+
+def _reusable_values(figure, df, affected):
+    """Array y delle tracce di figure non toccate da affected, se i periodi sono invariati."""
+    if not figure.data or list(figure.data[0].x) != period_labels(df.index):
+        return None
+    return {trace.name: trace.y for trace in figure.data
+            if trace.name not in affected and trace.name in df.columns}
+
+
+def create_revenue_chart(chart_df):
+    """Grafico a barre di Revenue e Net Income"""
+    return build_chart(0, chart_df)
+
+
+def create_margins_chart(chart_df):
+    """Grafico dei margini di profitto e della Tax Percentage"""
+    return build_chart(1, chart_df)
+
+
+def create_growth_chart(chart_df):
+    """Grafico delle variazioni Y/Y"""
+    return build_chart(2, chart_df)
+
+
+@timed("chart_build")
+def create_charts(df, previous=None, affected=None):
+    """
+    Create charts from the data. Se vengono passati i grafici precedenti e l'insieme
+    delle colonne ricalcolate (affected), riusa i grafici che non ne dipendono e,
+    in quelli da aggiornare, i valori delle tracce non modificate.
+    I grafici precedenti non vengono modificati.
+    """
+    figures = []
+    for i, columns in enumerate(CHART_COLUMNS):
+        if previous is None or affected is None:
+            figures.append(build_chart(i, df))
+        elif not (columns & affected):
+            figures.append(previous[i])
+        else:
+            figures.append(build_chart(i, df, reuse=_reusable_values(previous[i], df, affected)))
+    return tuple(figures)
@@ -0,0 +1,131 @@
+"""
+Esecuzione headless dell'analisi (annuale + TTM, oppure TTM mobile per trimestre)
+senza Streamlit.
+
+Esempi:
+    python cli.py --tickers-file watchlist.txt --output analisi.csv
+    python cli.py AAPL --quarterly --output trimestri.csv
+    python cli.py --source local --data-dir ./fundamentals --all --output analisi.parquet
+    python cli.py AAPL MSFT --mapping mapping.json --output analisi.parquet
+    python cli.py AAPL MSFT --output analisi.xlsx   (richiede openpyxl)
+
+Il file dei ticker contiene un ticker per riga (sono ammessi anche virgole e
+spazi; le righe che iniziano con '#' sono ignorate). Il mapping opzionale è un
+JSON target -> colonna o espressione, nello stesso formato prodotto dalla UI.
+I ticker con un mapping già accettato nella UI (registro dei mapping) usano
+quello, salvo --no-registry. La sorgente dati è Yahoo Finance salvo --source
+(o DATA_SOURCE): con "local" gli statement vengono letti da una directory di
+file Parquet/CSV, senza rete (vedi data_sources).
+
+Codice di uscita: 0 se tutti i ticker sono stati analizzati, 2 se alcuni sono
+falliti, 1 se sono falliti tutti o se nessun ticker ha prodotto risultati (in
+quel caso il file di output non viene scritto).
+"""
+import argparse
+import json
+import logging
+import sys
+
+from batch import BATCH_PROCESSES, parse_tickers, read_tickers_file, run_batch
+from data_sources import DATA_SOURCE, DATA_SOURCE_DIR, PROVIDERS, get_provider
+from export import write_export
+from mapping_registry import MappingRegistry
+from panel_store import PANEL_STORE_PATH, PanelStore
+from statement_cache import StatementCache
+
+logger = logging.getLogger("income_statement_cli")
+
+
+def write_results(df, path):
+    """Scrive i risultati in CSV, Parquet o Excel in base all'estensione del file."""
+    try:
+        write_export(df, path)
+    except ImportError as e:
+        raise SystemExit(f"Formato di output non disponibile: {e}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Analisi dell'Income Statement da Yahoo Finance (headless)")
+    parser.add_argument("tickers", nargs="*", help="Ticker da analizzare")
+    parser.add_argument("--tickers-file", help="File con i ticker, uno per riga")
+    parser.add_argument("--output", "-o", required=True, help="File di output (.csv, .parquet o .xlsx)")
+    parser.add_argument("--summary", help="File CSV opzionale con stato e tempi per ticker")
+    parser.add_argument("--mapping", help="File JSON con il mapping target -> colonna/espressione")
+    parser.add_argument("--demo", action="store_true", help="Usa i dati demo invece di Yahoo Finance")
+    parser.add_argument("--source", choices=sorted(PROVIDERS), default=DATA_SOURCE,
+                        help="Sorgente dati (default: %(default)s)")
+    parser.add_argument("--data-dir", default=DATA_SOURCE_DIR,
+                        help="Directory degli statement per --source local (default: %(default)s)")
+    parser.add_argument("--all", action="store_true",
+                        help="Analizza tutti i ticker presenti nella directory di --source local")
+    parser.add_argument("--no-ttm", action="store_true", help="Non calcolare la riga TTM")
+    parser.add_argument("--quarterly", action="store_true",
+                        help="Analisi trimestrale: TTM mobile, Y/Y e margini per ogni trimestre")
+    parser.add_argument("--millions", action="store_true", help="Esporta gli importi in milioni")
+    parser.add_argument("--store", nargs="?", const=PANEL_STORE_PATH, metavar="DIR",
+                        help="Salva le analisi anche nell'archivio Parquet (default: %(const)s)")
+    parser.add_argument("--no-cache", action="store_true", help="Non usare la cache persistente su disco")
+    parser.add_argument("--no-registry", action="store_true",
+                        help="Non applicare i mapping appresi dal registro dei mapping")
+    parser.add_argument("--processes", type=int, default=BATCH_PROCESSES,
+                        help="Processi per la fase di analisi (default: %(default)s)")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Log dettagliati")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    demo = args.demo or args.source == "demo"
+    if args.source == "local":
+        provider = get_provider("local", root=args.data_dir)
+    else:
+        provider = get_provider(args.source)
+
+    tickers = parse_tickers(" ".join(args.tickers))
+    if args.tickers_file:
+        tickers += [t for t in read_tickers_file(args.tickers_file) if t not in tickers]
+    if args.all and hasattr(provider, "tickers"):
+        tickers += [t for t in provider.tickers() if t not in tickers]
+    if not tickers:
+        logger.error("Nessun ticker indicato")
+        return 1
+
+    saved_mapping = None
+    if args.mapping:
+        with open(args.mapping, encoding="utf-8") as f:
+            saved_mapping = json.load(f)
+
+    summary, results = run_batch(
+        tickers,
+        saved_mapping=saved_mapping,
+        cache=None if args.no_cache or demo or not provider.remote else StatementCache(),
+        demo=demo,
+        include_ttm=not args.no_ttm,
+        in_millions=args.millions,
+        panel_store=PanelStore(args.store) if args.store and not demo else None,
+        processes=args.processes,
+        registry=None if args.no_registry or demo else MappingRegistry(),
+        quarterly=args.quarterly,
+        provider=provider
+    )
+
+    if not results.empty:
+        write_results(results, args.output)
+    if args.summary:
+        summary.to_csv(args.summary, index=False)
+    print(summary.to_string(index=False))
+
+    if results.empty:
+        logger.error("Nessun risultato da esportare: %s non è stato scritto", args.output)
+        return 1
+    failed = int((summary["Stato"] == "Errore").sum())
+    if failed == len(summary):
+        return 1
+    return 2 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Indice normalizzato delle colonne di uno statement, per la ricerca delle candidate.
+
+I nomi delle voci di bilancio cambiano tra ticker e fonti per maiuscole, spazi,
+punteggiatura, "&" al posto di "and", plurali o abbreviazioni (SG&A, COGS...).
+L'indice viene costruito una sola volta per insieme di colonne (ed è in cache):
+la risoluzione di una candidata è un accesso a dizionario sulla chiave
+normalizzata, mentre i suggerimenti per le voci non riconosciute usano un
+punteggio fuzzy (similarità di sequenza e sovrapposizione delle parole).
+"""
+import re
+from difflib import SequenceMatcher
+from functools import lru_cache
+
+# Abbreviazioni e sinonimi espansi prima del confronto (sulla forma normalizzata)
+SYNONYMS = {
+    "sga": "selling general and administration",
+    "sg and a": "selling general and administration",
+    "cogs": "cost of revenue",
+    "cost of goods sold": "cost of revenue",
+    "cost of sales": "cost of revenue",
+    "r and d": "research and development",
+    "rnd": "research and development",
+    "s and m": "sales and marketing",
+    "selling and marketing": "sales and marketing",
+    "eps": "diluted eps",
+    "ebit": "operating income",
+    "sales": "revenue",
+    "total revenue": "revenue",
+    "turnover": "revenue",
+    "pretax": "pretax income",
+    "pre tax income": "pretax income",
+    "income before tax": "pretax income",
+    "provision for income taxes": "income tax expense",
+    "tax provision": "income tax expense",
+    "net earnings": "net income",
+}
+
+# Punteggio minimo perché un suggerimento fuzzy venga proposto
+SUGGESTION_CUTOFF = 0.6
+
+
+def _singular(word):
+    if len(word) <= 3:
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("xes", "ches", "shes", "sses")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def normalize_column_name(name):
+    """Forma canonica di un nome di colonna: minuscole, '&' -> 'and', senza punteggiatura né plurali."""
+    text = str(name).replace("&", " and ")
+    # Separa il camel case (es. "TotalRevenue" -> "Total Revenue")
+    text = re.sub(r"(?<=[a-z])(?=[A-Z])", " ", text).lower()
+    text = " ".join(re.sub(r"[^a-z0-9]+", " ", text).split())
+    text = SYNONYMS.get(text, text)
+    return " ".join(_singular(word) for word in text.split())
+
+
+def similarity(a, b):
+    """
+    Punteggio tra 0 e 1 tra due nomi già normalizzati: media tra la similarità dei
+    caratteri e quella delle parole (Jaccard e contenimento, così "net income" è
+    vicino a "net income common stockholder").
+    """
+    if a == b:
+        return 1.0
+    words_a, words_b = set(a.split()), set(b.split())
+    if not words_a or not words_b:
+        return 0.0
+    common = len(words_a & words_b)
+    words = (common / len(words_a | words_b) + common / min(len(words_a), len(words_b))) / 2
+    return (SequenceMatcher(None, a, b).ratio() + words) / 2
+
+
+class ColumnIndex:
+    """Indice delle colonne di uno statement per nome esatto e per nome normalizzato."""
+
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+        self._exact = set(self.columns)
+        self._by_key = {}
+        self._suggestions = {}
+        for col in self.columns:
+            # A parità di chiave vale la prima colonna, come nella ricerca lineare
+            self._by_key.setdefault(normalize_column_name(col), col)
+
+    def __contains__(self, name):
+        return self.resolve(name) is not None
+
+    def resolve(self, name):
+        """Colonna dello statement corrispondente a name (esatta o normalizzata), altrimenti None."""
+        if name in self._exact:
+            return name
+        return self._by_key.get(normalize_column_name(name))
+
+    def resolve_candidates(self, candidates):
+        """Colonne corrispondenti alle candidate, nell'ordine delle candidate e senza duplicati."""
+        resolved = []
+        for cand in candidates:
+            col = self.resolve(cand)
+            if col is not None and col not in resolved:
+                resolved.append(col)
+        return resolved
+
+    def suggest(self, name, limit=5, cutoff=SUGGESTION_CUTOFF):
+        """Colonne più simili a name come lista di (colonna, punteggio), dal punteggio più alto."""
+        memo_key = (name, limit, cutoff)
+        if memo_key not in self._suggestions:
+            self._suggestions[memo_key] = self._suggest(name, limit, cutoff)
+        return self._suggestions[memo_key]
+
+    def _suggest(self, name, limit, cutoff):
+        key = normalize_column_name(name)
+        scored = []
+        for col_key, col in self._by_key.items():
+            # Scarto rapido: quick_ratio è un limite superiore di ratio()
+            if SequenceMatcher(None, key, col_key).quick_ratio() < cutoff and \
+               not set(key.split()) & set(col_key.split()):
+                continue
+            score = similarity(key, col_key)
+            if score >= cutoff:
+                scored.append((col, score))
+        scored.sort(key=lambda item: -item[1])
+        return scored[:limit]
+
+    def suggest_targets(self, mapping_config, cutoff=SUGGESTION_CUTOFF):
+        """
+        Per ogni colonna non riconosciuta da alcuna candidata di mapping_config restituisce
+        il target più probabile come {colonna: (target, punteggio)}.
+        """
+        recognized = {col for candidates in mapping_config.values()
+                      for col in self.resolve_candidates(candidates)}
+        candidate_keys = [(target, normalize_column_name(cand))
+                          for target, candidates in mapping_config.items() for cand in candidates]
+        suggestions = {}
+        for col_key, col in self._by_key.items():
+            if col in recognized:
+                continue
+            best = max(((target, similarity(col_key, cand_key)) for target, cand_key in candidate_keys),
+                       key=lambda item: item[1], default=None)
+            if best is not None and best[1] >= cutoff:
+                suggestions[col] = best
+        return suggestions
+
+
+@lru_cache(maxsize=64)
+def _cached_index(columns):
+    return ColumnIndex(columns)
+
+
+def build_column_index(columns):
+    """Indice per un insieme di colonne, costruito una sola volta per ogni layout di statement."""
+    return _cached_index(tuple(columns))
+
+
+@lru_cache(maxsize=64)
+def _cached_target_suggestions(columns, mapping_items):
+    config = {target: list(candidates) for target, candidates in mapping_items}
+    return _cached_index(columns).suggest_targets(config)
+
+
+def suggest_targets(columns, mapping_config):
+    """Versione in cache di ColumnIndex.suggest_targets per un insieme di colonne."""
+    items = tuple((target, tuple(candidates)) for target, candidates in mapping_config.items())
+    return _cached_target_suggestions(tuple(columns), items)
@@ -0,0 +1,219 @@
+"""
+Sorgenti dati intercambiabili per statement e informazioni aziendali.
+
+Ogni sorgente (DataProvider) restituisce gli statement nel formato di yfinance
+(righe = voci di bilancio, colonne = periodi) e le info aziendali come
+dizionario, così il resto della pipeline non dipende dalla provenienza dei dati:
+  - "yahoo": Yahoo Finance tramite yfinance (rete, cache persistente e scheduler),
+  - "local": una directory di statement Parquet/CSV già scaricati, senza rete,
+  - "demo": i dati demo inclusi nell'app.
+
+Layout della directory locale (una riga per periodo, una colonna per voce, più
+una colonna "period" con la data di chiusura; i Parquet sono letti mappati in
+memoria):
+
+    <root>/AAPL/financials.parquet            (oppure .csv)
+    <root>/AAPL/quarterly_financials.parquet  (opzionale)
+    <root>/AAPL/info.json                     (opzionale)
+
+in alternativa, per download massivi, un file per tipo con una colonna "ticker":
+
+    <root>/financials.parquet
+    <root>/quarterly_financials.parquet
+    <root>/info.json                          ({ticker: info})
+
+Configurazione tramite variabili d'ambiente:
+    DATA_SOURCE      sorgente usata dall'app e dalla CLI (yahoo, local, demo)
+    DATA_SOURCE_DIR  directory della sorgente "local"
+"""
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+
+import pandas as pd
+
+from financial_data import (
+    fetch_company_info, fetch_financials, fetch_quarterly_financials,
+    get_demo_company_info, get_demo_financials
+)
+
+DEFAULT_DATA_SOURCE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "income-statement-app", "fundamentals"
+)
+
+DATA_SOURCE = os.environ.get("DATA_SOURCE", "yahoo")
+DATA_SOURCE_DIR = os.environ.get("DATA_SOURCE_DIR", DEFAULT_DATA_SOURCE_DIR)
+
+# Tipi di dato forniti da ogni sorgente
+KINDS = ("financials", "quarterly_financials", "info")
+
+# Nomi accettati per la colonna con la data del periodo nei file locali
+PERIOD_COLUMNS = ("period", "Periodo", "period_end", "date", "Date")
+
+
+class DataProvider(ABC):
+    """
+    Sorgente di statement (formato yfinance) e info aziendali per ticker. Le sottoclassi
+    devono implementare almeno financials(); trimestrali e info sono facoltativi.
+    """
+
+    name = None
+    label = None
+    # True per le sorgenti di rete: le chiamate passano dalla cache persistente
+    remote = False
+
+    @abstractmethod
+    def financials(self, ticker):
+        """Income statement annuale del ticker, oppure None se non disponibile."""
+
+    def quarterly_financials(self, ticker):
+        return None
+
+    def info(self, ticker):
+        return None
+
+    def fetch(self, kind, ticker):
+        """Valore del tipo indicato (uno di KINDS) per il ticker."""
+        if kind not in KINDS:
+            raise ValueError(f"Tipo di dato sconosciuto: {kind}")
+        return getattr(self, kind)(ticker)
+
+
+class YahooProvider(DataProvider):
+    """Yahoo Finance via yfinance, con rate limit e retry dello scheduler condiviso."""
+
+    name = "yahoo"
+    label = "Yahoo Finance"
+    remote = True
+
+    def financials(self, ticker):
+        return fetch_financials(ticker)
+
+    def quarterly_financials(self, ticker):
+        return fetch_quarterly_financials(ticker)
+
+    def info(self, ticker):
+        return fetch_company_info(ticker)
+
+
+class DemoProvider(DataProvider):
+    """Dati demo inclusi nell'app (senza trimestrali)."""
+
+    name = "demo"
+    label = "dati demo"
+
+    def financials(self, ticker):
+        return get_demo_financials(ticker)
+
+    def info(self, ticker):
+        return get_demo_company_info(ticker)
+
+
+def _to_yfinance_format(frame):
+    """Da una riga per periodo al formato yfinance, con i periodi come date."""
+    period = next((col for col in PERIOD_COLUMNS if col in frame.columns), None)
+    if period is not None:
+        frame = frame.set_index(period)
+    elif not isinstance(frame.index, pd.DatetimeIndex):
+        frame = frame.set_index(frame.columns[0])
+    frame.index = pd.to_datetime(frame.index, errors="coerce")
+    frame.index.name = None
+    return frame.sort_index(ascending=False).T
+
+
+class LocalDirectoryProvider(DataProvider):
+    """Statement Parquet/CSV in una directory locale, per ticker o in file massivi."""
+
+    name = "local"
+    label = "archivio locale"
+
+    def __init__(self, root=DATA_SOURCE_DIR):
+        # Import differito: pyarrow.dataset serve solo alla sorgente locale
+        from pyarrow import fs
+        self.root = root
+        self._filesystem = fs.LocalFileSystem(use_mmap=True)
+        self._datasets = {}
+        self._bulk_info = None
+        self._lock = threading.Lock()
+
+    def _bulk_dataset(self, kind):
+        """Dataset del file massivo del tipo indicato (aperto una sola volta), oppure None."""
+        import pyarrow.dataset as ds
+        path = os.path.join(self.root, f"{kind}.parquet")
+        with self._lock:
+            if kind not in self._datasets:
+                self._datasets[kind] = (ds.dataset(path, format="parquet", filesystem=self._filesystem)
+                                        if os.path.exists(path) else None)
+            return self._datasets[kind]
+
+    def _statement(self, ticker, kind):
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+        base = os.path.join(self.root, ticker, kind)
+        if os.path.exists(base + ".parquet"):
+            return _to_yfinance_format(pq.read_table(base + ".parquet", memory_map=True).to_pandas())
+        if os.path.exists(base + ".csv"):
+            return _to_yfinance_format(pd.read_csv(base + ".csv"))
+        dataset = self._bulk_dataset(kind)
+        if dataset is None:
+            return None
+        # Filtro sul ticker applicato durante la scansione: si leggono solo le sue righe
+        rows = dataset.to_table(filter=ds.field("ticker") == ticker).to_pandas()
+        if rows.empty:
+            return None
+        return _to_yfinance_format(rows.drop(columns="ticker"))
+
+    def financials(self, ticker):
+        return self._statement(ticker, "financials")
+
+    def quarterly_financials(self, ticker):
+        return self._statement(ticker, "quarterly_financials")
+
+    def info(self, ticker):
+        path = os.path.join(self.root, ticker, "info.json")
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        with self._lock:
+            if self._bulk_info is None:
+                bulk_path = os.path.join(self.root, "info.json")
+                self._bulk_info = {}
+                if os.path.exists(bulk_path):
+                    with open(bulk_path, encoding="utf-8") as f:
+                        self._bulk_info = json.load(f)
+        return self._bulk_info.get(ticker)
+
+    def tickers(self):
+        """Ticker disponibili nella directory (per ticker e nel file massivo degli annuali)."""
+        found = set()
+        if os.path.isdir(self.root):
+            found.update(entry.name for entry in os.scandir(self.root) if entry.is_dir())
+        dataset = self._bulk_dataset("financials")
+        if dataset is not None:
+            found.update(dataset.to_table(columns=["ticker"]).column("ticker").unique().to_pylist())
+        return sorted(found)
+
+
+# Nome -> factory della sorgente; altre sorgenti si aggiungono con register_provider
+PROVIDERS = {
+    YahooProvider.name: YahooProvider,
+    LocalDirectoryProvider.name: LocalDirectoryProvider,
+    DemoProvider.name: DemoProvider,
+}
+
+
+def register_provider(name, factory):
+    """Registra una sorgente aggiuntiva, selezionabile con DATA_SOURCE=name."""
+    missing = sorted(getattr(factory, "__abstractmethods__", ()))
+    if isinstance(factory, type) and missing:
+        raise TypeError(f"La sorgente {name} non implementa: {', '.join(missing)}")
+    PROVIDERS[name] = factory
+
+
+def get_provider(name=None, **options):
+    """Istanza della sorgente indicata (di default DATA_SOURCE)."""
+    name = name or DATA_SOURCE
+    if name not in PROVIDERS:
+        raise ValueError(f"Sorgente dati sconosciuta: {name} (disponibili: {', '.join(PROVIDERS)})")
+    return PROVIDERS[name](**options)
@@ -0,0 +1,133 @@
+"""
+Export numerico delle tabelle di analisi in CSV, Parquet ed Excel.
+
+Si esportano i valori numerici (non le stringhe formattate per la
+visualizzazione), scritti a blocchi di righe in un file temporaneo che resta in
+memoria finché è piccolo e passa su disco oltre EXPORT_SPOOL_MB: le tabelle
+multi-ticker non vengono mai copiate per intero né materializzate come
+un'unica stringa (indice e periodi diventano colonne blocco per blocco).
+
+L'export Excel richiede openpyxl (o xlsxwriter), che non è tra le dipendenze
+obbligatorie.
+
+Configurazione tramite variabili d'ambiente:
+    EXPORT_CHUNK_ROWS  righe scritte per blocco
+    EXPORT_SPOOL_MB    dimensione oltre la quale il file temporaneo va su disco
+"""
+import importlib.util
+import io
+import os
+import tempfile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from analysis import period_labels
+
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", 50000))
+EXPORT_SPOOL_BYTES = int(float(os.environ.get("EXPORT_SPOOL_MB", 32)) * 1024 * 1024)
+
+# Formato -> (estensione, MIME type)
+EXPORT_FORMATS = {
+    "csv": (".csv", "text/csv"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+    "xlsx": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+
+def _excel_engine():
+    for engine in ("openpyxl", "xlsxwriter"):
+        if importlib.util.find_spec(engine) is not None:
+            return engine
+    return None
+
+
+def available_formats():
+    """Formati utilizzabili con le dipendenze installate."""
+    return [fmt for fmt in EXPORT_FORMATS if fmt != "xlsx" or _excel_engine() is not None]
+
+
+def export_table(df):
+    """
+    Tabella piatta da esportare: l'indice diventa colonna e i periodi diventano testo
+    (usata su un blocco di righe alla volta, perché copia i dati).
+    """
+    table = df.reset_index()
+    if "index" in table.columns:
+        table = table.rename(columns={"index": "Periodo"})
+    if "Periodo" in table.columns:
+        table["Periodo"] = period_labels(table["Periodo"])
+    return table
+
+
+def _chunks(df, chunk_rows):
+    """Blocchi di righe di df (viste, senza copie) già convertiti con export_table."""
+    for start in range(0, len(df), chunk_rows):
+        yield start, export_table(df.iloc[start:start + chunk_rows])
+
+
+def write_csv(df, fileobj, chunk_rows=EXPORT_CHUNK_ROWS):
+    text = io.TextIOWrapper(fileobj, encoding="utf-8", newline="", write_through=True)
+    for start, chunk in _chunks(df, chunk_rows):
+        chunk.to_csv(text, header=start == 0, index=False)
+    text.detach()
+
+
+def write_parquet(df, fileobj, chunk_rows=EXPORT_CHUNK_ROWS):
+    writer = None
+    try:
+        for _, chunk in _chunks(df, chunk_rows):
+            if writer is None:
+                # Schema del primo blocco, imposto ai successivi
+                schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                writer = pq.ParquetWriter(fileobj, schema)
+            # Un row group per blocco
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        if writer is None:
+            pq.write_table(pa.Table.from_pandas(export_table(df), preserve_index=False), fileobj)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_excel(df, fileobj, chunk_rows=EXPORT_CHUNK_ROWS):
+    engine = _excel_engine()
+    if engine is None:
+        raise ImportError("Per l'export Excel serve openpyxl (pip install openpyxl)")
+    import pandas as pd
+    with pd.ExcelWriter(fileobj, engine=engine) as writer:
+        for start, chunk in _chunks(df, chunk_rows):
+            chunk.to_excel(writer, index=False, header=start == 0,
+                           startrow=start + 1 if start else 0)
+
+
+_WRITERS = {"csv": write_csv, "parquet": write_parquet, "xlsx": write_excel}
+
+
+def write_export(df, destination, fmt=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Scrive df (risultato dell'analisi) su destination, un percorso o un file binario.
+    Il formato, se non indicato, si ricava dall'estensione del percorso (default CSV).
+    """
+    if fmt is None:
+        extension = os.path.splitext(str(destination))[1].lower()
+        fmt = next((name for name, (ext, _) in EXPORT_FORMATS.items() if ext == extension), "csv")
+    if isinstance(destination, (str, os.PathLike)):
+        with open(destination, "wb") as f:
+            _WRITERS[fmt](df, f, chunk_rows)
+    else:
+        _WRITERS[fmt](df, destination, chunk_rows)
+
+
+def export_file(df, fmt, chunk_rows=EXPORT_CHUNK_ROWS):
+    """File temporaneo (già riavvolto) con l'export di df nel formato richiesto."""
+    fileobj = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+    write_export(df, fileobj, fmt, chunk_rows)
+    fileobj.seek(0)
+    return fileobj
+
+
+def export_bytes(df, fmt, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Contenuto dell'export di df come bytes, il tipo accettato da st.download_button."""
+    with export_file(df, fmt, chunk_rows) as fileobj:
+        return fileobj.read()
@@ -0,0 +1,140 @@
+"""
+Valutatore delle espressioni di mapping, senza eval().
+
+Un'espressione combina colonne dello statement (racchiuse tra backtick),
+costanti numeriche, le quattro operazioni, il segno e le funzioni abs, min e
+max, ad esempio:
+
+    `Selling General And Administration` + max(`Research And Development`, 0) * 0.5
+
+Il testo viene analizzato con ast una sola volta (compilazione in cache per
+testo dell'espressione) e trasformato in una funzione NumPy: qualunque altro
+elemento (nomi, attributi, chiamate a funzioni non ammesse, indici...) viene
+rifiutato in compilazione, quindi l'espressione è sicura anche se arriva da un
+utente qualsiasi. La stessa funzione si applica a scalari, array o Series.
+"""
+import ast
+import re
+from functools import lru_cache, reduce
+
+import numpy as np
+
+# Lunghezza massima accettata per un'espressione
+MAX_EXPRESSION_LENGTH = 2000
+
+_EXPR_OPERATORS = ['+', '-', '*', '/']
+
+# Operatori ammessi nelle espressioni di mapping, applicati colonna per colonna
+_BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.divide,
+}
+
+# Funzioni ammesse: nome -> (funzione NumPy, argomenti minimi, argomenti massimi)
+FUNCTIONS = {
+    "abs": (np.abs, 1, 1),
+    "min": (np.minimum, 2, None),
+    "max": (np.maximum, 2, None),
+}
+
+_FUNCTION_CALL = re.compile(r'\b(?:' + '|'.join(FUNCTIONS) + r')\s*\(')
+
+
+def transform_expr(user_input, available):
+    """
+    Sostituisce ogni numero intero (indice) nell'input con il nome della colonna
+    corrispondente (racchiuso tra backtick), basandosi sulla lista available.
+    I numeri decimali (es. 0.5) restano costanti.
+    """
+    def repl(match):
+        idx = int(match.group(0))
+        if 1 <= idx <= len(available):
+            return f"`{available[idx-1]}`"
+        else:
+            return match.group(0)
+    return re.sub(r'(?<![\w.`])\d+(?![\w.`])', repl, user_input)
+
+
+def is_mapping_expression(expr):
+    """True se il mapping è un'espressione e non un nome di colonna."""
+    return any(op in expr for op in _EXPR_OPERATORS) or _FUNCTION_CALL.search(expr) is not None
+
+
+def _compile_call(node):
+    if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+        raise ValueError("sono ammesse solo le funzioni " + ", ".join(FUNCTIONS))
+    fn, min_args, max_args = FUNCTIONS[node.func.id]
+    if len(node.args) < min_args or (max_args is not None and len(node.args) > max_args):
+        raise ValueError(f"numero di argomenti non valido per {node.func.id}()")
+    args = [_compile_node(arg) for arg in node.args]
+    if len(args) == 1:
+        return lambda values: fn(args[0](values))
+    # min/max con più argomenti: riduzione elemento per elemento
+    return lambda values: reduce(fn, (arg(values) for arg in args))
+
+
+def _compile_node(node):
+    """Trasforma un nodo dell'AST in una funzione che opera su array NumPy."""
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+        op = _BINARY_OPERATORS[type(node.op)]
+        left = _compile_node(node.left)
+        right = _compile_node(node.right)
+        return lambda values: op(left(values), right(values))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        operand = _compile_node(node.operand)
+        if isinstance(node.op, ast.USub):
+            return lambda values: np.negative(operand(values))
+        return operand
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) \
+       and not isinstance(node.value, bool):
+        constant = float(node.value)
+        return lambda values: constant
+    if isinstance(node, ast.Name) and re.fullmatch(r'__col\d+', node.id):
+        position = int(node.id[5:])
+        return lambda values: values[position]
+    if isinstance(node, ast.Call):
+        return _compile_call(node)
+    if isinstance(node, (ast.BinOp, ast.UnaryOp)):
+        raise ValueError(f"operatore non supportato nell'espressione: {type(node.op).__name__}")
+    raise ValueError(f"elemento non supportato nell'espressione: {type(node).__name__}")
+
+
+@lru_cache(maxsize=512)
+def compile_mapping_expr(expr):
+    """
+    Compila un'espressione di mapping (forma con backtick prodotta da transform_expr)
+    una sola volta. Restituisce la tupla delle colonne referenziate e una funzione
+    che, ricevuta la lista dei valori di quelle colonne (array, Series o scalari),
+    calcola il risultato in un unico passaggio vettoriale.
+    Solleva ValueError per le espressioni non valide o non ammesse.
+    """
+    if len(expr) > MAX_EXPRESSION_LENGTH:
+        raise ValueError(f"espressione troppo lunga (massimo {MAX_EXPRESSION_LENGTH} caratteri)")
+    columns = []
+
+    def placeholder(match):
+        colname = match.group(0).strip('`')
+        if colname not in columns:
+            columns.append(colname)
+        return f"__col{columns.index(colname)}"
+
+    source = re.sub(r'`[^`]+`', placeholder, expr).strip()
+    try:
+        tree = ast.parse(source, mode='eval')
+        return tuple(columns), _compile_node(tree.body)
+    except SyntaxError as e:
+        raise ValueError(f"sintassi non valida: {e.msg}") from None
+    except RecursionError:
+        raise ValueError("espressione troppo annidata") from None
+
+
+def evaluate_expression(expr, values, missing=0.0):
+    """
+    Valuta expr sui valori delle colonne, dati come mapping colonna -> scalare, array
+    o Series (es. una riga dello statement). Le colonne assenti valgono missing.
+    """
+    columns, evaluator = compile_mapping_expr(expr)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return evaluator([values[col] if col in values else missing for col in columns])
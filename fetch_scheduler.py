@@ -0,0 +1,167 @@
+"""
+Scheduler condiviso per le chiamate a Yahoo Finance.
+
+Sostituisce la pausa fissa di un secondo prima di ogni chiamata con:
+  - un token bucket che limita la frequenza delle richieste (con burst),
+  - un limite al numero di richieste contemporanee,
+  - retry con backoff esponenziale e jitter per gli errori transitori (429),
+  - un budget globale di retry, per non amplificare il carico quando Yahoo
+    continua a rifiutare le richieste.
+
+Configurazione tramite variabili d'ambiente:
+    YF_RATE_PER_SEC     richieste al secondo consentite a regime
+    YF_BURST            richieste consecutive consentite senza attesa
+    YF_MAX_CONCURRENCY  richieste contemporanee massime
+    YF_MAX_RETRIES      retry massimi per singola chiamata
+    YF_RETRY_BUDGET     retry massimi al minuto per l'intero processo
+"""
+import importlib
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from instrumentation import increment
+
+logger = logging.getLogger(__name__)
+
+RATE_PER_SEC = float(os.environ.get("YF_RATE_PER_SEC", 2))
+BURST = int(os.environ.get("YF_BURST", 4))
+MAX_CONCURRENCY = int(os.environ.get("YF_MAX_CONCURRENCY", 4))
+MAX_RETRIES = int(os.environ.get("YF_MAX_RETRIES", 4))
+RETRY_BUDGET = int(os.environ.get("YF_RETRY_BUDGET", 30))
+
+
+def is_rate_limit_error(error):
+    """True per gli errori di rate limiting restituiti da Yahoo Finance."""
+    message = str(error)
+    return ("Rate limited" in message or "Too Many Requests" in message
+            or type(error).__name__ == "YFRateLimitError")
+
+
+@lru_cache(maxsize=1)
+def _connection_error_types():
+    """
+    Errori di connessione e timeout, compresi quelli dei client HTTP usati da yfinance
+    (requests e curl_cffi), che non derivano dai ConnectionError/TimeoutError di Python.
+    Gli altri errori HTTP (es. 404) non sono transitori.
+    """
+    types = [ConnectionError, TimeoutError]
+    for module in ("requests.exceptions", "curl_cffi.requests.exceptions"):
+        # Import differito: i client servono solo a yfinance, e solo dopo un errore
+        try:
+            exceptions = importlib.import_module(module)
+        except ImportError:
+            continue
+        types += [exceptions.ConnectionError, exceptions.Timeout]
+    return tuple(types)
+
+
+def is_transient_error(error):
+    """Errori per cui ha senso riprovare: rate limiting e problemi di connessione."""
+    return is_rate_limit_error(error) or isinstance(error, _connection_error_types())
+
+
+class TokenBucket:
+    """Token bucket thread-safe: `rate` token al secondo, al massimo `capacity` accumulati."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """Consuma un token se disponibile, senza attendere."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        """Attende finché un token è disponibile e lo consuma."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class FetchScheduler:
+    """Esegue le chiamate di rete rispettando rate limit, concorrenza e budget di retry."""
+
+    def __init__(self, rate=RATE_PER_SEC, burst=BURST, max_concurrency=MAX_CONCURRENCY,
+                 max_retries=MAX_RETRIES, retry_budget=RETRY_BUDGET,
+                 base_delay=1.0, max_delay=30.0):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._bucket = TokenBucket(rate, burst)
+        self._retry_budget = TokenBucket(retry_budget / 60.0, retry_budget)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def _backoff(self, attempt):
+        """Backoff esponenziale con full jitter."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Esegue fn(*args, **kwargs). Gli errori transitori vengono ritentati finché
+        restano retry per la chiamata e nel budget globale; poi l'ultimo errore
+        viene rilanciato al chiamante.
+        """
+        attempt = 0
+        while True:
+            self._bucket.acquire()
+            with self._slots:
+                try:
+                    result = fn(*args, **kwargs)
+                    increment("fetch_calls", result="ok")
+                    return result
+                except Exception as e:
+                    if not is_transient_error(e) or attempt >= self.max_retries \
+                       or not self._retry_budget.try_acquire():
+                        increment("fetch_calls", result="error")
+                        raise
+                    increment("fetch_retries")
+                    delay = self._backoff(attempt)
+                    logger.info("Errore transitorio (%s), nuovo tentativo tra %.1fs", e, delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def map(self, fn, keys):
+        """
+        Esegue fn(key) per ogni chiave in parallelo (fino a max_concurrency).
+        Restituisce un dizionario key -> risultato, oppure l'eccezione sollevata.
+        """
+        keys = list(keys)
+        results = {}
+        if not keys:
+            return results
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(keys))) as pool:
+            futures = {key: pool.submit(self.call, fn, key) for key in keys}
+            for key, future in futures.items():
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    results[key] = e
+        return results
+
+
+# Scheduler condiviso da tutti i thread del processo
+default_scheduler = FetchScheduler()
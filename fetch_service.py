@@ -0,0 +1,103 @@
+"""
+Servizio di recupero concorrente degli statement, con coalescing delle richieste.
+
+Le richieste (ticker, tipo) vengono eseguite in un thread pool: annuale,
+trimestrale e info di un ticker partono insieme, così il primo caricamento
+costa circa un solo round-trip. Una richiesta per una chiave già in corso non
+genera una nuova chiamata ma riceve lo stesso Future, anche se arriva da
+un'altra sessione o da un altro thread. I dati vengono dalla sorgente
+configurata (data_sources); quelli di rete passano dalla cache persistente, se
+fornita, e dallo scheduler condiviso.
+
+Uso:
+    service = FetchService(StatementCache())
+    service.prefetch("AAPL")                    # non bloccante
+    financials = service.fetch("AAPL", "financials")
+
+Configurazione tramite variabili d'ambiente:
+    FETCH_SERVICE_WORKERS  thread del pool (le chiamate contemporanee restano
+                           limitate da YF_MAX_CONCURRENCY)
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from data_sources import KINDS, get_provider
+from instrumentation import increment
+
+WORKERS = int(os.environ.get("FETCH_SERVICE_WORKERS", 16))
+
+STATEMENT_KINDS = ("financials", "quarterly_financials")
+
+
+class FetchService:
+    """Recupero concorrente per (ticker, tipo) con una sola richiesta in corso per chiave."""
+
+    def __init__(self, cache=None, max_workers=WORKERS, provider=None):
+        self.cache = cache
+        self.provider = provider or get_provider()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch")
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _load(self, ticker, kind, refresh=False):
+        def fetcher(ticker):
+            return self.provider.fetch(kind, ticker)
+        # I dati locali non passano dalla cache: leggerli costa meno che deserializzarli
+        if self.cache is not None and self.provider.remote:
+            if refresh:
+                return self.cache.refresh(ticker, kind, fetcher)
+            return self.cache.get_or_fetch(ticker, kind, fetcher)
+        return fetcher(ticker)
+
+    def submit(self, ticker, kind, refresh=False):
+        """
+        Future con il valore di (ticker, kind); riusa la richiesta in corso, se c'è.
+        Con refresh il valore viene riscaricato e salvato in cache anche se ancora fresco.
+        """
+        key = (ticker, kind)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                increment("fetch_requests", kind=kind, result="coalesced")
+                return future
+            future = self._pool.submit(self._load, ticker, kind, refresh)
+            self._inflight[key] = future
+        increment("fetch_requests", kind=kind, result="issued")
+        future.add_done_callback(lambda done: self._release(key, done))
+        return future
+
+    def _release(self, key, future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def prefetch(self, ticker, kinds=KINDS):
+        """Avvia insieme le richieste indicate per il ticker, senza attenderle."""
+        return {kind: self.submit(ticker, kind) for kind in kinds}
+
+    def fetch(self, ticker, kind, timeout=None):
+        """Valore di (ticker, kind); gli errori del recupero vengono rilanciati."""
+        return self.submit(ticker, kind).result(timeout)
+
+    def fetch_many(self, ticker, kinds=STATEMENT_KINDS, timeout=None):
+        """
+        Recupera in parallelo i tipi indicati. Restituisce un dizionario kind -> valore,
+        oppure l'eccezione sollevata per quel tipo.
+        """
+        futures = self.prefetch(ticker, kinds)
+        results = {}
+        for kind, future in futures.items():
+            try:
+                results[kind] = future.result(timeout)
+            except Exception as e:
+                results[kind] = e
+        return results
+
+    def in_flight(self):
+        """Numero di richieste in corso."""
+        with self._lock:
+            return len(self._inflight)
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
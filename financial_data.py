@@ -0,0 +1,147 @@
+"""
+Accesso a Yahoo Finance senza dipendenze da Streamlit.
+
+Queste funzioni eseguono solo la chiamata di rete: la gestione della modalità
+demo, dei messaggi all'utente e della cache è a carico del chiamante, così
+possono essere usate anche da thread in background. Tutte le chiamate passano
+dallo scheduler condiviso, che applica rate limit e retry.
+
+Qui risiedono anche i dati demo usati quando l'API è limitata.
+"""
+import pandas as pd
+
+from fetch_scheduler import default_scheduler
+from instrumentation import timed
+
+
+def _ticker(ticker):
+    # Import differito: yfinance è pesante e serve solo quando si va in rete
+    import yfinance as yf
+    return yf.Ticker(ticker)
+
+
+@timed("network_fetch", kind="info")
+def fetch_company_info(ticker):
+    """Scarica le informazioni aziendali da Yahoo Finance."""
+    return default_scheduler.call(lambda: _ticker(ticker).info)
+
+
+@timed("network_fetch", kind="financials")
+def fetch_financials(ticker):
+    """Scarica l'income statement annuale da Yahoo Finance (formato yfinance)."""
+    return default_scheduler.call(lambda: _ticker(ticker).financials)
+
+
+@timed("network_fetch", kind="quarterly_financials")
+def fetch_quarterly_financials(ticker):
+    """Scarica l'income statement trimestrale da Yahoo Finance (formato yfinance)."""
+    return default_scheduler.call(lambda: _ticker(ticker).quarterly_financials)
+
+
+###############################################
+# DEMO DATA
+###############################################
+
+# Sample data for demo mode when API is rate limited
+DEMO_COMPANY_INFO = {
+    "AAPL": {
+        "longName": "Apple Inc.",
+        "sector": "Technology",
+        "industry": "Consumer Electronics",
+        "currentPrice": 174.79,
+        "marketCap": 2740000000000,
+        "logo_url": "https://logo.clearbit.com/apple.com"
+    },
+    "MSFT": {
+        "longName": "Microsoft Corporation",
+        "sector": "Technology",
+        "industry": "Software—Infrastructure",
+        "currentPrice": 403.78,
+        "marketCap": 3000000000000,
+        "logo_url": "https://logo.clearbit.com/microsoft.com"
+    },
+    "GOOGL": {
+        "longName": "Alphabet Inc.",
+        "sector": "Communication Services",
+        "industry": "Internet Content & Information",
+        "currentPrice": 153.05,
+        "marketCap": 1900000000000,
+        "logo_url": "https://logo.clearbit.com/google.com"
+    }
+}
+
+# Sample financial data structure for demo mode
+DEMO_FINANCIAL_DATA = {
+    "AAPL": {
+        "financials": {
+            "Revenue": [394328000000, 365817000000, 274515000000, 260174000000],
+            "Cost Of Revenue": [226107000000, 208168000000, 152836000000, 161782000000],
+            "Gross Profit": [168221000000, 157649000000, 121679000000, 98392000000],
+            "Selling General And Administration": [26474000000, 25094000000, 21973000000, 19916000000],
+            "Research And Development": [29915000000, 26251000000, 21914000000, 18752000000],
+            "Operating Income": [111832000000, 109552000000, 94680000000, 66288000000],
+            "Pretax Income": [113645000000, 109272000000, 94680000000, 67091000000],
+            "Income Tax Expense": [18573000000, 14089000000, 14527000000, 9680000000],
+            "Net Income": [95025000000, 99803000000, 94680000000, 57411000000],
+            "Diluted EPS": [6.14, 6.11, 5.61, 3.28]
+        },
+        "dates": ["2023-09-30", "2022-09-30", "2021-09-30", "2020-09-30"]
+    },
+    "MSFT": {
+        "financials": {
+            "Revenue": [211915000000, 198270000000, 168088000000, 143015000000],
+            "Cost Of Revenue": [70950000000, 65812000000, 52232000000, 46078000000],
+            "Gross Profit": [140965000000, 132458000000, 115856000000, 96937000000],
+            "Selling General And Administration": [42513000000, 39585000000, 35327000000, 29539000000],
+            "Research And Development": [27155000000, 24512000000, 20716000000, 19269000000],
+            "Operating Income": [88389000000, 83383000000, 69916000000, 52959000000],
+            "Pretax Income": [88092000000, 83386000000, 71102000000, 53036000000],
+            "Income Tax Expense": [10605000000, 10978000000, 9831000000, 8755000000],
+            "Net Income": [77487000000, 72738000000, 61271000000, 44281000000],
+            "Diluted EPS": [10.31, 9.65, 8.05, 5.76]
+        },
+        "dates": ["2023-06-30", "2022-06-30", "2021-06-30", "2020-06-30"]
+    },
+    "GOOGL": {
+        "financials": {
+            "Revenue": [307394000000, 282836000000, 257637000000, 182527000000],
+            "Cost Of Revenue": [131380000000, 126203000000, 110939000000, 84732000000],
+            "Gross Profit": [176014000000, 156633000000, 146698000000, 97795000000],
+            "Selling General And Administration": [45567000000, 43026000000, 37702000000, 31023000000],
+            "Research And Development": [44861000000, 39500000000, 31562000000, 27573000000],
+            "Operating Income": [84486000000, 73972000000, 78714000000, 41224000000],
+            "Pretax Income": [84800000000, 76033000000, 86692000000, 42733000000],
+            "Income Tax Expense": [11907000000, 13118000000, 14701000000, 7813000000],
+            "Net Income": [73800000000, 59972000000, 76033000000, 40269000000],
+            "Diluted EPS": [5.80, 4.56, 5.61, 2.93]
+        },
+        "dates": ["2023-12-31", "2022-12-31", "2021-12-31", "2020-12-31"]
+    }
+}
+
+# Function to get demo financial data
+def get_demo_financial_data(ticker):
+    """Get demo financial data for a ticker"""
+    if ticker in DEMO_FINANCIAL_DATA:
+        return DEMO_FINANCIAL_DATA[ticker]
+    # Default to AAPL if ticker not in demo data
+    return DEMO_FINANCIAL_DATA["AAPL"]
+
+# Function to get demo company info
+def get_demo_company_info(ticker):
+    """Get demo company info for a ticker"""
+    if ticker in DEMO_COMPANY_INFO:
+        return DEMO_COMPANY_INFO[ticker]
+    # Default to AAPL if ticker not in demo data
+    return DEMO_COMPANY_INFO["AAPL"]
+
+def get_demo_financials(ticker):
+    """Income statement annuale demo nello stesso formato di yfinance (righe = voci)"""
+    demo_data = get_demo_financial_data(ticker)
+    
+    # Convert demo data to pandas DataFrame format
+    fin_data = pd.DataFrame(demo_data["financials"])
+    fin_data.index = pd.to_datetime(demo_data["dates"])
+    
+    # Transpose to match yfinance format
+    return fin_data.T
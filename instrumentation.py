@@ -0,0 +1,228 @@
+"""
+Strumentazione leggera delle fasi dell'app: span temporizzati e contatori.
+
+Le misure vengono raccolte in un registro in memoria condiviso dal processo
+(thread-safe), che conserva per ogni span gli ultimi campioni per calcolare i
+percentili. Il registro è indipendente da Streamlit: l'app lo mostra in un
+pannello di debug nella sidebar, ma può essere esportato anche come testo in
+formato Prometheus. Ogni span viene inoltre scritto come log strutturato (JSON)
+sul logger "instrumentation" a livello DEBUG.
+
+Uso:
+    with span("mapping_eval", target="Revenue"):
+        ...
+
+    @timed("network_fetch", kind="financials")
+    def fetch_financials(ticker): ...
+
+    increment("statement_cache_requests", kind="financials", result="hit")
+
+Configurazione tramite variabili d'ambiente:
+    INSTRUMENTATION_ENABLED  0 per disattivare la raccolta
+    INSTRUMENTATION_WINDOW   campioni conservati per span (per p50/p95)
+"""
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger("instrumentation")
+
+ENABLED = os.environ.get("INSTRUMENTATION_ENABLED", "1") != "0"
+WINDOW = int(os.environ.get("INSTRUMENTATION_WINDOW", 1000))
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _prometheus_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _prometheus_labels(key, **extra):
+    items = list(key) + [(k, str(v)) for k, v in extra.items()]
+    if not items:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+class _SpanStats:
+    """Statistiche di uno span: totali cumulativi più una finestra degli ultimi campioni."""
+
+    def __init__(self, window):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def add(self, seconds, error):
+        self.count += 1
+        self.errors += int(error)
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+
+class Registry:
+    """Registro in memoria di span e contatori, identificati da nome ed etichette."""
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self._spans = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, error=False, **labels):
+        """Registra la durata di uno span."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            stats = self._spans.get(key)
+            if stats is None:
+                stats = self._spans[key] = _SpanStats(self.window)
+            stats.add(seconds, error)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps({"span": name, "seconds": round(seconds, 6), "error": error, **labels},
+                                    default=str))
+
+    def increment(self, name, amount=1, **labels):
+        """Incrementa un contatore."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+
+    def spans(self):
+        """Una riga per span ed etichette: conteggio, errori, totale, media, p50, p95 e massimo (secondi)."""
+        with self._lock:
+            items = [(name, key, stats.count, stats.errors, stats.total, stats.max, list(stats.recent))
+                     for (name, key), stats in self._spans.items()]
+        rows = []
+        for name, key, count, errors, total, max_seconds, recent in items:
+            p50, p95 = np.percentile(recent, [50, 95]) if recent else (np.nan, np.nan)
+            rows.append({
+                "Span": name,
+                "Etichette": ", ".join(f"{k}={v}" for k, v in key),
+                "Conteggio": count,
+                "Errori": errors,
+                "Totale (s)": total,
+                "Media (s)": total / count if count else np.nan,
+                "p50 (s)": p50,
+                "p95 (s)": p95,
+                "Max (s)": max_seconds,
+            })
+        columns = ["Span", "Etichette", "Conteggio", "Errori", "Totale (s)", "Media (s)",
+                   "p50 (s)", "p95 (s)", "Max (s)"]
+        return pd.DataFrame(rows, columns=columns).sort_values(["Span", "Etichette"], ignore_index=True)
+
+    def counters(self):
+        """Una riga per contatore ed etichette."""
+        with self._lock:
+            rows = [{"Contatore": name, "Etichette": ", ".join(f"{k}={v}" for k, v in key), "Valore": value}
+                    for (name, key), value in self._counters.items()]
+        return pd.DataFrame(rows, columns=["Contatore", "Etichette", "Valore"]).sort_values(
+            ["Contatore", "Etichette"], ignore_index=True)
+
+    def hit_ratio(self, name, hit_values=("hit",), **labels):
+        """
+        Quota delle richieste di un contatore con etichetta result in hit_values,
+        filtrando sulle altre etichette indicate. None se non ci sono richieste.
+        """
+        wanted = _label_key(labels)
+        hits = total = 0
+        with self._lock:
+            for (counter, key), value in self._counters.items():
+                if counter != name or not set(wanted) <= set(key):
+                    continue
+                total += value
+                if dict(key).get("result") in hit_values:
+                    hits += value
+        return hits / total if total else None
+
+    def prometheus_text(self, prefix="income_app"):
+        """Esporta span (come summary) e contatori nel formato testuale di Prometheus."""
+        with self._lock:
+            spans = [(name, key, stats.count, stats.total, list(stats.recent))
+                     for (name, key), stats in self._spans.items()]
+            counters = list(self._counters.items())
+
+        lines = []
+        if spans:
+            metric = f"{prefix}_span_duration_seconds"
+            lines += [f"# HELP {metric} Durata degli span strumentati",
+                      f"# TYPE {metric} summary"]
+            for name, key, count, total, recent in sorted(spans, key=lambda s: (s[0], s[1])):
+                key = (("span", name),) + key
+                if recent:
+                    for q, value in zip(("0.5", "0.95"), np.percentile(recent, [50, 95])):
+                        lines.append(f"{metric}{_prometheus_labels(key, quantile=q)} {value:.6g}")
+                lines.append(f"{metric}_count{_prometheus_labels(key)} {count}")
+                lines.append(f"{metric}_sum{_prometheus_labels(key)} {total:.6g}")
+
+        by_name = {}
+        for (name, key), value in counters:
+            by_name.setdefault(name, []).append((key, value))
+        for name in sorted(by_name):
+            metric = f"{prefix}_{_prometheus_name(name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for key, value in sorted(by_name[name]):
+                lines.append(f"{metric}{_prometheus_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Registro condiviso da tutti i thread del processo
+default_registry = Registry()
+
+
+@contextmanager
+def span(name, registry=None, **labels):
+    """Misura il blocco e lo registra come span; gli errori vengono contati e rilanciati."""
+    if not ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        (registry or default_registry).record(name, time.perf_counter() - started, error, **labels)
+
+
+def timed(name, **labels):
+    """Decoratore: ogni chiamata della funzione viene registrata come span."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(name, seconds, registry=None, **labels):
+    """Registra uno span misurato altrove (es. un intervallo che non è un blocco di codice)."""
+    if ENABLED:
+        (registry or default_registry).record(name, seconds, **labels)
+
+
+def increment(name, amount=1, registry=None, **labels):
+    """Incrementa un contatore del registro condiviso."""
+    if ENABLED:
+        (registry or default_registry).increment(name, amount, **labels)
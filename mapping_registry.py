@@ -0,0 +1,200 @@
+"""
+Registro persistente (SQLite) dei mapping accettati dall'utente.
+
+Ogni mapping confermato viene salvato insieme al ticker e alla firma del
+layout dello statement (l'insieme normalizzato delle voci di bilancio). Per un
+nuovo caricamento il registro propone, con un punteggio di confidenza:
+  1. il mapping già accettato per lo stesso ticker e lo stesso layout,
+  2. il mapping del ticker su un layout diverso, se le colonne referenziate esistono,
+  3. il mapping accettato dal maggior numero di altri ticker per lo stesso layout,
+  4. il mapping di un layout simile (Jaccard delle voci), se le colonne esistono.
+Il primo, se c'è, ha sempre la precedenza; tra gli altri vince la confidenza
+più alta. Sopra la soglia di confidenza il passo di mapping manuale viene
+saltato; i mapping di altri ticker (3 e 4) vengono applicati senza conferma
+solo dopo la conferma di almeno MIN_AUTO_CONFIRMATIONS ticker diversi,
+altrimenti sono solo proposti.
+
+Configurazione tramite variabili d'ambiente:
+    MAPPING_REGISTRY_PATH       percorso del file SQLite
+    AUTO_MAPPING_THRESHOLD      confidenza minima per applicare il mapping senza conferma
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from column_index import normalize_column_name
+from expressions import is_mapping_expression
+
+DEFAULT_REGISTRY_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "income-statement-app", "mappings.sqlite"
+)
+
+REGISTRY_PATH = os.environ.get("MAPPING_REGISTRY_PATH", DEFAULT_REGISTRY_PATH)
+AUTO_MAPPING_THRESHOLD = float(os.environ.get("AUTO_MAPPING_THRESHOLD", 0.9))
+
+# Somiglianza minima tra layout perché un mapping venga riproposto
+MIN_LAYOUT_SIMILARITY = 0.8
+
+# Ticker diversi che devono aver confermato un mapping di altri ticker perché venga applicato senza conferma
+MIN_AUTO_CONFIRMATIONS = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mappings (
+    ticker       TEXT NOT NULL,
+    signature    TEXT NOT NULL,
+    columns      TEXT NOT NULL,
+    mapping      TEXT NOT NULL,
+    accepted_at  REAL NOT NULL,
+    accepted     INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (ticker, signature, mapping)
+)
+"""
+
+
+def layout_signature(columns):
+    """Firma del layout: hash delle voci normalizzate, indipendente da ordine e maiuscole."""
+    keys = sorted({normalize_column_name(col) for col in columns})
+    return hashlib.sha1("\n".join(keys).encode("utf-8")).hexdigest()
+
+
+def referenced_columns(expr):
+    """Colonne usate da una voce di mapping (nome diretto o espressione con backtick)."""
+    if expr is None:
+        return []
+    return re.findall(r'`([^`]+)`', expr) if is_mapping_expression(expr) else [expr]
+
+
+def mapping_coverage(mapping, columns):
+    """Quota dei target mappati le cui colonne referenziate sono tutte presenti."""
+    columns = set(columns)
+    mapped = [expr for expr in mapping.values() if expr is not None]
+    if not mapped:
+        return 0.0
+    return sum(all(col in columns for col in referenced_columns(expr)) for expr in mapped) / len(mapped)
+
+
+class MappingSuggestion:
+    """Mapping proposto dal registro, con confidenza (0-1) e fonte della proposta."""
+
+    def __init__(self, mapping, confidence, source, confirmations=None):
+        self.mapping = mapping
+        self.confidence = confidence
+        self.source = source
+        # Ticker che hanno confermato il mapping (None per i mapping dello stesso ticker)
+        self.confirmations = confirmations
+
+    @property
+    def automatic(self):
+        if self.confirmations is not None and self.confirmations < MIN_AUTO_CONFIRMATIONS:
+            return False
+        return self.confidence >= AUTO_MAPPING_THRESHOLD
+
+    def describe(self):
+        return f"{self.source} (confidenza {self.confidence:.0%})"
+
+
+class MappingRegistry:
+    """Registro dei mapping accettati, per ticker e per firma del layout."""
+
+    def __init__(self, path=REGISTRY_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_mappings_signature ON mappings (signature)")
+
+    @contextmanager
+    def _connect(self):
+        """Connessione con commit (o rollback) all'uscita, poi chiusa: sqlite3 da solo non la chiude."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def remember(self, ticker, columns, mapping):
+        """Registra un mapping accettato per il ticker e il layout delle sue colonne."""
+        payload = json.dumps(mapping, sort_keys=True)
+        columns_json = json.dumps(sorted(columns))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO mappings (ticker, signature, columns, mapping, accepted_at) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (ticker, signature, mapping) "
+                "DO UPDATE SET accepted = accepted + 1, accepted_at = excluded.accepted_at",
+                (ticker, layout_signature(columns), columns_json, payload, time.time()),
+            )
+
+    def forget(self, ticker=None):
+        """Elimina i mapping di un ticker, oppure l'intero registro se ticker è None."""
+        with self._connect() as conn:
+            if ticker is None:
+                conn.execute("DELETE FROM mappings")
+            else:
+                conn.execute("DELETE FROM mappings WHERE ticker = ?", (ticker,))
+
+    def suggest(self, ticker, columns):
+        """Miglior MappingSuggestion per il ticker e le sue colonne, oppure None."""
+        signature = layout_signature(columns)
+        columns = list(columns)
+        with self._connect() as conn:
+            # 1-2. Mapping già accettati per lo stesso ticker, il più recente per primo
+            rows = conn.execute(
+                "SELECT signature, mapping FROM mappings WHERE ticker = ? ORDER BY accepted_at DESC",
+                (ticker,),
+            ).fetchall()
+            for row_signature, payload in rows:
+                mapping = json.loads(payload)
+                if row_signature == signature:
+                    return MappingSuggestion(mapping, 1.0, "stesso ticker e layout")
+            # Tra i passi 2-4 vince la confidenza più alta: una proposta debole
+            # dello stesso ticker non nasconde un mapping condiviso da molti altri
+            candidates = []
+            if rows:
+                mapping = json.loads(rows[0][1])
+                coverage = mapping_coverage(mapping, columns)
+                if coverage > 0:
+                    candidates.append(MappingSuggestion(mapping, 0.95 * coverage, "stesso ticker, layout diverso"))
+
+            # 3. Mapping accettato dal maggior numero di ticker per lo stesso layout
+            rows = conn.execute(
+                "SELECT mapping, COUNT(DISTINCT ticker) FROM mappings WHERE signature = ? "
+                "GROUP BY mapping ORDER BY COUNT(DISTINCT ticker) DESC",
+                (signature,),
+            ).fetchall()
+            if rows:
+                total = sum(count for _, count in rows)
+                mapping, count = json.loads(rows[0][0]), rows[0][1]
+                # La confidenza cresce con il consenso e con il numero di ticker che l'hanno confermato
+                confidence = (count / total) * min(1.0, 0.8 + 0.05 * count)
+                candidates.append(MappingSuggestion(mapping, confidence, "stesso layout di altri ticker",
+                                                    confirmations=count))
+
+            # 4. Layout simile (diverso da quello del passo 3): Jaccard tra le voci normalizzate
+            keys = {normalize_column_name(col) for col in columns}
+            best = None
+            for row_columns, payload, count in conn.execute(
+                "SELECT columns, mapping, COUNT(DISTINCT ticker) FROM mappings WHERE signature != ? "
+                "GROUP BY signature, mapping",
+                (signature,),
+            ):
+                other = {normalize_column_name(col) for col in json.loads(row_columns)}
+                similarity = len(keys & other) / len(keys | other) if keys | other else 0.0
+                if similarity < MIN_LAYOUT_SIMILARITY:
+                    continue
+                mapping = json.loads(payload)
+                confidence = 0.9 * similarity * mapping_coverage(mapping, columns)
+                if best is None or (confidence, count) > best[0]:
+                    best = ((confidence, count), mapping)
+            if best is not None and best[0][0] > 0:
+                candidates.append(MappingSuggestion(best[1], best[0][0], "layout simile", confirmations=best[0][1]))
+        # A parità di confidenza resta il passo precedente
+        return max(candidates, key=lambda suggestion: suggestion.confidence, default=None)
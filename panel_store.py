@@ -0,0 +1,134 @@
+"""
+Archivio colonnare (Parquet) delle analisi di più ticker.
+
+Ogni analisi viene salvata in una directory partizionata in stile Hive:
+
+    <root>/ticker=AAPL/fiscal_year=2023/part-0.parquet
+    <root>/ticker=AAPL/fiscal_year=TTM/part-0.parquet
+
+Una nuova analisi dello stesso ticker sostituisce le partizioni dei periodi
+che contiene. Le letture usano pyarrow.dataset con proiezione delle colonne,
+filtri sulle partizioni e file mappati in memoria, così uno screen
+trasversale legge solo la metrica richiesta senza ricalcolare nulla.
+
+Configurazione tramite variabili d'ambiente:
+    PANEL_STORE_PATH  directory radice dell'archivio
+"""
+import os
+import tempfile
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+from analysis import OUTPUT_COLUMNS
+
+DEFAULT_PANEL_STORE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "income-statement-app", "panel"
+)
+
+PANEL_STORE_PATH = os.environ.get("PANEL_STORE_PATH", DEFAULT_PANEL_STORE_PATH)
+
+_PARTITIONING = ds.partitioning(
+    pa.schema([("ticker", pa.string()), ("fiscal_year", pa.string())]), flavor="hive"
+)
+
+_FILE_SCHEMA = pa.schema(
+    [("period", pa.string()), ("period_end", pa.timestamp("ns")),
+     ("analyzed_at", pa.timestamp("us", tz="UTC"))]
+    + [(col, pa.float64()) for col in OUTPUT_COLUMNS]
+)
+
+
+def _fiscal_year(period):
+    """Partizione del periodo: l'anno della data di chiusura, oppure l'etichetta (es. TTM)."""
+    return str(period.year) if isinstance(period, (pd.Timestamp, datetime)) else str(period)
+
+
+class PanelStore:
+    """Archivio Parquet partizionato per ticker e anno fiscale."""
+
+    def __init__(self, root=PANEL_STORE_PATH):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def append(self, ticker, df_income_full):
+        """
+        Salva l'analisi di un ticker (output di analyze_income_statement, importi pieni).
+        Le partizioni (ticker, anno fiscale) già presenti vengono sostituite.
+        """
+        if df_income_full is None or df_income_full.empty:
+            return
+        if "/" in ticker or ticker in ("", ".", ".."):
+            raise ValueError(f"Ticker non valido per l'archivio: {ticker!r}")
+
+        periods = [pd.Timestamp(p) if not isinstance(p, str) else p for p in df_income_full.index]
+        table = pd.DataFrame({
+            "period": [p.strftime("%Y-%m-%d") if isinstance(p, pd.Timestamp) else p for p in periods],
+            "period_end": [p if isinstance(p, pd.Timestamp) else pd.NaT for p in periods],
+            "analyzed_at": pd.Timestamp.now(tz=timezone.utc),
+        })
+        for col in OUTPUT_COLUMNS:
+            if col in df_income_full.columns:
+                table[col] = pd.to_numeric(df_income_full[col], errors="coerce").to_numpy(dtype=float)
+            else:
+                table[col] = np.nan
+        table["fiscal_year"] = [_fiscal_year(p) for p in periods]
+
+        for fiscal_year, rows in table.groupby("fiscal_year", sort=False):
+            directory = os.path.join(self.root, f"ticker={ticker}", f"fiscal_year={fiscal_year}")
+            os.makedirs(directory, exist_ok=True)
+            arrow_table = pa.Table.from_pandas(rows.drop(columns="fiscal_year"), schema=_FILE_SCHEMA,
+                                               preserve_index=False)
+            # Scrittura atomica: i lettori concorrenti vedono il file vecchio o quello nuovo
+            # (il prefisso "." esclude il file temporaneo dalle letture del dataset)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".part-")
+            os.close(fd)
+            pq.write_table(arrow_table, tmp_path)
+            os.replace(tmp_path, os.path.join(directory, "part-0.parquet"))
+
+    def _dataset(self):
+        return ds.dataset(
+            self.root,
+            format="parquet",
+            partitioning=_PARTITIONING,
+            filesystem=fs.LocalFileSystem(use_mmap=True),
+        )
+
+    def load_panel(self, metrics=None, tickers=None, fiscal_years=None):
+        """
+        Restituisce le analisi salvate in formato lungo (una riga per ticker e periodo),
+        limitate alle metriche, ai ticker e agli anni fiscali richiesti.
+        """
+        columns = ["ticker", "fiscal_year", "period", "period_end"] + list(metrics or OUTPUT_COLUMNS)
+        expression = None
+        if tickers:
+            expression = ds.field("ticker").isin(list(tickers))
+        if fiscal_years:
+            year_filter = ds.field("fiscal_year").isin([str(y) for y in fiscal_years])
+            expression = year_filter if expression is None else expression & year_filter
+        try:
+            dataset = self._dataset()
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return pd.DataFrame(columns=columns)
+        # Directory presente ma senza file (es. prima scrittura fallita): lo schema è vuoto
+        if not dataset.files:
+            return pd.DataFrame(columns=columns)
+        return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+    def load_metric(self, metric, tickers=None, fiscal_years=None):
+        """Una metrica per tutti i ticker: righe = ticker, colonne = periodi."""
+        panel = self.load_panel([metric], tickers, fiscal_years)
+        if panel.empty:
+            return pd.DataFrame()
+        return panel.pivot_table(index="ticker", columns="period", values=metric, aggfunc="last")
+
+    def tickers(self):
+        """Ticker presenti nell'archivio."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name.split("=", 1)[1] for name in os.listdir(self.root) if name.startswith("ticker="))
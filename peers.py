@@ -0,0 +1,169 @@
+"""
+Confronto con i peer di settore e industria sulle analisi già salvate.
+
+Il pannello dei peer contiene, per ogni ticker analizzato, l'ultimo periodo
+disponibile (la riga TTM se presente, altrimenti l'esercizio più recente) delle
+metriche di confronto, più settore e industria. Mediane e percentili per
+gruppo si calcolano con group-by vettoriali sull'intero pannello; quando un
+ticker viene (ri)analizzato si aggiornano solo la sua riga e le statistiche
+dei gruppi a cui appartiene, senza rileggere l'archivio.
+
+Le informazioni aziendali (settore, industria) arrivano da una funzione
+info_lookup(ticker) fornita dal chiamante, che non dovrebbe andare in rete.
+Il confronto è accessorio: gli errori di lettura dell'archivio o di
+aggiornamento vengono registrati nel log e il pannello resta senza quei peer.
+"""
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Metriche confrontate tra peer (più alto = meglio)
+PEER_METRICS = ["Gross Margin", "Operating Margin", "Net Margin", "Revenue Y/Y", "Net Income Y/Y"]
+
+# Livelli di raggruppamento, dal più ampio al più specifico
+PEER_LEVELS = {"sector": "Settore", "industry": "Industria"}
+
+# Peer minimi (compreso il ticker) perché le statistiche di un gruppo siano mostrate
+MIN_PEERS = 3
+
+
+def latest_metrics(df_income_full):
+    """Metriche di confronto dell'ultimo periodo di un'analisi (TTM se presente)."""
+    row = df_income_full.loc["TTM"] if "TTM" in df_income_full.index else df_income_full.iloc[0]
+    return pd.to_numeric(row.reindex(PEER_METRICS), errors="coerce")
+
+
+def _latest_rows(panel):
+    """Dal pannello lungo dell'archivio, una riga per ticker con l'ultimo periodo."""
+    if panel.empty:
+        return pd.DataFrame(columns=PEER_METRICS)
+    ordered = panel.assign(_is_ttm=panel["period"] == "TTM").sort_values(
+        ["ticker", "_is_ttm", "period_end"], na_position="first")
+    # Righe intere: last() prenderebbe per ogni metrica l'ultimo valore non nullo,
+    # mescolando il TTM con l'anno precedente dove il TTM manca
+    return ordered.groupby("ticker").tail(1).set_index("ticker")[PEER_METRICS]
+
+
+class PeerPanel:
+    """Pannello dei peer con statistiche per settore e industria aggiornate in modo incrementale."""
+
+    def __init__(self, store=None, info_lookup=None):
+        self.store = store
+        self.info_lookup = info_lookup
+        self._panel = pd.DataFrame(columns=PEER_METRICS + list(PEER_LEVELS), dtype=object)
+        self._stats = {level: {} for level in PEER_LEVELS}
+        self._dirty = {level: set() for level in PEER_LEVELS}
+        self._lock = threading.Lock()
+        if store is not None:
+            self.refresh()
+
+    def _classification(self, ticker, info=None):
+        if info is None and self.info_lookup is not None:
+            try:
+                info = self.info_lookup(ticker)
+            except Exception:
+                info = None
+        info = info or {}
+        return {level: info.get(level) or None for level in PEER_LEVELS}
+
+    def _set_rows(self, rows):
+        """Sostituisce le righe dei ticker in rows e segna come da ricalcolare i gruppi coinvolti."""
+        for level in PEER_LEVELS:
+            previous = self._panel[level].reindex(rows.index).dropna()
+            self._dirty[level].update(previous)
+            self._dirty[level].update(rows[level].dropna())
+        panel = self._panel.drop(index=rows.index, errors="ignore")
+        self._panel = rows if panel.empty else pd.concat([panel, rows])
+
+    def refresh(self, tickers=None):
+        """Rilegge dall'archivio i ticker indicati (tutti se None)."""
+        if self.store is None:
+            return
+        try:
+            rows = _latest_rows(self.store.load_panel(PEER_METRICS, tickers=tickers))
+        except Exception as e:
+            logger.warning("Lettura dei peer dall'archivio non riuscita: %s", e)
+            return
+        if rows.empty:
+            return
+        classification = pd.DataFrame([self._classification(t) for t in rows.index], index=rows.index)
+        with self._lock:
+            self._set_rows(rows.join(classification))
+
+    def update(self, ticker, df_income_full, info=None):
+        """Aggiorna il pannello con una nuova analisi del ticker."""
+        try:
+            row = latest_metrics(df_income_full).to_frame(ticker).T
+            for level, value in self._classification(ticker, info).items():
+                row[level] = value
+            with self._lock:
+                self._set_rows(row)
+        except Exception as e:
+            logger.warning("Aggiornamento dei peer non riuscito per %s: %s", ticker, e)
+
+    def _group_stats(self, level):
+        """Statistiche del livello, ricalcolate solo per i gruppi modificati."""
+        dirty = self._dirty[level]
+        if dirty:
+            members = self._panel[self._panel[level].isin(dirty)]
+            values = members[PEER_METRICS].apply(pd.to_numeric, errors="coerce")
+            grouped = values.groupby(members[level])
+            ranks = grouped.rank(pct=True) * 100
+            medians = grouped.median()
+            counts = grouped.size()
+            for group in dirty:
+                if group not in counts.index:
+                    self._stats[level].pop(group, None)
+                    continue
+                in_group = members[level] == group
+                self._stats[level][group] = {
+                    "median": medians.loc[group],
+                    "rank": ranks[in_group],
+                    "count": int(counts.loc[group]),
+                }
+            dirty.clear()
+        return self._stats[level]
+
+    def compare(self, ticker):
+        """
+        Confronto del ticker con i peer: una riga per metrica con valore, mediana e
+        percentile (0-100, 100 = migliore) per settore e industria. Le colonne di un
+        livello sono NaN se il gruppo ha meno di MIN_PEERS ticker.
+        Restituisce (tabella, {livello: (gruppo, numero di peer)}); tabella vuota se
+        il ticker non è nel pannello.
+        """
+        with self._lock:
+            if ticker not in self._panel.index:
+                return pd.DataFrame(), {}
+            own = pd.to_numeric(self._panel.loc[ticker, PEER_METRICS], errors="coerce")
+            table = pd.DataFrame({"Valore": own})
+            groups = {}
+            for level, label in PEER_LEVELS.items():
+                group = self._panel.loc[ticker, level]
+                stats = self._group_stats(level).get(group) if group is not None else None
+                if stats is None or stats["count"] < MIN_PEERS:
+                    table[f"Mediana {label.lower()}"] = np.nan
+                    table[f"Percentile {label.lower()}"] = np.nan
+                    groups[level] = (group, stats["count"] if stats else 0)
+                    continue
+                table[f"Mediana {label.lower()}"] = stats["median"]
+                table[f"Percentile {label.lower()}"] = stats["rank"].loc[ticker]
+                groups[level] = (group, stats["count"])
+        return table, groups
+
+    def group_summary(self, level="sector"):
+        """Mediane per gruppo del livello indicato, con il numero di ticker."""
+        with self._lock:
+            stats = self._group_stats(level)
+            if not stats:
+                return pd.DataFrame(columns=["Ticker"] + PEER_METRICS)
+            summary = pd.DataFrame({group: s["median"] for group, s in stats.items()}).T
+            summary.insert(0, "Ticker", pd.Series({group: s["count"] for group, s in stats.items()}))
+        return summary.sort_index()
+
+    def __len__(self):
+        return len(self._panel)
@@ -0,0 +1,166 @@
+"""
+Prefetch in background degli statement dei ticker della watchlist e dei più richiesti.
+
+A intervalli regolari il prefetcher riscarica annuale, trimestrale e info dei
+ticker configurati (PREFETCH_WATCHLIST) e dei PREFETCH_TOP_N ticker più
+richiesti in modo interattivo, quando mancano dalla cache persistente o
+scadono entro PREFETCH_REFRESH_AHEAD secondi: gli utenti trovano così quasi
+sempre la cache calda. Le richieste passano dal FetchService (coalescing con
+quelle interattive) e quindi dallo scheduler condiviso; le età delle voci sono
+lette dal file SQLite comune, quindi i worker che eseguono il prefetch non
+riscaricano ciò che un altro ha già aggiornato.
+
+Può girare in un thread dell'app oppure come processo separato:
+    python prefetcher.py                        (ciclo continuo)
+    python prefetcher.py --once AAPL MSFT       (un solo ciclo)
+
+Configurazione tramite variabili d'ambiente:
+    PREFETCH_ENABLED        0 per non avviare il prefetch nell'app
+    PREFETCH_WATCHLIST      ticker sempre aggiornati (elenco separato da virgole o file)
+    PREFETCH_TOP_N          ticker più richiesti (negli ultimi 7 giorni) da aggiornare
+    PREFETCH_INTERVAL       secondi tra due cicli
+    PREFETCH_REFRESH_AHEAD  anticipo in secondi sulla scadenza (TTL) della cache
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import wait
+
+from batch import parse_tickers, read_tickers_file
+from data_sources import KINDS
+from fetch_service import FetchService
+from instrumentation import increment, span
+from statement_cache import StatementCache
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "1") != "0"
+PREFETCH_WATCHLIST = os.environ.get("PREFETCH_WATCHLIST", "")
+PREFETCH_TOP_N = int(os.environ.get("PREFETCH_TOP_N", 20))
+PREFETCH_INTERVAL = float(os.environ.get("PREFETCH_INTERVAL", 600))
+PREFETCH_REFRESH_AHEAD = float(os.environ.get("PREFETCH_REFRESH_AHEAD", 1800))
+
+# Finestra delle statistiche d'uso per i ticker più richiesti
+USAGE_WINDOW = 7 * 86400
+
+
+def parse_watchlist(value):
+    """Ticker della watchlist: un file (uno per riga, con commenti) oppure un elenco."""
+    if value and os.path.isfile(value):
+        return read_tickers_file(value)
+    return parse_tickers(value)
+
+
+class Prefetcher:
+    """Aggiorna a intervalli la cache dei ticker della watchlist e dei più richiesti."""
+
+    def __init__(self, service, cache, watchlist=(), top_n=PREFETCH_TOP_N, interval=PREFETCH_INTERVAL,
+                 refresh_ahead=PREFETCH_REFRESH_AHEAD, kinds=KINDS):
+        self.service = service
+        self.cache = cache
+        self.watchlist = list(watchlist)
+        self.top_n = top_n
+        self.interval = interval
+        # Mai oltre metà del TTL, altrimenti ogni voce risulterebbe sempre da aggiornare
+        self.refresh_ahead = min(refresh_ahead, cache.ttl / 2)
+        self.kinds = kinds
+        # (ticker, tipo) -> ultimo tentativo: i dati non disponibili o in errore non
+        # vengono richiesti di nuovo prima di una voce appena aggiornata
+        self._attempts = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def tickers(self):
+        """Watchlist seguita dai ticker più richiesti, senza duplicati."""
+        popular = self.cache.most_requested(self.top_n, USAGE_WINDOW) if self.top_n > 0 else []
+        return list(dict.fromkeys(self.watchlist + popular))
+
+    def due(self):
+        """Coppie (ticker, tipo) assenti dalla cache o in scadenza entro refresh_ahead."""
+        ages = self.cache.ages()
+        threshold = self.cache.ttl - self.refresh_ahead
+        now = time.time()
+        return [(ticker, kind) for ticker in self.tickers() for kind in self.kinds
+                if ages.get((ticker, kind), float("inf")) > threshold
+                and now - self._attempts.get((ticker, kind), 0) > threshold]
+
+    def run_once(self):
+        """Un ciclo di prefetch; restituisce il numero di voci aggiornate."""
+        due = self.due()
+        if not due:
+            return 0
+        now = time.time()
+        self._attempts.update((key, now) for key in due)
+        with span("prefetch_cycle"):
+            futures = {self.service.submit(ticker, kind, refresh=True): (ticker, kind) for ticker, kind in due}
+            wait(futures)
+        refreshed = 0
+        for future, (ticker, kind) in futures.items():
+            error = future.exception()
+            if error is not None:
+                logger.warning("Prefetch fallito per %s/%s: %s", ticker, kind, error)
+                increment("prefetch_requests", kind=kind, result="error")
+            else:
+                refreshed += 1
+                increment("prefetch_requests", kind=kind, result="ok")
+        return refreshed
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.warning("Ciclo di prefetch fallito: %s", e)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Avvia il ciclo in un thread daemon (il primo ciclo parte subito)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="prefetcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prefetch degli statement nella cache persistente")
+    parser.add_argument("tickers", nargs="*", help="Ticker da aggiungere alla watchlist")
+    parser.add_argument("--watchlist", default=PREFETCH_WATCHLIST,
+                        help="Elenco di ticker o file con un ticker per riga (default: PREFETCH_WATCHLIST)")
+    parser.add_argument("--top", type=int, default=PREFETCH_TOP_N,
+                        help="Ticker più richiesti da aggiornare (default: %(default)s)")
+    parser.add_argument("--interval", type=float, default=PREFETCH_INTERVAL,
+                        help="Secondi tra due cicli (default: %(default)s)")
+    parser.add_argument("--once", action="store_true", help="Esegue un solo ciclo ed esce")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Log dettagliati")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    service = FetchService(StatementCache())
+    if not service.provider.remote:
+        logger.error("La sorgente %s non usa la cache persistente: nessun prefetch necessario",
+                     service.provider.name)
+        return 1
+    watchlist = parse_watchlist(args.watchlist) + parse_tickers(" ".join(args.tickers))
+    prefetcher = Prefetcher(service, service.cache, watchlist=watchlist, top_n=args.top,
+                            interval=args.interval)
+    if args.once:
+        print(f"Voci aggiornate: {prefetcher.run_once()}")
+        return 0
+    prefetcher.start()
+    try:
+        prefetcher._thread.join()
+    except KeyboardInterrupt:
+        prefetcher.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
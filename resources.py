@@ -0,0 +1,98 @@
+"""
+Risorse condivise dalle sessioni dell'app (una istanza per processo).
+
+Le funzioni stanno in un modulo a parte, e non in app.py, perché Streamlit
+riesegue lo script a ogni interazione e ridecora ogni funzione in cache
+(leggendone il sorgente per calcolarne la chiave): qui il decoratore
+st.cache_resource viene applicato una volta sola, all'import del modulo.
+
+Configurazione tramite variabili d'ambiente:
+    ANALYSIS_CACHE_SIZE  analisi annuali conservate in memoria e condivise tra sessioni
+"""
+import logging
+import os
+
+import streamlit as st
+
+from analysis import AnalysisCache
+from data_sources import get_provider
+from fetch_service import FetchService
+from mapping_registry import MappingRegistry
+from peers import PeerPanel
+from prefetcher import PREFETCH_ENABLED, PREFETCH_WATCHLIST, Prefetcher, parse_watchlist
+from session_memory import SessionMemory
+from statement_cache import StatementCache
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_CACHE_SIZE = int(os.environ.get("ANALYSIS_CACHE_SIZE", 64))
+
+
+@st.cache_resource
+def get_session_memory():
+    """Budget di memoria delle sessioni del processo"""
+    return SessionMemory()
+
+@st.cache_resource
+def get_data_provider():
+    """Sorgente dati della deployment (DATA_SOURCE), condivisa tra sessioni"""
+    return get_provider()
+
+@st.cache_resource
+def get_statement_cache():
+    """Cache persistente su disco condivisa tra sessioni, worker e riavvii"""
+    return StatementCache()
+
+@st.cache_resource
+def get_fetch_service():
+    """Servizio di recupero condiviso: le richieste in corso per lo stesso ticker vengono unite tra sessioni"""
+    return FetchService(get_statement_cache(), provider=get_data_provider())
+
+@st.cache_resource
+def get_prefetcher():
+    """
+    Prefetch in background della watchlist e dei ticker più richiesti, avviato una volta
+    per processo (solo per le sorgenti di rete, le uniche che passano dalla cache)
+    """
+    if not PREFETCH_ENABLED or not get_data_provider().remote:
+        return None
+    return Prefetcher(get_fetch_service(), get_statement_cache(),
+                      watchlist=parse_watchlist(PREFETCH_WATCHLIST)).start()
+
+@st.cache_resource
+def get_panel_store():
+    """Archivio Parquet delle analisi, condiviso tra sessioni"""
+    # Import differito: l'archivio (pyarrow.dataset) serve solo dopo un'analisi
+    from panel_store import PanelStore
+    return PanelStore()
+
+@st.cache_resource
+def get_mapping_registry():
+    """Registro persistente dei mapping accettati, condiviso tra sessioni"""
+    return MappingRegistry()
+
+def cached_company_info(ticker):
+    """Info aziendali senza chiamate di rete: dalla sorgente locale o dalla cache persistente"""
+    provider = get_data_provider()
+    if not provider.remote:
+        return provider.info(ticker)
+    cached = get_statement_cache().get(ticker, "info")
+    return cached[0] if cached is not None else None
+
+@st.cache_resource
+def get_peer_panel():
+    """
+    Pannello dei peer costruito una volta dall'archivio e poi aggiornato a ogni analisi
+    (senza archivio, se non è disponibile, contiene solo le analisi successive)
+    """
+    try:
+        store = get_panel_store()
+    except Exception as e:
+        logger.warning("Archivio delle analisi non disponibile per i peer: %s", e)
+        store = None
+    return PeerPanel(store, info_lookup=cached_company_info)
+
+@st.cache_resource
+def get_analysis_cache():
+    """Analisi annuali condivise tra sessioni (le ANALYSIS_CACHE_SIZE usate più di recente)"""
+    return AnalysisCache(ANALYSIS_CACHE_SIZE)
@@ -0,0 +1,229 @@
+"""
+Statement compatti in sessione e budget di memoria per sessione.
+
+Gli statement caricati in sessione sono tenuti in forma compatta
+(compact_statement): un unico blocco di valori float senza colonne object, le
+voci di bilancio come indice categorico (categorie condivise tra gli statement
+con lo stesso layout) e i periodi come DatetimeIndex. Le analisi derivate
+riusano le colonne senza copiarle: è sicuro solo con il copy-on-write, sempre
+attivo da pandas 3 (per questo requirements.txt richiede pandas>=3.0).
+
+I dati pesanti di ogni sessione (statement, analisi, grafici, risultati batch)
+stanno in un SessionData registrato nel SessionMemory del processo, che a ogni
+esecuzione di una sessione:
+  - ne stima l'occupazione e, oltre il budget della sessione, libera per primi
+    i dati ricostruibili (grafici in cache, stato dell'analisi incrementale...),
+  - libera i dati delle sessioni inattive da più di SESSION_IDLE_SECONDS e,
+    oltre il budget complessivo, quelli delle sessioni inattive da più tempo.
+Una sessione i cui dati sono stati liberati li ricarica (dalla cache
+persistente) alla successiva interazione.
+
+Configurazione tramite variabili d'ambiente:
+    SESSION_MEMORY_MB        budget di memoria di ciascuna sessione
+    SESSION_MEMORY_TOTAL_MB  budget complessivo delle sessioni del processo
+    SESSION_IDLE_SECONDS     inattività oltre la quale i dati di una sessione vengono liberati
+    STATEMENT_FLOAT32        1 per tenere sempre gli statement a 32 bit (circa 7 cifre
+                             significative); di default solo se la conversione è esatta
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import increment
+
+SESSION_MEMORY_MB = float(os.environ.get("SESSION_MEMORY_MB", 64))
+SESSION_MEMORY_TOTAL_MB = float(os.environ.get("SESSION_MEMORY_TOTAL_MB", 1024))
+SESSION_IDLE_SECONDS = float(os.environ.get("SESSION_IDLE_SECONDS", 1800))
+STATEMENT_FLOAT32 = os.environ.get("STATEMENT_FLOAT32", "0") == "1"
+
+# Inattività minima perché una sessione possa essere liberata per il budget complessivo
+# (evita di togliere i dati a un'esecuzione ancora in corso)
+EVICTION_GRACE_SECONDS = 60
+
+###############################################
+# STATEMENT COMPATTI
+###############################################
+
+@lru_cache(maxsize=256)
+def _line_item_dtype(columns):
+    """Tipo categorico delle voci di un layout, condiviso da tutti gli statement con quel layout."""
+    return pd.CategoricalDtype(list(dict.fromkeys(columns)))
+
+
+def compact_statement(df, float32=STATEMENT_FLOAT32):
+    """
+    Forma compatta di uno statement (periodi x voci): un unico blocco float64, o
+    float32 se richiesto o se la conversione è esatta, voci come CategoricalIndex e
+    periodi come DatetimeIndex. I valori non numerici diventano NaN.
+    """
+    if df is None or df.empty:
+        return df
+    if all(pd.api.types.is_numeric_dtype(dtype) for dtype in df.dtypes):
+        values = df.to_numpy(dtype=float)
+    else:
+        values = df.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    single = values.astype(np.float32)
+    if float32 or np.array_equal(single, values, equal_nan=True):
+        values = single
+    periods = df.index if isinstance(df.index, pd.DatetimeIndex) else pd.to_datetime(df.index, errors="coerce")
+    line_items = pd.CategoricalIndex(df.columns, dtype=_line_item_dtype(tuple(df.columns)))
+    return pd.DataFrame(values, index=periods, columns=line_items, copy=False)
+
+###############################################
+# STIMA DELL'OCCUPAZIONE
+###############################################
+
+def _buffer_key(array):
+    return array.__array_interface__["data"][0], array.nbytes
+
+
+def estimate_nbytes(obj, _seen=None):
+    """
+    Stima dei byte occupati da obj (DataFrame, Series, array, figure Plotly e
+    contenitori di questi). Oggetti e buffer condivisi, come le colonne riusate
+    da più DataFrame, sono contati una volta sola.
+    """
+    seen = set() if _seen is None else _seen
+    if isinstance(obj, np.ndarray) and obj.dtype != object:
+        # Le viste sono oggetti diversi sullo stesso buffer: si confronta il buffer
+        key = _buffer_key(obj)
+        if key in seen:
+            return 0
+        seen.add(key)
+        return obj.nbytes
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes + sum(estimate_nbytes(item, seen) for item in obj.ravel())
+    if isinstance(obj, pd.Index):
+        return obj.memory_usage(deep=True)
+    if isinstance(obj, pd.Series):
+        if pd.api.types.is_numeric_dtype(obj.dtype) and not isinstance(obj.dtype, pd.CategoricalDtype):
+            values = estimate_nbytes(obj.to_numpy(copy=False), seen)
+        else:
+            values = obj.memory_usage(deep=True, index=False)
+        return values + estimate_nbytes(obj.index, seen)
+    if isinstance(obj, pd.DataFrame):
+        return (estimate_nbytes(obj.index, seen) + estimate_nbytes(obj.columns, seen)
+                + sum(estimate_nbytes(column.to_numpy(copy=False), seen)
+                      if pd.api.types.is_numeric_dtype(column.dtype)
+                      else column.memory_usage(deep=True, index=False)
+                      for _, column in obj.items()))
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(estimate_nbytes(value, seen) for value in obj.values())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(estimate_nbytes(item, seen) for item in obj)
+    if hasattr(obj, "data") and hasattr(obj, "layout"):
+        # Figure Plotly: contano i dati delle tracce
+        return sum(estimate_nbytes(trace[axis], seen)
+                   for trace in obj.data for axis in ("x", "y") if trace[axis] is not None)
+    return sys.getsizeof(obj)
+
+###############################################
+# DATI E BUDGET DELLE SESSIONI
+###############################################
+
+class SessionData:
+    """
+    Dati pesanti di una sessione, come attributi. fields è un dizionario
+    nome -> factory del valore iniziale; evict() riporta tutti i campi ai valori
+    iniziali e segna i dati come liberati.
+    """
+
+    def __init__(self, fields):
+        self._fields = dict(fields)
+        self.evicted = False
+        self.reset()
+
+    def reset(self, names=None):
+        for name in names or self._fields:
+            setattr(self, name, self._fields[name]())
+
+    def evict(self):
+        self.reset()
+        self.evicted = True
+
+    def nbytes(self):
+        return estimate_nbytes([getattr(self, name) for name in self._fields])
+
+    def trim(self, budget, names):
+        """
+        Libera i campi names, nell'ordine, finché l'occupazione non rientra nel budget
+        (per le cache OrderedDict si tolgono prima le voci meno recenti).
+        Restituisce (occupazione finale, campi liberati).
+        """
+        size = self.nbytes()
+        freed = []
+        for name in names:
+            if size <= budget:
+                break
+            value = getattr(self, name)
+            if isinstance(value, OrderedDict):
+                while value and size > budget:
+                    value.popitem(last=False)
+                    size = self.nbytes()
+            else:
+                self.reset([name])
+                size = self.nbytes()
+            freed.append(name)
+        return size, freed
+
+
+class SessionMemory:
+    """Registro delle sessioni del processo, con occupazione e ultima attività di ciascuna."""
+
+    def __init__(self, session_budget=SESSION_MEMORY_MB * 2**20, total_budget=SESSION_MEMORY_TOTAL_MB * 2**20,
+                 idle_seconds=SESSION_IDLE_SECONDS, clock=time.monotonic):
+        self.session_budget = session_budget
+        self.total_budget = total_budget
+        self.idle_seconds = idle_seconds
+        self.clock = clock
+        # session_id -> [SessionData, ultima attività, byte stimati]
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def attach(self, session_id, data, trimmable=()):
+        """
+        Registra i dati della sessione all'inizio di un'esecuzione: li riporta nel budget
+        della sessione liberando i campi trimmable e libera quelli delle sessioni
+        inattive. Restituisce True se i dati della sessione erano stati liberati.
+        """
+        evicted = data.evicted
+        data.evicted = False
+        size, freed = data.trim(self.session_budget, trimmable)
+        for name in freed:
+            increment("session_memory_evictions", reason="session_budget", field=name)
+        now = self.clock()
+        with self._lock:
+            self._sessions[session_id] = [data, now, size]
+            self._evict_inactive(now, session_id)
+        return evicted
+
+    def _evict_inactive(self, now, current):
+        idle = sorted((entry[1], session_id) for session_id, entry in self._sessions.items()
+                      if session_id != current)
+        total = sum(entry[2] for entry in self._sessions.values())
+        for last_active, session_id in idle:
+            inactive = now - last_active
+            if inactive > self.idle_seconds:
+                reason = "idle"
+            elif total > self.total_budget and inactive > EVICTION_GRACE_SECONDS:
+                reason = "total_budget"
+            else:
+                continue
+            data, _, size = self._sessions.pop(session_id)
+            data.evict()
+            total -= size
+            increment("session_memory_evictions", reason=reason, field="all")
+
+    def summary(self):
+        """Numero di sessioni registrate e loro occupazione complessiva stimata (MB)."""
+        with self._lock:
+            return len(self._sessions), sum(entry[2] for entry in self._sessions.values()) / 2**20
@@ -0,0 +1,246 @@
+"""
+Cache persistente su disco (SQLite) per gli statement e le info aziendali.
+
+Il file SQLite è condiviso tra i worker Streamlit e sopravvive ai riavvii, così
+un deploy "a caldo" serve i dati senza chiamate a Yahoo Finance. Ogni voce è
+identificata da ticker, tipo di statement e data di recupero. Lo stesso file
+conta le richieste interattive per ticker, usate dal prefetcher per tenere in
+cache i ticker più richiesti.
+
+Configurazione tramite variabili d'ambiente:
+    STATEMENT_CACHE_PATH       percorso del file SQLite
+    STATEMENT_CACHE_TTL        secondi in cui una voce è considerata fresca
+    STATEMENT_CACHE_STALE_TTL  secondi oltre il TTL in cui una voce scaduta viene
+                               ancora servita mentre si aggiorna in background
+    STATEMENT_CACHE_MAX_MB     dimensione massima della cache prima dell'eviction
+"""
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from instrumentation import increment, span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "income-statement-app", "statements.sqlite"
+)
+
+CACHE_PATH = os.environ.get("STATEMENT_CACHE_PATH", DEFAULT_CACHE_PATH)
+CACHE_TTL = int(os.environ.get("STATEMENT_CACHE_TTL", 7200))
+CACHE_STALE_TTL = int(os.environ.get("STATEMENT_CACHE_STALE_TTL", 86400))
+CACHE_MAX_BYTES = int(float(os.environ.get("STATEMENT_CACHE_MAX_MB", 256)) * 1024 * 1024)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS statements (
+    ticker      TEXT NOT NULL,
+    kind        TEXT NOT NULL,
+    fetch_date  TEXT NOT NULL,
+    fetched_at  REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size        INTEGER NOT NULL,
+    payload     BLOB NOT NULL,
+    PRIMARY KEY (ticker, kind, fetch_date)
+)
+"""
+
+_USAGE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ticker_requests (
+    ticker          TEXT PRIMARY KEY,
+    requests        INTEGER NOT NULL,
+    last_requested  REAL NOT NULL
+)
+"""
+
+
+def _is_cacheable(value):
+    """Non salva risposte vuote o mancanti."""
+    if value is None:
+        return False
+    if hasattr(value, "empty"):
+        return not value.empty
+    return bool(value)
+
+
+class StatementCache:
+    """Cache key/value su SQLite con TTL, eviction per dimensione e stale-while-revalidate."""
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, stale_ttl=CACHE_STALE_TTL,
+                 max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+        self._revalidating = set()
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            # WAL permette letture concorrenti da più processi durante le scritture
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            conn.execute(_USAGE_SCHEMA)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_statements_accessed ON statements (accessed_at)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        """Connessione con commit (o rollback) all'uscita, poi chiusa: sqlite3 da solo non la chiude."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, ticker, kind):
+        """Restituisce (valore, età in secondi) della voce più recente, oppure None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT fetch_date, fetched_at, payload FROM statements "
+                "WHERE ticker = ? AND kind = ? ORDER BY fetched_at DESC LIMIT 1",
+                (ticker, kind),
+            ).fetchone()
+            if row is None:
+                return None
+            fetch_date, fetched_at, payload = row
+            conn.execute(
+                "UPDATE statements SET accessed_at = ? WHERE ticker = ? AND kind = ? AND fetch_date = ?",
+                (time.time(), ticker, kind, fetch_date),
+            )
+        try:
+            value = pickle.loads(payload)
+        except Exception as e:
+            logger.warning("Voce di cache illeggibile per %s/%s: %s", ticker, kind, e)
+            return None
+        return value, time.time() - fetched_at
+
+    def put(self, ticker, kind, value):
+        """Salva il valore con la data di recupero corrente ed applica l'eviction."""
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        fetch_date = datetime.fromtimestamp(now).strftime("%Y-%m-%d")
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO statements "
+                "(ticker, kind, fetch_date, fetched_at, accessed_at, size, payload) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (ticker, kind, fetch_date, now, now, len(payload), payload),
+            )
+        self.evict()
+
+    def ages(self):
+        """Età in secondi della voce più recente di ogni (ticker, tipo), senza leggerne il contenuto."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT ticker, kind, MAX(fetched_at) FROM statements GROUP BY ticker, kind"
+            ).fetchall()
+        now = time.time()
+        return {(ticker, kind): now - fetched_at for ticker, kind, fetched_at in rows}
+
+    def refresh(self, ticker, kind, fetch):
+        """Chiama fetch(ticker) e salva il risultato, qualunque sia l'età della voce in cache."""
+        with span("cache_refresh_fetch", kind=kind):
+            value = fetch(ticker)
+        if _is_cacheable(value):
+            self.put(ticker, kind, value)
+        return value
+
+    def record_request(self, ticker):
+        """Conta una richiesta interattiva del ticker."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO ticker_requests (ticker, requests, last_requested) VALUES (?, 1, ?) "
+                "ON CONFLICT(ticker) DO UPDATE SET requests = requests + 1, "
+                "last_requested = excluded.last_requested",
+                (ticker, time.time()),
+            )
+
+    def most_requested(self, limit, window=None):
+        """Ticker più richiesti (al massimo limit), limitati a quelli richiesti negli ultimi window secondi."""
+        since = time.time() - window if window is not None else 0
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT ticker FROM ticker_requests WHERE last_requested >= ? "
+                "ORDER BY requests DESC, last_requested DESC LIMIT ?",
+                (since, limit),
+            ).fetchall()
+        return [ticker for ticker, in rows]
+
+    def evict(self):
+        """Rimuove le voci usate meno di recente finché la cache supera max_bytes."""
+        with self._connect() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM statements").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = conn.execute(
+                "SELECT ticker, kind, fetch_date, size FROM statements ORDER BY accessed_at ASC"
+            ).fetchall()
+            for ticker, kind, fetch_date, size in rows:
+                if total <= self.max_bytes:
+                    break
+                conn.execute(
+                    "DELETE FROM statements WHERE ticker = ? AND kind = ? AND fetch_date = ?",
+                    (ticker, kind, fetch_date),
+                )
+                total -= size
+
+    def invalidate(self, ticker=None):
+        """Elimina le voci di un ticker, oppure l'intera cache se ticker è None."""
+        with self._connect() as conn:
+            if ticker is None:
+                conn.execute("DELETE FROM statements")
+            else:
+                conn.execute("DELETE FROM statements WHERE ticker = ?", (ticker,))
+
+    def get_or_fetch(self, ticker, kind, fetch):
+        """
+        Restituisce il valore in cache se fresco. Se è scaduto ma ancora entro la
+        finestra stale lo restituisce subito e lo aggiorna in background; altrimenti
+        chiama fetch(ticker) e salva il risultato.
+        """
+        cached = self.get(ticker, kind)
+        if cached is not None:
+            value, age = cached
+            if age <= self.ttl:
+                increment("statement_cache_requests", kind=kind, result="hit")
+                return value
+            if age <= self.ttl + self.stale_ttl:
+                increment("statement_cache_requests", kind=kind, result="stale")
+                self._revalidate(ticker, kind, fetch)
+                return value
+
+        increment("statement_cache_requests", kind=kind, result="miss")
+        with span("cache_miss_fetch", kind=kind):
+            value = fetch(ticker)
+        if _is_cacheable(value):
+            self.put(ticker, kind, value)
+        return value
+
+    def _revalidate(self, ticker, kind, fetch):
+        key = (ticker, kind)
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def worker():
+            try:
+                value = fetch(ticker)
+                if _is_cacheable(value):
+                    self.put(ticker, kind, value)
+            except Exception as e:
+                logger.warning("Aggiornamento in background fallito per %s/%s: %s", ticker, kind, e)
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        threading.Thread(target=worker, name=f"revalidate-{ticker}-{kind}", daemon=True).start()
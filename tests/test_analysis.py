@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+
+from analysis import AnalysisCache, _same_quarter_last_year, config, rolling_ttm, update_income_analysis
+
+
+def statement():
+    index = pd.DatetimeIndex(["2023-12-31", "2022-12-31"])
+    return pd.DataFrame({"Total Revenue": [100.0, 80.0], "Cost Of Revenue": [40.0, 30.0],
+                         "Zero": [0.0, 0.0]}, index=index)
+
+
+def mapping(**overrides):
+    base = {target: None for target in config["income_mapping"]}
+    base.update({"Revenue": "Total Revenue", "Total COGS": "Cost Of Revenue"})
+    base.update(overrides)
+    return base
+
+
+def test_messages_are_kept_per_target():
+    annual = statement()
+    # Falliscono "S&M" e "SG&A"; poi si corregge solo "SG&A"
+    state = update_income_analysis(None, annual, None, mapping(**{"S&M": "`Total Revenue` / `Zero`",
+                                                                   "SG&A": "`Total Revenue` / `Zero`"}),
+                                   include_ttm=False)
+    assert set(state["messages"]) == {"S&M", "SG&A"}
+
+    state = update_income_analysis(state, annual, None, mapping(**{"S&M": "`Total Revenue` / `Zero`",
+                                                                   "SG&A": "`Total Revenue` * 2"}),
+                                   include_ttm=False)
+    assert state["affected"] is not None
+    assert set(state["messages"]) == {"S&M"}
+    assert state["df_income_full"]["SG&A"].tolist() == [200.0, 160.0]
+
+
+def test_target_name_prefix_does_not_drop_other_messages():
+    annual = statement()
+    failing = "`Total Revenue` / `Zero`"
+    state = update_income_analysis(None, annual, None, mapping(**{"Net Income": failing, "EPS": failing}),
+                                   include_ttm=False)
+    # "Net Interest Income" condivide il prefisso "Net" con "Net Income"
+    state = update_income_analysis(state, annual, None,
+                                   mapping(**{"Net Income": failing, "EPS": failing,
+                                              "Net Interest Income": "Total Revenue"}),
+                                   include_ttm=False)
+    assert set(state["messages"]) == {"Net Income", "EPS"}
+
+
+def test_analysis_cache_copies_results_and_evicts_oldest():
+    annual = statement()
+    state = update_income_analysis(None, annual, None, mapping(), include_ttm=False)
+    cache = AnalysisCache(max_entries=2)
+    entry = cache.put("a", state)
+    assert set(entry) == {"include_ttm", "mapping", "messages", "df_income_full", "df_income_display"}
+    assert not np.shares_memory(entry["df_income_full"]["Revenue"].to_numpy(),
+                                state["df_income_full"]["Revenue"].to_numpy())
+    cache.put("b", state)
+    cache.get("a")
+    cache.put("c", state)
+    assert cache.get("b") is None
+    assert cache.get("a") is entry
+    assert len(cache) == 2
+
+
+def test_state_without_intermediate_frames_is_recomputed():
+    annual = statement()
+    state = update_income_analysis(None, annual, None, mapping(), include_ttm=False)
+    state = dict(state, mapped=None, derived=None)
+    state = update_income_analysis(state, annual, None, mapping(**{"SG&A": "Total Revenue"}), include_ttm=False)
+    assert state["affected"] is None
+    assert state["df_income_full"]["SG&A"].tolist() == [100.0, 80.0]
+
+
+def quarterly(**columns):
+    """Statement trimestrale dal più recente, con le voci date dal trimestre più vecchio."""
+    length = len(next(iter(columns.values())))
+    index = pd.date_range("2023-03-31", periods=length, freq="QE")
+    return pd.DataFrame(columns, index=index).iloc[::-1]
+
+
+def test_rolling_ttm_sums_flows_over_four_quarters():
+    ttm = rolling_ttm(quarterly(**{"Total Revenue": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]}))
+    assert ttm["Total Revenue"].tolist()[:3] == [18.0, 14.0, 10.0]
+    assert ttm["Total Revenue"].iloc[3:].isna().all()
+
+
+def test_rolling_ttm_masks_windows_across_a_missing_quarter():
+    statement = quarterly(**{"Total Revenue": np.arange(1.0, 11.0)})
+    statement = statement.drop(pd.Timestamp("2024-03-31"))
+    ttm = rolling_ttm(statement)["Total Revenue"]
+    assert ttm[pd.Timestamp("2025-06-30")] == 7.0 + 8.0 + 9.0 + 10.0
+    assert ttm[pd.Timestamp("2025-03-31")] == 6.0 + 7.0 + 8.0 + 9.0
+    assert ttm[pd.Timestamp("2023-12-31")] == 1.0 + 2.0 + 3.0 + 4.0
+    for quarter in ["2024-06-30", "2024-09-30", "2024-12-31"]:
+        assert np.isnan(ttm[pd.Timestamp(quarter)])
+
+
+def test_rolling_ttm_nan_item_invalidates_its_windows_only():
+    ttm = rolling_ttm(quarterly(**{"Total Revenue": [1.0, np.nan, 3.0, 4.0, 5.0, 6.0],
+                                   "Cost Of Revenue": [1.0] * 6}))
+    assert ttm["Total Revenue"].iloc[0] == 18.0
+    assert ttm["Total Revenue"].iloc[1:].isna().all()
+    assert ttm["Cost Of Revenue"].tolist()[:3] == [4.0, 4.0, 4.0]
+
+
+def test_rolling_ttm_averages_share_counts_and_keeps_last_balances():
+    ttm = rolling_ttm(quarterly(**{"Diluted Average Shares": [10.0, 10.0, 20.0, 20.0, 30.0],
+                                   "Shares Outstanding": [1.0, 2.0, 3.0, 4.0, 5.0]}))
+    assert ttm["Diluted Average Shares"].tolist()[:2] == [20.0, 15.0]
+    assert ttm["Shares Outstanding"].tolist()[:2] == [5.0, 4.0]
+
+
+def test_rolling_ttm_recomputes_eps_from_income_and_shares():
+    ttm = rolling_ttm(quarterly(**{"Net Income": [10.0, 20.0, 30.0, 40.0],
+                                   "Diluted Average Shares": [10.0, 10.0, 10.0, 30.0],
+                                   "Diluted EPS": [1.0, 2.0, 3.0, 4.0 / 3]}))
+    assert ttm["Diluted EPS"].iloc[0] == 100.0 / 15.0
+
+
+def test_rolling_ttm_sums_eps_without_share_data():
+    ttm = rolling_ttm(quarterly(**{"Net Income": [10.0, 20.0, 30.0, 40.0],
+                                   "Diluted EPS": [1.0, 2.0, 3.0, 4.0]}))
+    assert ttm["Diluted EPS"].iloc[0] == 10.0
+
+
+def test_quarterly_growth_compares_the_same_quarter_across_a_gap():
+    df = quarterly(Revenue=[100.0, 110.0, 120.0, 130.0, 150.0, 165.0, 180.0, 195.0])
+    df = df.drop(pd.Timestamp("2023-06-30"))
+    growth = _same_quarter_last_year("Revenue")[1](df)
+    assert growth[pd.Timestamp("2024-03-31")] == 50.0
+    assert np.isnan(growth[pd.Timestamp("2024-06-30")])
+    assert growth[pd.Timestamp("2024-09-30")] == 50.0
+    assert growth.iloc[-3:].isna().all()
@@ -0,0 +1,16 @@
+import pandas as pd
+
+from cli import main
+
+
+def test_demo_analysis_is_written(tmp_path):
+    output = tmp_path / "analisi.csv"
+    assert main(["AAPL", "MSFT", "--demo", "--processes", "1", "--output", str(output)]) == 0
+    assert set(pd.read_csv(output)["Ticker"]) == {"AAPL", "MSFT"}
+
+
+def test_no_results_is_an_error(tmp_path):
+    # In modalità demo non ci sono dati trimestrali: nessun risultato, senza errori per ticker
+    output = tmp_path / "trimestri.csv"
+    assert main(["AAPL", "--demo", "--quarterly", "--processes", "1", "--output", str(output)]) == 1
+    assert not output.exists()
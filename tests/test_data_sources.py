@@ -0,0 +1,39 @@
+import pytest
+
+from data_sources import PROVIDERS, DataProvider, DemoProvider, get_provider, register_provider
+
+
+class Incomplete(DataProvider):
+    name = "incomplete"
+
+    def info(self, ticker):
+        return {}
+
+
+def test_provider_without_financials_cannot_be_registered_or_created():
+    with pytest.raises(TypeError):
+        register_provider("incomplete", Incomplete)
+    assert "incomplete" not in PROVIDERS
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_registered_provider_is_selectable():
+    class Static(DataProvider):
+        name = "static"
+
+        def financials(self, ticker):
+            return None
+
+    register_provider("static", Static)
+    try:
+        provider = get_provider("static")
+        assert provider.fetch("financials", "AAPL") is None
+        assert provider.fetch("quarterly_financials", "AAPL") is None
+    finally:
+        PROVIDERS.pop("static")
+
+
+def test_unknown_kind():
+    with pytest.raises(ValueError):
+        DemoProvider().fetch("balance_sheet", "AAPL")
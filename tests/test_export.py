@@ -0,0 +1,52 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from streamlit.runtime.download_data_util import convert_data_to_bytes_and_infer_mime
+
+from export import export_bytes, export_file
+
+
+def analysis():
+    index = ["TTM"] + list(pd.date_range("2015-12-31", periods=6, freq="YE")[::-1])
+    return pd.DataFrame(np.arange(28, dtype=float).reshape(7, 4), index=index,
+                        columns=["Revenue", "Net Income", "Net Margin", "EPS"])
+
+
+def panel():
+    return pd.concat({ticker: analysis() for ticker in ["AAPL", "MSFT", "NVDA"]}, names=["Ticker", "Periodo"])
+
+
+@pytest.mark.parametrize("df", [analysis(), panel()], ids=["ticker", "panel"])
+def test_chunked_csv_matches_single_chunk(df):
+    chunked = export_file(df, "csv", chunk_rows=3).read()
+    single = export_file(df, "csv", chunk_rows=len(df)).read()
+    assert chunked == single
+    table = pd.read_csv(io.BytesIO(chunked))
+    assert table.columns[0] in ("Periodo", "Ticker")
+    assert table["Periodo"].iloc[0] == "TTM"
+    assert len(table) == len(df)
+
+
+@pytest.mark.parametrize("df", [analysis(), panel()], ids=["ticker", "panel"])
+def test_chunked_parquet_has_one_row_group_per_chunk(df):
+    parquet = pq.ParquetFile(export_file(df, "parquet", chunk_rows=3))
+    assert parquet.metadata.num_row_groups == -(-len(df) // 3)
+    table = parquet.read().to_pandas()
+    assert table["Periodo"].tolist()[:2] == ["TTM", "2020-12-31"]
+    assert table["Revenue"].tolist() == df["Revenue"].tolist()
+
+
+def test_empty_table():
+    df = analysis().iloc[:0]
+    assert pq.read_table(export_file(df, "parquet")).num_rows == 0
+    assert export_file(df, "csv").read() == b""
+
+
+@pytest.mark.parametrize("fmt", ["csv", "parquet"])
+def test_export_bytes_accepted_by_download_button(fmt):
+    df = analysis()
+    data, _ = convert_data_to_bytes_and_infer_mime(export_bytes(df, fmt), TypeError("tipo non supportato"))
+    assert data == export_file(df, fmt).read()
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from expressions import MAX_EXPRESSION_LENGTH, compile_mapping_expr, evaluate_expression, transform_expr
+
+
+@pytest.mark.parametrize("expr", [
+    "`Total Revenue`.real",
+    "`Total Revenue`.__class__",
+    "(1).__class__.__bases__",
+    "__import__('os')",
+    "open('x')",
+    "round(`Total Revenue`)",
+    "np.abs(`Total Revenue`)",
+    "max(`Total Revenue`, 0, key=abs)",
+    "Revenue + 1",
+    "__builtins__",
+    "__col",
+    "`Total Revenue` ** 2",
+    "`Total Revenue` // 2",
+    "`Total Revenue`[0]",
+    "lambda: 1",
+    "'text'",
+    "True + 1",
+])
+def test_rejects_anything_outside_the_grammar(expr):
+    with pytest.raises(ValueError):
+        compile_mapping_expr(expr)
+
+
+def test_rejects_over_length_input():
+    expr = " + ".join(["1"] * MAX_EXPRESSION_LENGTH)
+    with pytest.raises(ValueError, match="troppo lunga"):
+        compile_mapping_expr(expr)
+
+
+def test_rejects_wrong_argument_counts():
+    with pytest.raises(ValueError):
+        compile_mapping_expr("abs(`A`, `B`)")
+    with pytest.raises(ValueError):
+        compile_mapping_expr("max(`A`)")
+
+
+def test_columns_are_referenced_once_in_order():
+    columns, _ = compile_mapping_expr("`B` + `A` * `B`")
+    assert columns == ("B", "A")
+
+
+def test_series_and_scalar_evaluation_agree():
+    expr = transform_expr("max(1, 2 * 0.5) - abs(3) / 1 + min(1, 2, 3)", ["A", "B", "C"])
+    frame = pd.DataFrame({"A": [10.0, -4.0, 0.0, np.nan], "B": [3.0, 8.0, -2.0, 1.0],
+                          "C": [2.0, 0.0, -5.0, 7.0]})
+    vectorized = evaluate_expression(expr, frame)
+    for position, row in enumerate(frame.to_dict("records")):
+        expected = evaluate_expression(expr, row)
+        assert vectorized.iloc[position] == pytest.approx(expected, nan_ok=True)
+
+
+def test_missing_columns_and_division_by_zero():
+    assert evaluate_expression("`A` + `B`", {"A": 2.0}) == 2.0
+    assert np.isinf(evaluate_expression("`A` / `B`", {"A": 1.0, "B": 0.0}))
@@ -0,0 +1,24 @@
+import pytest
+
+from fetch_scheduler import is_transient_error
+
+
+def test_builtin_connection_errors_are_transient():
+    assert is_transient_error(ConnectionError("reset"))
+    assert is_transient_error(TimeoutError("timed out"))
+    assert is_transient_error(Exception("Too Many Requests. Rate limited. Try after a while."))
+    assert not is_transient_error(ValueError("dati non validi"))
+
+
+def test_requests_errors_are_transient():
+    exceptions = pytest.importorskip("requests.exceptions")
+    assert is_transient_error(exceptions.ConnectionError("connessione rifiutata"))
+    assert is_transient_error(exceptions.ReadTimeout("read timed out"))
+    assert not is_transient_error(exceptions.HTTPError("404 Client Error"))
+
+
+def test_curl_cffi_errors_are_transient():
+    exceptions = pytest.importorskip("curl_cffi.requests.exceptions")
+    assert is_transient_error(exceptions.ConnectionError("connessione rifiutata"))
+    assert is_transient_error(exceptions.Timeout("operation timed out"))
+    assert not is_transient_error(exceptions.HTTPError("404 Client Error"))
@@ -0,0 +1,24 @@
+import instrumentation
+from instrumentation import Registry, increment, record, span
+
+
+def test_helpers_record_into_the_registry():
+    registry = Registry()
+    record("script_run", 0.5, registry=registry, step="input")
+    with span("render", registry=registry):
+        pass
+    increment("requests", registry=registry, result="hit")
+    spans = registry.spans()
+    assert set(spans["Span"]) == {"script_run", "render"}
+    assert registry.counters()["Valore"].tolist() == [1]
+
+
+def test_disabled_instrumentation_records_nothing(monkeypatch):
+    monkeypatch.setattr(instrumentation, "ENABLED", False)
+    registry = Registry()
+    record("script_run", 0.5, registry=registry, step="input")
+    with span("render", registry=registry):
+        pass
+    increment("requests", registry=registry)
+    assert registry.spans().empty
+    assert registry.counters().empty
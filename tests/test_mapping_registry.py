@@ -0,0 +1,75 @@
+import sqlite3
+
+import pytest
+
+import mapping_registry
+from mapping_registry import MIN_AUTO_CONFIRMATIONS, MappingRegistry
+
+COLUMNS = ["Total Revenue", "Cost Of Revenue", "Net Income"]
+MAPPING = {"Revenue": "Total Revenue", "Total COGS": "Cost Of Revenue", "Net Income": "Net Income"}
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return MappingRegistry(str(tmp_path / "mappings.sqlite"))
+
+
+def test_same_ticker_and_layout_is_automatic(registry):
+    registry.remember("AAPL", COLUMNS, MAPPING)
+    suggestion = registry.suggest("AAPL", COLUMNS)
+    assert suggestion.mapping == MAPPING
+    assert suggestion.automatic
+
+
+def test_other_tickers_need_enough_confirmations(registry):
+    for i in range(MIN_AUTO_CONFIRMATIONS - 1):
+        registry.remember(f"T{i}", COLUMNS, MAPPING)
+    suggestion = registry.suggest("NEW", COLUMNS)
+    assert suggestion.source == "stesso layout di altri ticker"
+    assert suggestion.mapping == MAPPING
+    assert not suggestion.automatic
+
+    registry.remember("LAST", COLUMNS, MAPPING)
+    assert registry.suggest("NEW", COLUMNS).automatic
+
+
+def test_similar_layout_is_never_automatic_with_few_confirmations(registry):
+    registry.remember("AAPL", COLUMNS + ["EPS", "Taxes"], MAPPING)
+    suggestion = registry.suggest("NEW", COLUMNS + ["EPS", "Taxes", "Other"])
+    assert suggestion is not None and suggestion.source == "layout simile"
+    assert not suggestion.automatic
+
+
+def test_repeated_acceptances_by_one_ticker_are_one_confirmation(registry):
+    for _ in range(MIN_AUTO_CONFIRMATIONS):
+        registry.remember("AAPL", COLUMNS, MAPPING)
+    suggestion = registry.suggest("NEW", COLUMNS)
+    assert suggestion.confirmations == 1
+    assert not suggestion.automatic
+
+
+def test_weak_own_mapping_does_not_hide_a_shared_one(registry):
+    registry.remember("AAPL", ["Revenues", "Net Income"], {"Revenue": "Revenues", "Net Income": "Net Income"})
+    for i in range(MIN_AUTO_CONFIRMATIONS + 1):
+        registry.remember(f"T{i}", COLUMNS, MAPPING)
+    suggestion = registry.suggest("AAPL", COLUMNS)
+    assert suggestion.source == "stesso layout di altri ticker"
+    assert suggestion.mapping == MAPPING
+    assert suggestion.automatic
+
+
+def test_connections_are_closed(tmp_path, monkeypatch):
+    opened = []
+    original = sqlite3.connect
+
+    def connect(*args, **kwargs):
+        opened.append(original(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(mapping_registry.sqlite3, "connect", connect)
+    registry = MappingRegistry(str(tmp_path / "mappings.sqlite"))
+    registry.remember("AAPL", COLUMNS, MAPPING)
+    assert registry.suggest("AAPL", COLUMNS).mapping == MAPPING
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
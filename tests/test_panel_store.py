@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+
+from panel_store import PanelStore
+from peers import PEER_METRICS, PeerPanel
+
+
+def analysis(revenue, net_margin):
+    """Analisi minima: due esercizi e la riga TTM."""
+    index = [pd.Timestamp("2023-12-31"), pd.Timestamp("2022-12-31"), "TTM"]
+    return pd.DataFrame({"Revenue": revenue, "Net Margin": net_margin}, index=index, dtype=float)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PanelStore(str(tmp_path / "panel"))
+
+
+def test_empty_store(store):
+    panel = store.load_panel(PEER_METRICS)
+    assert panel.empty
+    assert list(panel.columns) == ["ticker", "fiscal_year", "period", "period_end"] + PEER_METRICS
+    assert store.load_metric("Revenue").empty
+    assert store.tickers() == []
+    assert len(PeerPanel(store)) == 0
+
+
+def test_empty_partition_directories(store, tmp_path):
+    # Directory delle partizioni senza file, come dopo una scrittura fallita
+    (tmp_path / "panel" / "ticker=AAPL" / "fiscal_year=2023").mkdir(parents=True)
+    assert store.load_panel(PEER_METRICS).empty
+    assert len(PeerPanel(store)) == 0
+
+
+def test_load_panel_filters(store):
+    store.append("AAPL", analysis([100.0, 90.0, 110.0], [0.2, 0.1, 0.3]))
+    store.append("MSFT", analysis([200.0, 180.0, 210.0], [0.4, 0.3, 0.5]))
+
+    panel = store.load_panel(["Revenue"])
+    assert len(panel) == 6
+    assert "Net Margin" not in panel.columns
+
+    msft = store.load_panel(["Revenue"], tickers=["MSFT"], fiscal_years=[2023])
+    assert msft["ticker"].tolist() == ["MSFT"]
+    assert msft["Revenue"].tolist() == [200.0]
+    assert store.tickers() == ["AAPL", "MSFT"]
+
+
+def test_load_metric_pivot(store):
+    store.append("AAPL", analysis([100.0, 90.0, 110.0], [0.2, 0.1, 0.3]))
+    metric = store.load_metric("Net Margin")
+    assert metric.loc["AAPL", "TTM"] == 0.3
+    assert metric.loc["AAPL", "2022-12-31"] == 0.1
+
+
+def test_append_replaces_partitions(store):
+    store.append("AAPL", analysis([100.0, 90.0, 110.0], [0.2, 0.1, 0.3]))
+    store.append("AAPL", analysis([150.0, 90.0, 160.0], [0.2, 0.1, 0.3]))
+    revenue = store.load_panel(["Revenue"], tickers=["AAPL"]).set_index("period")["Revenue"]
+    assert revenue.to_dict() == {"2023-12-31": 150.0, "2022-12-31": 90.0, "TTM": 160.0}
+
+
+def test_append_rejects_invalid_ticker(store):
+    with pytest.raises(ValueError):
+        store.append("../x", analysis([1.0, 1.0, 1.0], [0.1, 0.1, 0.1]))
@@ -0,0 +1,59 @@
+import pandas as pd
+
+from peers import MIN_PEERS, PEER_METRICS, PeerPanel
+
+
+class BrokenStore:
+    def load_panel(self, metrics, tickers=None):
+        raise OSError("archivio non leggibile")
+
+
+class StoredPanel:
+    def __init__(self, panel):
+        self.panel = panel
+
+    def load_panel(self, metrics, tickers=None):
+        return self.panel
+
+
+def analysis(gross_margin):
+    return pd.DataFrame({"Gross Margin": [gross_margin]}, index=["TTM"])
+
+
+def test_store_errors_leave_an_empty_panel():
+    panel = PeerPanel(BrokenStore())
+    assert len(panel) == 0
+    panel.refresh(["AAPL"])
+    assert len(panel) == 0
+
+
+def test_update_errors_are_not_raised():
+    panel = PeerPanel()
+    panel.update("AAPL", None)
+    assert len(panel) == 0
+
+
+def test_compare_with_peers():
+    panel = PeerPanel(info_lookup=lambda ticker: {"sector": "Tech", "industry": ticker})
+    for ticker, margin in zip("ABC", [10.0, 20.0, 30.0]):
+        panel.update(ticker, analysis(margin))
+    table, groups = panel.compare("C")
+    assert groups == {"sector": ("Tech", MIN_PEERS), "industry": ("C", 1)}
+    assert table.loc["Gross Margin", "Mediana settore"] == 20.0
+    assert table.loc["Gross Margin", "Percentile settore"] == 100.0
+    assert table["Mediana industria"].isna().all()
+
+
+def test_refresh_takes_the_whole_ttm_row():
+    ttm = pd.DataFrame({metric: [10.0] for metric in PEER_METRICS}, index=["TTM"])
+    ttm["Revenue Y/Y"] = float("nan")
+    stored = pd.concat([ttm.assign(**{metric: 5.0 for metric in PEER_METRICS}), ttm])
+    stored = stored.assign(ticker="AAPL", period=["2024-09-30", "TTM"],
+                           period_end=pd.to_datetime(["2024-09-30", "2025-06-30"]))
+    refreshed = PeerPanel(StoredPanel(stored))
+    updated = PeerPanel()
+    updated.update("AAPL", ttm)
+    row = refreshed._panel.loc["AAPL", PEER_METRICS]
+    assert row["Gross Margin"] == 10.0
+    assert pd.isna(row["Revenue Y/Y"])
+    assert row.astype(float).equals(updated._panel.loc["AAPL", PEER_METRICS].astype(float))
@@ -0,0 +1,44 @@
+import sqlite3
+
+import pytest
+
+import statement_cache
+from statement_cache import StatementCache
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    opened = []
+    original = sqlite3.connect
+
+    def connect(*args, **kwargs):
+        conn = original(*args, **kwargs)
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(statement_cache.sqlite3, "connect", connect)
+    return opened
+
+
+def is_closed(conn):
+    try:
+        conn.execute("SELECT 1")
+    except sqlite3.ProgrammingError:
+        return True
+    return False
+
+
+def test_connections_are_closed(tmp_path, connections):
+    cache = StatementCache(str(tmp_path / "statements.sqlite"))
+    cache.put("AAPL", "info", {"longName": "Apple"})
+    value, _ = cache.get("AAPL", "info")
+    cache.record_request("AAPL")
+    assert value == {"longName": "Apple"}
+    assert cache.most_requested(5) == ["AAPL"]
+    assert connections and all(is_closed(conn) for conn in connections)
+
+
+def test_writes_are_committed_before_closing(tmp_path):
+    path = str(tmp_path / "statements.sqlite")
+    StatementCache(path).put("AAPL", "info", {"longName": "Apple"})
+    assert StatementCache(path).get("AAPL", "info")[0] == {"longName": "Apple"}